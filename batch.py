@@ -0,0 +1,187 @@
+import argparse
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+import io
+from itertools import islice
+import os
+import sys
+from cli import add_grammar_arguments, parse_specials, read_rules
+from grammar import CFGException, Grammar
+from lexer import Lexer, Token
+from parser import LR1Parser, ParseErrors, ParseException, ParseSession, resolve_shift
+from tables import ParseTables, TableCache
+from typing import Deque, Dict, Iterable, Iterator, List, Sequence, Tuple, Union
+
+
+class FileResult:
+    """
+    The outcome of parsing one file with parse_many().
+    """
+
+    __slots__ = ("__path", "__tokens", "__error")
+
+    def __init__(self, path: str, tokens: int, error: Union[str, None]):
+        """
+        :param path: The file that was parsed.
+        :param tokens: How many tokens were read before the parse finished or failed.
+        :param error: Why the file was rejected, or None if it was accepted.
+        """
+        self.__path = path
+        self.__tokens = tokens
+        self.__error = error
+
+    def path(self) -> str:
+        return self.__path
+
+    def tokens(self) -> int:
+        return self.__tokens
+
+    def error(self) -> Union[str, None]:
+        return self.__error
+
+    def ok(self) -> bool:
+        return self.__error is None
+
+    def __str__(self) -> str:
+        return self.__path + ": " + ("ok" if self.__error is None else self.__error)
+
+
+# what each worker process parses with, set up once by _init_worker()
+_worker: Union[Tuple[Lexer, ParseTables, Union[Sequence[str], None]], None] = None
+
+
+def _init_worker(rules: Sequence[Tuple[str, Tuple[str, ...]]], spcl: Dict[str, str], blob: bytes, fingerprint: str, sync: Union[Sequence[str], None]) -> None:
+    """
+    Runs once in each worker process.
+    The grammar arrives as (non-terminal, production) tuples, which keep terminals with spaces in them intact.
+    The tables arrive as the bytes written by ParseTables.dump() and are loaded as views into them, so they are never rebuilt.
+    """
+    global _worker
+    _worker = (Lexer(Grammar(rules), spcl), ParseTables.load(blob, fingerprint), sync)
+
+
+def _parse_files(paths: Sequence[str]) -> List[FileResult]:
+    """
+    Lexes and parses a batch of files with the tables of the current worker.
+    """
+    lexer, tables, sync = _worker
+    return [parse_file(lexer, tables, path, sync) for path in paths]
+
+
+def parse_file(lexer: Lexer, tables: ParseTables, path: str, sync: Sequence[str] = None) -> FileResult:
+    """
+    Lexes and parses one file, catching anything that goes wrong with it.
+
+    :param lexer: The lexer for the grammar.
+    :param tables: The tables of the parser.
+    :param path: The file to read. It is streamed in binary, so positions are byte offsets, and the specials have to work on bytes. See Lexer.scan().
+    :param sync: The terminals to resynchronize on after a syntax error, so every error in the file is reported. See ParseSession.
+    :returns: The result. Lex, parse and I/O errors are reported in it instead of being raised.
+    """
+    count = 0
+    last: Union[Token, None] = None
+    ended = False
+
+    def counted(tokens: Iterable[Token]) -> Iterator[Token]:
+        nonlocal count, last
+        for t in tokens:
+            count += 1
+            last = t
+            yield t
+
+    try:
+        with open(path, "rb") as f:
+            session = ParseSession(tables, "recognize", sync=sync)
+            session.feed(counted(lexer.stream(f)))
+            ended = True
+            session.finish()
+    except ParseErrors as e:
+        return FileResult(path, count, str(e).replace("\n", "; "))
+    except ParseException as e:
+        where = " at end of input" if ended or last is None else " at line " + str(last.line()) + ", column " + str(last.col())
+        return FileResult(path, count, str(e) + where)
+    except (CFGException, OSError, UnicodeDecodeError) as e:
+        return FileResult(path, count, str(e))
+    return FileResult(path, count, None)
+
+
+def parse_many(parser: LR1Parser, paths: Iterable[str], spcl: Dict[str, str] = None, workers: int = None, chunksize: int = 16,
+               sync: Sequence[str] = None) -> Iterator[FileResult]:
+    """
+    Parses many files in a pool of worker processes.
+    Each worker is sent the grammar and the tables once when it starts, and only paths and results go back and forth after that.
+
+    :param parser: The parser to run.
+    :param paths: The files to parse.
+    :param spcl: Special rules to lex with. See Grammar.lex().
+    :param workers: How many processes to use. Defaults to the number of CPUs. With 1, the files are parsed in this process.
+    :param chunksize: How many paths are sent to a worker at a time.
+    Only a few batches per worker are read ahead of the results, so paths can be a stream like stdin.
+    :param sync: If given, errors are recovered from on these terminals, and each result reports every error in its file.
+    :returns: An iterator of results in the same order as paths, produced as soon as each one and all before it are done.
+    """
+
+    # cannot have mutable default arguments
+    if spcl is None:
+        spcl = {}
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    if workers <= 1:
+        lexer = Lexer(parser.grammar(), spcl)
+        for path in paths:
+            yield parse_file(lexer, parser.tables(), path, sync)
+        return
+
+    buf = io.BytesIO()
+    parser.tables().dump(buf, parser.fingerprint())
+    rules = [(nt, tuple(prod)) for nt, prod in parser.grammar()]
+    initargs = (rules, spcl, buf.getvalue(), parser.fingerprint(), None if sync is None else tuple(sync))
+    it = iter(paths)
+    pending: Deque[Future] = deque()
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=initargs) as pool:
+        while True:
+            # keep every worker busy without reading all of the paths up front
+            while len(pending) < workers * 2:
+                batch = list(islice(it, chunksize))
+                if len(batch) == 0:
+                    break
+                pending.append(pool.submit(_parse_files, batch))
+            if len(pending) == 0:
+                return
+            yield from pending.popleft().result()
+
+
+def main(argv: Sequence[str] = None) -> int:
+    """
+    Command line entry point. Prints one line per file and returns 1 if any file was rejected.
+    """
+    ap = argparse.ArgumentParser(description="Parse many files with a grammar.")
+    add_grammar_arguments(ap)
+    ap.add_argument("paths", nargs="*", help="the files to parse; read from stdin, one per line, if none are given")
+    ap.add_argument("-j", "--jobs", type=int, default=None, help="worker processes, defaults to the number of CPUs")
+    ap.add_argument("-c", "--cache", default=None, metavar="DIR", help="directory to cache the parse tables in")
+    ap.add_argument("-r", "--sync", action="append", default=None, metavar="TERMINAL",
+                    help="recover from syntax errors at this terminal to report all of them; can be repeated")
+    ap.add_argument("-q", "--quiet", action="store_true", help="only print the files that were rejected")
+    args = ap.parse_args(argv)
+
+    rules = read_rules(args.grammar)
+    spcl = parse_specials(ap, args.special)
+
+    paths: Iterable[str] = args.paths if len(args.paths) > 0 else (x.rstrip("\n") for x in sys.stdin if x.strip() != "")
+    cache = TableCache(args.cache) if args.cache is not None else None
+    parser = LR1Parser(Grammar(rules), resolve_shift, cache, args.mode)
+
+    failed = 0
+    for result in parse_many(parser, paths, spcl, args.jobs, sync=args.sync):
+        if not result.ok():
+            failed += 1
+        if not result.ok() or not args.quiet:
+            print(result)
+    return 1 if failed > 0 else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
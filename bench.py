@@ -0,0 +1,298 @@
+import argparse
+import json
+import platform
+import re
+import sys
+import time
+import tracemalloc
+from grammar import CFGException, Grammar
+from lexer import Lexer
+from parser import Item, ItemCores, ItemSet, LR1Parser, compile_tables, resolve_shift
+from main import CMINUS_RULES, CMINUS_SOURCE, CMINUS_SPECIALS
+from normalize import augment
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple, Union
+
+
+def reference_lex(grammar: Grammar, ip: Iterable[str], spcl: Dict[str, str]) -> Sequence[Tuple[str, str]]:
+    """
+    The original Grammar.lex, which tries every terminal and every special at every token.
+    Kept as the baseline the compiled Lexer is measured against.
+    """
+
+    spcl = {x: re.compile(spcl[x]) for x in spcl}
+    terms = set(grammar.terminals()) - set(spcl)
+
+    ret: List[Tuple[str, str]] = []
+    for line in ip:
+        line = line.strip()
+        while line != "":
+            longest: Tuple[str, str] = ("", "")
+            for s in terms:
+                if line.startswith(s):
+                    longest = (s, s) if len(s) > len(longest[1]) else longest
+            for name in spcl:
+                r = spcl[name].match(line, 0)
+                if r is not None:
+                    longest = (name, r[0]) if len(r[0]) > len(longest[1]) else longest
+            if longest[0] == "":
+                raise CFGException("Invalid token starting with \"" + line + "\"")
+            ret.append(longest)
+            line = line[len(longest[1]):].strip()
+    return ret
+
+
+def best_of(fn: Callable[[], object], repeat: int = 5) -> float:
+    """
+    Runs a function several times and returns the fastest wall clock time in seconds.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def keyword_rules(n: int) -> Tuple[List[str], List[str]]:
+    """
+    Builds the rules of a grammar with n keyword terminals and some input that uses all of them.
+    """
+    keywords = ["kw" + str(i) for i in range(n)]
+    line = " ".join(keywords[i % n] + " id" for i in range(64))
+    return ["S -> S W | W", "W -> " + " | ".join(keywords) + " | ID"], [line] * 64
+
+
+def keyword_grammar(n: int) -> Tuple[Grammar, List[str]]:
+    """
+    Builds a grammar with n keyword terminals and some input that uses all of them.
+    """
+    rules, src = keyword_rules(n)
+    return Grammar(rules), src
+
+
+EXPRESSION_RULES = [
+    "E -> E + T | T",
+    "T -> T x F | F",
+    "F -> ( E ) | id",
+]
+
+
+def expression_source(terms: int) -> List[str]:
+    """
+    Builds input for EXPRESSION_RULES with about terms ids in it, eight to a line.
+    """
+    words = []
+    for i in range(terms):
+        if i > 0:
+            words.append("+x"[i % 2])
+        words.append("( id x id )" if i % 3 == 0 else "id")
+    return [" ".join(words[i:i + 16]) for i in range(0, len(words), 16)]
+
+
+def precedence_rules(n: int, terms: int) -> Tuple[List[str], List[str]]:
+    """
+    Builds the rules of an expression grammar with n levels of binary operators, and input with about terms ids that uses all of them.
+    Each level adds a few states, so this scales the size of the tables without changing their shape.
+    """
+    rules = ["E%d -> E%d op%d E%d | E%d" % (i, i, i, i + 1, i + 1) for i in range(n)]
+    rules.append("E%d -> ( E0 ) | id" % n)
+    words = []
+    for i in range(terms):
+        if i > 0:
+            words.append("op%d" % (i % n))
+        words.append("( id op%d id )" % (i * 7 % n) if i % 5 == 0 else "id")
+    return rules, [" ".join(words[i:i + 16]) for i in range(0, len(words), 16)]
+
+
+def bench_lex() -> None:
+    g = Grammar(CMINUS_RULES)
+    src = CMINUS_SOURCE * 200
+    lexer = Lexer(g, CMINUS_SPECIALS)
+    ntok = len(lexer.lex(src))
+    assert lexer.lex(src) == reference_lex(g, src, CMINUS_SPECIALS)
+
+    old = best_of(lambda: reference_lex(g, src, CMINUS_SPECIALS))
+    new = best_of(lambda: lexer.lex(src))
+    print("c-minus: %d tokens, reference %.0f tok/s, Lexer %.0f tok/s (%.1fx)" % (ntok, ntok / old, ntok / new, old / new))
+
+    for n in (10, 100, 1000):
+        g, src = keyword_grammar(n)
+        lexer = Lexer(g, {"ID": "[a-z]+"})
+        ntok = len(lexer.lex(src))
+        old = best_of(lambda: reference_lex(g, src, {"ID": "[a-z]+"}), 3)
+        new = best_of(lambda: lexer.lex(src), 3)
+        print("%d keywords: %d tokens, reference %.0f tok/s, Lexer %.0f tok/s (%.1fx)" % (n, ntok, ntok / old, ntok / new, old / new))
+
+
+def bench_long_line() -> None:
+    g = Grammar(CMINUS_RULES)
+    lexer = Lexer(g, CMINUS_SPECIALS)
+    for n in (100, 400, 1600):
+        # minified input: the whole program on one line
+        src = " ".join(CMINUS_SOURCE * n)
+        ntok = sum(1 for _ in lexer.scan(src))
+        old = best_of(lambda: reference_lex(g, [src], CMINUS_SPECIALS), 1)
+        new = best_of(lambda: sum(1 for _ in lexer.scan(src)), 3)
+        print("one line of %d chars: %d tokens, reference %.0f tok/s, Lexer.scan %.0f tok/s (%.1fx)" % (len(src), ntok, ntok / old, ntok / new, old / new))
+
+
+def bench_states() -> None:
+    grammars = {
+        "c-minus": Grammar(CMINUS_RULES),
+        "lalr-conflict": Grammar(["S -> a A d | b B d | a B e | b A e", "A -> c", "B -> c"]),
+        "expression": Grammar(["E -> E + T | T", "T -> T x F | F", "F -> ( E ) | id"]),
+    }
+    for name, g in grammars.items():
+        row = []
+        for mode in ("lr1", "lalr", "minimal"):
+            start = time.perf_counter()
+            p = LR1Parser(g, resolve_shift, mode=mode)
+            elapsed = time.perf_counter() - start
+            row.append("%s %d states %.0f ms" % (mode, p.tables().num_states(), elapsed * 1000))
+        print(name + ": " + ", ".join(row))
+
+
+def suite(quick: bool = False) -> List[Tuple[str, List[str], Dict[str, str], List[str]]]:
+    """
+    Returns the grammars the suite measures, as (name, rules, specials, input lines).
+    Everything is generated the same way every time, so results from different commits can be compared.
+
+    :param quick: Use smaller grammars and inputs.
+    """
+    scale = 1 if quick else 10
+    cases = [
+        ("c-minus", CMINUS_RULES, CMINUS_SPECIALS, CMINUS_SOURCE * 20 * scale),
+        ("expression", EXPRESSION_RULES, {}, expression_source(500 * scale)),
+    ]
+    for n in ((4, 16) if quick else (4, 16, 48)):
+        rules, src = precedence_rules(n, 500 * scale)
+        cases.append(("precedence-" + str(n), rules, {}, src))
+    for n in ((10, 100) if quick else (10, 100, 1000)):
+        rules, src = keyword_rules(n)
+        cases.append(("keywords-" + str(n), rules, {"ID": "[a-z]+"}, src * scale))
+    return cases
+
+
+def measure(rules: Sequence[str], spcl: Dict[str, str], src: Sequence[str], repeat: int = 3) -> Dict[str, Union[int, float]]:
+    """
+    Measures each stage of building and running a parser for one grammar.
+    Times are the fastest of repeat runs, in milliseconds. Every stage is timed on fresh objects, so nothing is cached from an earlier run.
+
+    :returns: A dictionary of the measurements.
+    """
+
+    def fastest(setup: Callable[[], object], fn: Callable[[object], object]) -> float:
+        best = float("inf")
+        for _ in range(repeat):
+            arg = setup()
+            start = time.perf_counter()
+            fn(arg)
+            best = min(best, time.perf_counter() - start)
+        return best * 1000
+
+    def augmented() -> Grammar:
+        # the same grammar LR1Parser builds its states from
+        return augment(Grammar(rules))
+
+    def generate(g: Grammar) -> Sequence[ItemSet]:
+        cores = ItemCores(g)
+        start = g.nonterms()[0]
+        item = Item(cores, cores.core(start, tuple(g[start])[0], 0), cores.bits().bit("$"))
+        return ItemSet.generate(item.closure(), g, resolve_shift)
+
+    ret: Dict[str, Union[int, float]] = {}
+    grammar = Grammar(rules)
+    ret["productions"] = sum(1 for _ in grammar)
+    ret["nonterms"] = len(grammar.nonterms())
+    ret["terminals"] = len(grammar.terminals() - {"#"})
+    ret["grammar_ms"] = fastest(lambda: None, lambda _: Grammar(rules))
+    ret["first_follow_ms"] = fastest(lambda: Grammar(rules), lambda g: (g.first_sets(), g.follow_sets()))
+    ret["generate_ms"] = fastest(augmented, generate)
+    aug = augmented()
+    sets = generate(aug)
+    ret["tables_ms"] = fastest(lambda: None, lambda _: compile_tables(sets, aug, aug.start()))
+    ret["parser_ms"] = fastest(lambda: None, lambda _: LR1Parser(Grammar(rules), resolve_shift))
+
+    tracemalloc.start()
+    parser = LR1Parser(Grammar(rules), resolve_shift)
+    ret["peak_kb"] = tracemalloc.get_traced_memory()[1] // 1024
+    tracemalloc.stop()
+    ret["states"] = parser.tables().num_states()
+
+    lexer = Lexer(parser.grammar(), spcl)
+    tokens = lexer.lex(src)
+    n = len(tokens)
+    ret["tokens"] = n
+    ret["lex_tok_s"] = n / fastest(lambda: None, lambda _: lexer.lex(src)) * 1000
+    ret["parse_tok_s"] = n / fastest(lambda: None, lambda _: parser.parse(tokens)) * 1000
+    ret["recognize_tok_s"] = n / fastest(lambda: None, lambda _: parser.parse(tokens, "recognize")) * 1000
+    return ret
+
+
+def run_suite(quick: bool = False, repeat: int = 3, out: Callable[[str], None] = print) -> Dict[str, object]:
+    """
+    Measures every grammar in suite().
+
+    :param quick: Use smaller grammars and inputs.
+    :param repeat: How many times each stage is run.
+    :param out: Where a line per grammar is written as it finishes.
+    :returns: The results, ready to be written as JSON: {"meta": {...}, "results": {name: measurements}}
+    """
+    results = {}
+    for name, rules, spcl, src in suite(quick):
+        m = measure(rules, spcl, src, repeat)
+        results[name] = m
+        out("%-16s %5d states %9.1f ms build %8.0f kB %10.0f lex tok/s %10.0f parse tok/s" % (
+            name, m["states"], m["parser_ms"], m["peak_kb"], m["lex_tok_s"], m["parse_tok_s"]))
+    meta = {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "machine": platform.machine(),
+        "system": platform.system(),
+        "quick": quick,
+        "repeat": repeat,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    return {"meta": meta, "results": results}
+
+
+def compare(base: Dict[str, object], new: Dict[str, object], out: Callable[[str], None] = print) -> None:
+    """
+    Prints how each measurement changed between two results of run_suite().
+    The ratio is new / base, so it is below 1 when a time got faster and above 1 when a throughput did.
+    """
+    for name, m in new["results"].items():
+        if name not in base["results"]:
+            continue
+        old = base["results"][name]
+        for key, value in m.items():
+            if key in old and old[key] != 0:
+                out("%-16s %-16s %12.1f %12.1f %6.2fx" % (name, key, old[key], value, value / old[key]))
+
+
+def main(argv: Sequence[str] = None) -> int:
+    ap = argparse.ArgumentParser(description="Benchmark building parsers and parsing with them.")
+    ap.add_argument("-o", "--json", metavar="FILE", help="write the results to FILE as JSON")
+    ap.add_argument("-b", "--baseline", metavar="FILE", help="compare the results to JSON written by an earlier run")
+    ap.add_argument("-q", "--quick", action="store_true", help="use smaller grammars and inputs")
+    ap.add_argument("-r", "--repeat", type=int, default=3, help="how many times each stage is run, keeping the fastest")
+    ap.add_argument("-x", "--extra", action="store_true", help="also compare the lexer to the original one and the construction modes")
+    args = ap.parse_args(argv)
+
+    if args.extra:
+        bench_lex()
+        bench_long_line()
+        bench_states()
+
+    results = run_suite(args.quick, args.repeat)
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            compare(json.load(f), results)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
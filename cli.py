@@ -0,0 +1,33 @@
+import argparse
+from typing import Dict, List, Sequence
+
+
+def add_grammar_arguments(ap: argparse.ArgumentParser) -> None:
+    """
+    Adds the arguments every command line that builds a parser takes: the rule file, the specials and the construction mode.
+    """
+    ap.add_argument("grammar", help="a file with one rule per line, like \"S -> a S | #\"")
+    ap.add_argument("-s", "--special", action="append", default=[], metavar="NAME=REGEX", help="lex a terminal with a regex")
+    ap.add_argument("-m", "--mode", default="lr1", choices=("lr1", "lalr", "minimal"), help="how the parser states are built")
+
+
+def read_rules(path: str) -> List[str]:
+    """
+    Reads a rule file, one rule per line. Blank lines are skipped.
+    """
+    with open(path) as f:
+        return [x.strip() for x in f if x.strip() != ""]
+
+
+def parse_specials(ap: argparse.ArgumentParser, specials: Sequence[str]) -> Dict[str, str]:
+    """
+    Turns NAME=REGEX arguments into the specials to lex with.
+    Exits through the argument parser if one has no "=".
+    """
+    spcl: Dict[str, str] = {}
+    for s in specials:
+        if "=" not in s:
+            ap.error("special \"" + s + "\" is not NAME=REGEX")
+        name, regex = s.split("=", 1)
+        spcl[name] = regex
+    return spcl
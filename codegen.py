@@ -0,0 +1,271 @@
+import argparse
+from array import array
+import sys
+import zlib
+from cli import add_grammar_arguments, parse_specials, read_rules
+from grammar import Grammar
+from lexer import Lexer
+from parser import LR1Parser, resolve_shift
+from typing import Dict, List, Sequence
+
+
+# everything a generated module runs, after its constants
+_RUNTIME = r'''
+
+class ParseError(Exception):
+    pass
+
+
+class Node:
+    """
+    A node of the parse tree. Terminals have the text they were lexed from as their value, and no children.
+    """
+
+    __slots__ = ("symbol", "children", "value")
+
+    def __init__(self, symbol, children, value=None):
+        self.symbol = symbol
+        self.children = children
+        self.value = value
+
+    def __eq__(self, other):
+        if not isinstance(other, Node):
+            return False
+        return self.symbol == other.symbol and self.value == other.value and self.children == other.children
+
+    def __repr__(self):
+        if len(self.children) == 0:
+            return "Node(%r, %r)" % (self.symbol, self.value)
+        return "Node(%r, [%s])" % (self.symbol, ", ".join(repr(x) for x in self.children))
+
+
+def _table(data):
+    ret = array("i")
+    ret.frombytes(zlib.decompress(data))
+    if sys.byteorder != "little":
+        ret.byteswap()
+    return ret
+
+
+ACTION = _table(_ACTION)
+GOTO = _table(_GOTO)
+EPSILON = _table(_EPSILON)
+TERM_IDS = {x: i for i, x in enumerate(TERMINALS)}
+PROD_LHS = tuple(NONTERMS.index(nt) for nt, _ in PRODUCTIONS)
+PROD_LEN = tuple(len(prod) for _, prod in PRODUCTIONS)
+
+_MASTER = re.compile(PATTERN)
+_GROUPS = ((_MASTER.groupindex["_l"], ""),) + tuple((_MASTER.groupindex["_s" + str(i)], x) for i, x in enumerate(SPECIALS))
+_NL = re.compile(r"[^\S\n]*\n")
+_WS = re.compile(r"[^\S\n]*")
+
+
+def lex(text):
+    """
+    Splits a string into tokens. The longest match wins, and on a tie a literal beats a special.
+
+    :returns: [(terminal, raw token, line, column)...]
+    :raise ParseError: The text contains something that does not match any terminal.
+    """
+    ret = []
+    pos = 0
+    line = 1
+    line_start = 0
+    n = len(text)
+    while True:
+        # skip whitespace, counting each line we pass
+        m = _NL.match(text, pos)
+        while m is not None:
+            line += 1
+            pos = line_start = m.end()
+            m = _NL.match(text, pos)
+        pos = _WS.match(text, pos).end()
+        if pos >= n:
+            return ret
+
+        m = _MASTER.match(text, pos)
+        best = pos
+        term = ""
+        for ind, name in _GROUPS:
+            end = m.end(ind)
+            if end > best:
+                best = end
+                term = name
+        if best == pos:
+            raise ParseError("Invalid token at line %d, column %d starting with \"%s\"" % (line, pos - line_start, text[pos:pos + 32].split("\n")[0]))
+        raw = text[pos:best]
+        ret.append((term if term != "" else raw, raw, line, pos - line_start))
+        # a special can match across lines
+        if term != "" and "\n" in raw:
+            line += raw.count("\n")
+            line_start = pos + raw.rindex("\n") + 1
+        pos = best
+
+
+def parse(arg, tree=True):
+    """
+    Parses a whole input.
+
+    :param arg: A string to lex, or (terminal, raw token) tuples like lex() produces.
+    :param tree: True to build a tree of Nodes, False to only check the input.
+    :returns: The root Node, or True if tree is False.
+    :raise ParseError: The input is not in the language.
+    """
+    if isinstance(arg, str):
+        arg = lex(arg)
+    action = ACTION
+    goto = GOTO
+    epsilon = EPSILON
+    prod_lhs = PROD_LHS
+    prod_len = PROD_LEN
+    nt = len(TERMINALS)
+    nn = len(NONTERMS)
+
+    states = [0]
+    values = []
+    for tok in _ended(arg):
+        look = tok[0]
+        t = TERM_IDS.get(look, -1)
+        # (state, stack depth) of each "#" shifted for this token whose state is still on the stack
+        looping = []
+        while True:
+            state = states[-1]
+            a = action[state * nt + t] if t >= 0 else 0
+
+            # shift the lookahead symbol and push the new state
+            if a > 0:
+                if tree:
+                    values.append(Node(look, (), tok[1]))
+                states.append(a - 1)
+                break
+
+            # reduce: pop the right hand side and push the non-terminal it produces
+            elif a < 0:
+                p = -a - 1
+                if p == 0:
+                    if look != "$":
+                        raise ParseError(_error(state, tok))
+                    return values[0] if tree else True
+                n = prod_len[p]
+                del states[len(states) - n:]
+                while looping and looping[-1][1] > len(states):
+                    looping.pop()
+                lhs = prod_lhs[p]
+                if tree:
+                    children = tuple(values[len(values) - n:])
+                    del values[len(values) - n:]
+                    values.append(Node(NONTERMS[lhs], children))
+                states.append(goto[states[-1] * nn + lhs])
+
+            # otherwise try shifting on epsilon
+            elif epsilon[state] >= 0:
+                # shifting "#" in a state that is still on the stack from the last time would repeat forever
+                if any(x[0] == state for x in looping):
+                    raise ParseError(_error(state, tok))
+                looping.append((state, len(states)))
+                if tree:
+                    values.append(Node("#", (), ""))
+                states.append(epsilon[state])
+
+            else:
+                raise ParseError(_error(state, tok))
+
+
+def _ended(tokens):
+    yield from tokens
+    yield ("$", "")
+
+
+def _error(state, tok):
+    where = " at line %d, column %d" % (tok[2], tok[3]) if len(tok) >= 4 else ""
+    return "No transition defined at state %d for symbol %s%s" % (state, tok[0], where)
+'''
+
+
+def _literal(name: str, values: Sequence[int]) -> List[str]:
+    """
+    Writes a table as an assignment of its zlib compressed little-endian bytes, split over lines.
+    """
+    arr = array("i", values)
+    if sys.byteorder != "little":
+        arr.byteswap()
+    data = zlib.compress(arr.tobytes(), 9)
+    lines = [name + " = ("]
+    for i in range(0, len(data), 48):
+        lines.append("    " + repr(data[i:i + 48]))
+    lines.append(")")
+    return lines
+
+
+def generate(parser: LR1Parser, spcl: Dict[str, str] = None) -> str:
+    """
+    Writes a Python module that lexes and parses the language of a parser without this package.
+    The module holds the tables as constants, the lexer's compiled pattern and a minimal parse loop,
+    so importing it only decompresses the tables and compiles one regex.
+
+    The module exposes lex(text), parse(text or tokens, tree=True), ParseError and Node,
+    along with the tables in the same layout as ParseTables.
+
+    :param parser: The parser to write out.
+    :param spcl: Special rules to lex with. See Grammar.lex().
+    :returns: The source of the module.
+    """
+    if array("i").itemsize != 4:
+        raise ValueError("Tables can only be written where array(\"i\") holds 32-bit ints")
+
+    # cannot have mutable default arguments
+    if spcl is None:
+        spcl = {}
+
+    tables = parser.tables()
+    tables.complete()
+    lexer = Lexer(parser.grammar(), spcl)
+    # the grammar goes in comments, since a terminal can hold backslashes or quotes that would break a string literal
+    lines = ["# Parser generated by codegen.py from the following grammar. Do not edit.", "#"]
+    lines += ["#     " + x for x in str(parser.grammar()).split("\n")]
+    lines += ['"""', "Parser generated by codegen.py. Do not edit.", '"""']
+    lines += ["import re", "import sys", "import zlib", "from array import array", "", ""]
+    lines.append("TERMINALS = " + repr(tuple(tables.terminals())))
+    lines.append("NONTERMS = " + repr(tuple(tables.nonterms())))
+    lines.append("PRODUCTIONS = (")
+    lines += ["    " + repr(x) + "," for x in tables.productions()]
+    lines.append(")")
+    lines.append("SPECIALS = " + repr(tuple(lexer.specials())))
+    lines.append("PATTERN = " + repr(lexer.pattern()))
+    lines += _literal("_ACTION", tables.action())
+    lines += _literal("_GOTO", tables.goto())
+    lines += _literal("_EPSILON", tables.epsilon())
+    return "\n".join(lines) + "\n" + _RUNTIME
+
+
+def write(parser: LR1Parser, path: str, spcl: Dict[str, str] = None) -> None:
+    """
+    Writes the module generate() produces to a file.
+    """
+    with open(path, "w") as f:
+        f.write(generate(parser, spcl))
+
+
+def main(argv: Sequence[str] = None) -> int:
+    """
+    Command line entry point. Writes the module for a grammar to a file or to stdout.
+    """
+    ap = argparse.ArgumentParser(description="Generate a standalone parser module for a grammar.")
+    add_grammar_arguments(ap)
+    ap.add_argument("-o", "--output", default=None, metavar="FILE", help="where to write the module, defaults to stdout")
+    args = ap.parse_args(argv)
+
+    rules = read_rules(args.grammar)
+    spcl = parse_specials(ap, args.special)
+
+    source = generate(LR1Parser(Grammar(rules), resolve_shift, mode=args.mode), spcl)
+    if args.output is None:
+        sys.stdout.write(source)
+    else:
+        with open(args.output, "w") as f:
+            f.write(source)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
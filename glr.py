@@ -0,0 +1,404 @@
+from itertools import chain
+from grammar import Grammar
+from lexer import Token
+from parser import ItemSet, LR1Parser, ParseException, ParseTreeNode, resolve_shift
+from tables import ParseTables
+from typing import Dict, Iterable, List, Sequence, Set, Tuple, Union
+
+
+class ForestNode:
+    """
+    A node of a shared packed parse forest.
+    It stands for one symbol spanning the tokens from start to end, and is shared by every tree that contains that span.
+    Each family is one way of deriving the symbol, so a node with more than one family is an ambiguity.
+    Terminals and "#" have no families.
+    """
+
+    __slots__ = ("__symbol", "__start", "__end", "__token", "__families")
+
+    def __init__(self, symbol: str, start: int, end: int, token: Union[Tuple[str, str], Token, None] = None):
+        """
+        :param symbol: The symbol.
+        :param start: The index of the first token it spans.
+        :param end: The index one past the last token it spans.
+        :param token: The token, if this is a terminal.
+        """
+        self.__symbol = symbol
+        self.__start = start
+        self.__end = end
+        self.__token = token
+        # used as an ordered set
+        self.__families: Dict[Tuple["ForestNode", ...], None] = {}
+
+    def symbol(self) -> str:
+        return self.__symbol
+
+    def start(self) -> int:
+        return self.__start
+
+    def end(self) -> int:
+        return self.__end
+
+    def token(self) -> Union[Tuple[str, str], Token, None]:
+        return self.__token
+
+    def families(self) -> Sequence[Tuple["ForestNode", ...]]:
+        """
+        Returns the ways this symbol was derived, each as the nodes of a right hand side.
+        """
+        return list(self.__families)
+
+    def add(self, children: Tuple["ForestNode", ...]) -> None:
+        """
+        Adds a derivation. Adding the same one twice does nothing.
+        """
+        self.__families[children] = None
+
+    def ambiguous(self) -> bool:
+        return len(self.__families) > 1
+
+    def count_trees(self) -> int:
+        """
+        Returns how many parse trees the forest under this node packs.
+        Every node is visited once, so this is cheap even when the count is exponential in the length of the input.
+
+        :raise ValueError: The grammar is cyclic and the forest packs infinitely many trees.
+        """
+        counts: Dict[int, int] = {}
+        # the nodes on the path down to the current one
+        path: Set[int] = set()
+        stk: List[Tuple[ForestNode, bool]] = [(self, False)]
+        while len(stk) > 0:
+            node, expanded = stk.pop()
+            if expanded:
+                # a leaf is one tree on its own
+                total = 1 if len(node.__families) == 0 else 0
+                for family in node.__families:
+                    n = 1
+                    for c in family:
+                        n *= counts[id(c)]
+                    total += n
+                counts[id(node)] = total
+                path.discard(id(node))
+            elif id(node) in path:
+                raise ValueError("The forest of " + str(self) + " has infinitely many trees")
+            elif id(node) not in counts:
+                path.add(id(node))
+                stk.append((node, True))
+                stk.extend((c, False) for family in node.__families for c in family)
+        return counts[id(self)]
+
+    def tree(self) -> ParseTreeNode:
+        """
+        Returns one of the trees in the forest, taking the first derivation of every node that does not lead back to itself.
+
+        :raise ValueError: The forest has no finite tree.
+        """
+        done: Dict[int, ParseTreeNode] = {}
+        chosen: Dict[int, Tuple[ForestNode, ...]] = {}
+        # the nodes on the path down to the current one
+        path: Set[int] = set()
+        stk: List[Tuple[ForestNode, bool]] = [(self, False)]
+        while len(stk) > 0:
+            node, expanded = stk.pop()
+            if expanded:
+                done[id(node)] = ParseTreeNode(node.__symbol, [done[id(c)] for c in chosen[id(node)]])
+                path.discard(id(node))
+            elif id(node) not in done:
+                path.add(id(node))
+                family = next((f for f in node.__families if all(id(c) not in path for c in f)), None)
+                if family is None:
+                    if len(node.__families) > 0:
+                        raise ValueError("The forest of " + str(self) + " has no finite tree")
+                    family = ()
+                chosen[id(node)] = family
+                stk.append((node, True))
+                stk.extend((c, False) for c in family)
+        return done[id(self)]
+
+    def __str__(self) -> str:
+        return self.__symbol + "[" + str(self.__start) + ":" + str(self.__end) + "]"
+
+
+class _StackNode:
+    """
+    A node of the graph-structured stack. Each link points to a node below it, along with the forest node of the symbol in between.
+    """
+
+    __slots__ = ("state", "level", "links")
+
+    def __init__(self, state: int, level: int):
+        self.state = state
+        self.level = level
+        self.links: List[Tuple["_StackNode", ForestNode]] = []
+
+
+def glr_conflicts(sets: Sequence[ItemSet], tables: ParseTables) -> Dict[int, Tuple[int, ...]]:
+    """
+    Finds every ACTION entry that has more than one action.
+    The states have to be built with resolve_shift, so every shift is kept, and every reduction is read back out of the items.
+
+    :param sets: The states the tables were compiled from.
+    :param tables: The tables.
+    :returns: A dictionary mapping state * len(terminals) + terminal to all of its actions, encoded like ACTION.
+    0 stands for shifting "#", which does not consume the lookahead.
+    """
+    term_ids = tables.term_ids()
+    nt = len(tables.terminals())
+    prod_ids = {x: i for i, x in enumerate(tables.productions())}
+
+    cells: List[Dict[int, List[int]]] = []
+    for itemset in sets:
+        row: Dict[int, List[int]] = {}
+        for c, (target, _) in itemset.shift().items():
+            if c in term_ids and c != "#":
+                row.setdefault(term_ids[c], []).append(target + 1)
+        for item in itemset:
+            if item.is_reduce():
+                p = prod_ids[(item.nt(), tuple(item.prod()))]
+                for c in item.follow():
+                    acts = row.setdefault(term_ids[c], [])
+                    if -p - 1 not in acts:
+                        acts.append(-p - 1)
+        cells.append(row)
+
+    # the lookaheads each state can act on, counting what it can do after shifting "#"
+    viable = [set(row) for row in cells]
+    changed = True
+    while changed:
+        changed = False
+        for state, itemset in enumerate(sets):
+            if "#" in itemset.shift() and not viable[itemset.shift()["#"][0]] <= viable[state]:
+                viable[state] |= viable[itemset.shift()["#"][0]]
+                changed = True
+
+    ret: Dict[int, Tuple[int, ...]] = {}
+    for state, itemset in enumerate(sets):
+        row = cells[state]
+        if "#" in itemset.shift():
+            # shifting "#" is only worth trying on the lookaheads it can lead to an action on
+            for t in viable[itemset.shift()["#"][0]]:
+                if t in row:
+                    row[t].append(0)
+        for t, acts in row.items():
+            if len(acts) > 1:
+                ret[state * nt + t] = tuple(acts)
+    return ret
+
+
+class GLRParser:
+    """
+    A generalized LR parser. Where the tables have a conflict, it tries every action instead of picking one,
+    keeping the stacks in a graph-structured stack, and returns every parse of the input as a shared packed parse forest.
+    Entries without a conflict are read straight from the ACTION table, the same as LR1Parser.
+    """
+
+    __parser: LR1Parser
+    __conflicts: Dict[int, Tuple[int, ...]]
+
+    def __init__(self, grammar: Grammar, mode: str = "lr1"):
+        """
+        :param grammar: The grammar to parse. It can be ambiguous.
+        :param mode: How the states are built. See ItemSet.generate().
+        """
+        self.__parser = LR1Parser(grammar, resolve_shift, mode=mode)
+        self.__conflicts = glr_conflicts(self.__parser.item_sets(), self.__parser.tables())
+
+    def grammar(self) -> Grammar:
+        return self.__parser.grammar()
+
+    def tables(self) -> ParseTables:
+        return self.__parser.tables()
+
+    def conflicts(self) -> Dict[int, Tuple[int, ...]]:
+        """
+        Returns the ACTION entries that have more than one action. See glr_conflicts().
+        """
+        return self.__conflicts
+
+    def parse(self, arg: Union[str, Iterable[Union[Tuple[str, str], Token]]]) -> ForestNode:
+        """
+        Parses a whole input.
+
+        :param arg: A string to lex, or (terminal, raw token) pairs or Tokens.
+        :returns: The forest node of the start symbol spanning the whole input.
+        :raise ParseException: No parse reaches the end of the input.
+        """
+        if isinstance(arg, str):
+            arg = self.grammar().lex([arg])
+
+        tables = self.__parser.tables()
+        conflicts = self.__conflicts
+        term_ids = tables.term_ids()
+        action = tables.action()
+        goto = tables.goto()
+        epsilon = tables.epsilon()
+        prod_lhs = tables.prod_lhs()
+        prod_len = tables.prod_len()
+        nonterms = tables.nonterms()
+        nt = len(tables.terminals())
+        nn = len(nonterms)
+
+        level = 0
+        # the tops of the stacks, at most one per state
+        frontier: Dict[int, _StackNode] = {0: _StackNode(0, 0)}
+        accepted: Union[ForestNode, None] = None
+
+        # what is being worked on at the current level
+        look = ""
+        t = 0
+        # the non-terminals reduced at this level, shared by every stack that reduced them over the same span
+        symbols: Dict[Tuple[int, int], ForestNode] = {}
+        empty: Union[ForestNode, None] = None
+        shifts: List[Tuple[_StackNode, int]] = []
+        todo: List[_StackNode] = []
+        processed: List[_StackNode] = []
+
+        def actions(node: _StackNode) -> Tuple[int, ...]:
+            cell = node.state * nt + t
+            acts = conflicts.get(cell)
+            if acts is None:
+                a = action[cell]
+                acts = (a,) if a != 0 else (0,) if epsilon[node.state] >= 0 else ()
+            return acts
+
+        def paths(node: _StackNode, n: int, via: Union[Tuple[_StackNode, ForestNode], None]) -> List[Tuple[_StackNode, Tuple[ForestNode, ...]]]:
+            # every way down n links, keeping only the ones through via if it is given
+            ret = []
+            stk = [(node, n, (), via is None)]
+            while len(stk) > 0:
+                node, k, kids, used = stk.pop()
+                if k == 0:
+                    if used:
+                        ret.append((node, kids))
+                    continue
+                for link in node.links:
+                    stk.append((link[0], k - 1, (link[1],) + kids, used or link is via))
+            return ret
+
+        def reduce(node: _StackNode, p: int, via: Union[Tuple[_StackNode, ForestNode], None]) -> None:
+            nonlocal accepted
+            if p == 0:
+                # reducing to the augmented start symbol accepts, but only at the end of the input
+                if look == "$":
+                    for _, kids in paths(node, 1, via):
+                        accepted = kids[0]
+                return
+            lhs = prod_lhs[p]
+            for bottom, kids in paths(node, prod_len[p], via):
+                key = (lhs, bottom.level)
+                if key not in symbols:
+                    symbols[key] = ForestNode(nonterms[lhs], bottom.level, level)
+                symbols[key].add(kids)
+                push(bottom, goto[bottom.state * nn + lhs], symbols[key])
+
+        def push(bottom: _StackNode, state: int, forest: ForestNode) -> None:
+            top = frontier.get(state)
+            if top is None:
+                top = _StackNode(state, level)
+                top.links.append((bottom, forest))
+                frontier[state] = top
+                todo.append(top)
+                return
+            for link in top.links:
+                # the forest node already has the new derivation
+                if link[0] is bottom:
+                    return
+            link = (bottom, forest)
+            top.links.append(link)
+            # stacks that already did their reductions have new paths through this link
+            for node in list(processed):
+                for a in actions(node):
+                    if a < 0 and prod_len[-a - 1] > 0:
+                        reduce(node, -a - 1, link)
+
+        for token in chain(arg, (None,)):
+            look = "$" if token is None else token.terminal() if isinstance(token, Token) else token[0]
+            if look not in term_ids:
+                raise ParseException("No transition defined at token " + str(level) + " for symbol " + str(look))
+            t = term_ids[look]
+            symbols = {}
+            empty = None
+            shifts = []
+            todo = list(frontier.values())
+            processed = []
+
+            # while there is one stack and no conflict, step it the same way LR1Parser would
+            while len(todo) == 1:
+                node = todo[0]
+                cell = node.state * nt + t
+                if cell in conflicts:
+                    break
+                a = action[cell]
+                if a > 0:
+                    shifts.append((node, a - 1))
+                    processed.append(node)
+                    todo.pop()
+                    break
+                elif a < 0:
+                    p = -a - 1
+                    if p == 0:
+                        break
+                    # the stack below has to be a single path
+                    n = prod_len[p]
+                    bottom = node
+                    kids: Tuple[ForestNode, ...] = ()
+                    while n > 0 and len(bottom.links) == 1:
+                        kids = (bottom.links[0][1],) + kids
+                        bottom = bottom.links[0][0]
+                        n -= 1
+                    if n > 0:
+                        break
+                    lhs = prod_lhs[p]
+                    state = goto[bottom.state * nn + lhs]
+                    key = (lhs, bottom.level)
+                    # anything already reduced at this level has to be shared, which the general case takes care of
+                    if state in frontier or key in symbols:
+                        break
+                    forest = ForestNode(nonterms[lhs], bottom.level, level)
+                    forest.add(kids)
+                    symbols[key] = forest
+                elif epsilon[node.state] >= 0:
+                    bottom = node
+                    state = epsilon[node.state]
+                    if state in frontier:
+                        break
+                    if empty is None:
+                        empty = ForestNode("#", level, level)
+                    forest = empty
+                else:
+                    break
+                top = _StackNode(state, level)
+                top.links.append((bottom, forest))
+                frontier[state] = top
+                processed.append(node)
+                todo[0] = top
+
+            while len(todo) > 0:
+                node = todo.pop()
+                processed.append(node)
+                for a in actions(node):
+                    if a > 0:
+                        shifts.append((node, a - 1))
+                    elif a < 0:
+                        reduce(node, -a - 1, None)
+                    else:
+                        # shifting "#" does not consume the lookahead, so it stays on this level
+                        if empty is None:
+                            empty = ForestNode("#", level, level)
+                        push(node, epsilon[node.state], empty)
+
+            if token is None:
+                if accepted is None:
+                    raise ParseException("No transition defined at token " + str(level) + " for symbol $")
+                return accepted
+
+            leaf = ForestNode(look, level, level + 1, token)
+            level += 1
+            frontier = {}
+            for node, state in shifts:
+                if state not in frontier:
+                    frontier[state] = _StackNode(state, level)
+                frontier[state].links.append((node, leaf))
+            if len(frontier) == 0:
+                raise ParseException("No transition defined at token " + str(level - 1) + " for symbol " + str(look))
@@ -1,6 +1,7 @@
 from functools import reduce
-import re
-from typing import Dict, FrozenSet, Iterable, Iterator, List, Sequence, Set, Tuple, Union
+import hashlib
+from types import MappingProxyType
+from typing import Dict, FrozenSet, Iterable, Iterator, List, Mapping, Sequence, Set, Tuple, Union
 
 
 class CFGException(Exception):
@@ -62,6 +63,235 @@ def tokenize(rhs: str) -> Tuple[str]:
         return tuple(ret)
 
 
+def nullable(grammar: "Grammar") -> Set[str]:
+    """
+    Finds every non-terminal that can produce epsilon in time linear in the size of the grammar.
+    Each production counts how many of its tokens are not yet known to vanish,
+    and a non-terminal is marked the moment one of its counts reaches zero.
+
+    :param grammar: The grammar
+    :returns: The non-terminals that can produce epsilon, along with "#"
+    """
+    prods = list(grammar)
+    remaining = [len(prod) for _, prod in prods]
+    # token -> the productions it appears in, once per appearance
+    uses: Dict[str, List[int]] = {}
+    for i, (_, prod) in enumerate(prods):
+        for token in prod:
+            uses.setdefault(token, []).append(i)
+
+    ret = {"#"}
+    work = ["#"]
+    # empty productions vanish right away
+    for i, (nt, prod) in enumerate(prods):
+        if remaining[i] == 0 and nt not in ret:
+            ret.add(nt)
+            work.append(nt)
+    while len(work) > 0:
+        for i in uses.get(work.pop(), []):
+            remaining[i] -= 1
+            nt = prods[i][0]
+            if remaining[i] == 0 and nt not in ret:
+                ret.add(nt)
+                work.append(nt)
+    return ret
+
+
+def digraph(nodes: Iterable[str], edges: Dict[str, Set[str]], init: Dict[str, Set[str]]) -> Dict[str, FrozenSet[str]]:
+    """
+    Computes F(x) = init(x) | the union of F(y) for every y reachable from x, as in DeRemer and Pennello's Digraph.
+    The strongly connected components of the graph are found with Tarjan's algorithm and every node in a component
+    shares one set, so each edge is followed once and each set union happens once per edge.
+
+    :param nodes: The nodes of the graph.
+    :param edges: The nodes each node has an edge to.
+    :param init: The starting set of each node.
+    :returns: F for each node.
+    """
+    depth: Dict[str, int] = {}
+    ret: Dict[str, FrozenSet[str]] = {}
+    work: Dict[str, Set[str]] = {}
+    stack: List[str] = []
+    done = float("inf")
+
+    for root in nodes:
+        if root in depth:
+            continue
+        # the recursion is kept on an explicit stack so large grammars do not overflow the interpreter's
+        frames = [(root, iter(edges[root]), 1 + len(stack))]
+        stack.append(root)
+        depth[root] = len(stack)
+        work[root] = set(init[root])
+        while len(frames) > 0:
+            x, children, d = frames[-1]
+            for y in children:
+                if y not in depth:
+                    stack.append(y)
+                    depth[y] = len(stack)
+                    work[y] = set(init[y])
+                    frames.append((y, iter(edges[y]), depth[y]))
+                    break
+                depth[x] = min(depth[x], depth[y])
+                work[x] |= ret[y] if y in ret else work[y]
+            else:
+                frames.pop()
+                # x is the root of a strongly connected component, so the component's set is complete
+                if depth[x] == d:
+                    result = frozenset(work[x])
+                    while True:
+                        top = stack.pop()
+                        depth[top] = done
+                        ret[top] = result
+                        del work[top]
+                        if top == x:
+                            break
+                if len(frames) > 0:
+                    parent = frames[-1][0]
+                    depth[parent] = min(depth[parent], depth[x])
+                    work[parent] |= ret[x] if x in ret else work[x]
+    return ret
+
+
+class TerminalBits:
+    """
+    Numbers a set of terminals so that any subset of them fits in one int, with bit i standing for terminal i.
+    Union, intersection, difference and hashing of these sets are then single integer operations.
+    """
+
+    __terminals: Sequence[str]
+    __bits: Dict[str, int]
+    __decoded: Dict[int, FrozenSet[str]]
+
+    def __init__(self, terminals: Iterable[str]):
+        """
+        :param terminals: The terminals, in the order their bits are assigned.
+        """
+        self.__terminals = tuple(terminals)
+        self.__bits = {x: 1 << i for i, x in enumerate(self.__terminals)}
+        self.__decoded = {}
+
+    def terminals(self) -> Sequence[str]:
+        return self.__terminals
+
+    def bit(self, terminal: str) -> int:
+        """
+        Returns the mask of a single terminal.
+        """
+        return self.__bits[terminal]
+
+    def encode(self, terminals: Iterable[str]) -> int:
+        """
+        Turns a set of terminals into a mask.
+        """
+        ret = 0
+        for x in terminals:
+            ret |= self.__bits[x]
+        return ret
+
+    def decode(self, mask: int) -> FrozenSet[str]:
+        """
+        Turns a mask back into a set of terminals.
+        """
+        if mask not in self.__decoded:
+            ret = []
+            m = mask
+            while m != 0:
+                low = m & -m
+                ret.append(self.__terminals[low.bit_length() - 1])
+                m ^= low
+            self.__decoded[mask] = frozenset(ret)
+        return self.__decoded[mask]
+
+    def __contains__(self, terminal: str) -> bool:
+        return terminal in self.__bits
+
+    def __len__(self) -> int:
+        return len(self.__terminals)
+
+
+class SymbolTable:
+    """
+    Numbers every symbol of a grammar once, so lookups by symbol or by id are a single dictionary or tuple access.
+    The order is deterministic: the start symbol, the other non-terminals sorted, the terminals sorted, and "#" last if it is used.
+    """
+
+    TERMINAL = "terminal"
+    NONTERM = "nonterm"
+    EPSILON = "epsilon"
+
+    __symbols: Sequence[str]
+    __ids: Dict[str, int]
+    __kinds: Dict[str, str]
+    __nonterms: FrozenSet[str]
+    __terminals: FrozenSet[str]
+
+    def __init__(self, start: str, nonterms: Iterable[str], terminals: Iterable[str]):
+        """
+        :param start: The start symbol.
+        :param nonterms: The non-terminals, including the start symbol.
+        :param terminals: The terminals. "#" is given the epsilon kind.
+        """
+        nonterms = set(nonterms)
+        terminals = set(terminals) - nonterms
+        order = [start] + sorted(nonterms - {start}) + sorted(terminals - {"#"}) + (["#"] if "#" in terminals else [])
+
+        self.__symbols = tuple(order)
+        self.__ids = {x: i for i, x in enumerate(order)}
+        self.__kinds = {x: SymbolTable.NONTERM for x in nonterms}
+        self.__kinds.update({x: SymbolTable.TERMINAL for x in terminals})
+        if "#" in terminals:
+            self.__kinds["#"] = SymbolTable.EPSILON
+        self.__nonterms = frozenset(nonterms)
+        self.__terminals = frozenset(terminals - {"#"})
+
+    def symbols(self) -> Sequence[str]:
+        """
+        Returns every symbol, indexed by id.
+        """
+        return self.__symbols
+
+    def nonterms(self) -> FrozenSet[str]:
+        return self.__nonterms
+
+    def terminals(self) -> FrozenSet[str]:
+        """
+        Returns the terminals, not including "#".
+        """
+        return self.__terminals
+
+    def id(self, symbol: str) -> int:
+        """
+        :raise KeyError: The symbol is not in the grammar.
+        """
+        return self.__ids[symbol]
+
+    def symbol(self, id: int) -> str:
+        return self.__symbols[id]
+
+    def kind(self, symbol: str) -> str:
+        """
+        Returns SymbolTable.TERMINAL, SymbolTable.NONTERM or SymbolTable.EPSILON.
+
+        :raise KeyError: The symbol is not in the grammar.
+        """
+        return self.__kinds[symbol]
+
+    def is_nonterm(self, symbol: str) -> bool:
+        return symbol in self.__nonterms
+
+    def is_terminal(self, symbol: str) -> bool:
+        return symbol in self.__terminals
+
+    def __contains__(self, symbol: str) -> bool:
+        return symbol in self.__ids
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.__symbols)
+
+    def __len__(self) -> int:
+        return len(self.__symbols)
+
+
 class Nonterm:
     __symbol: str = ""
     __productions: FrozenSet[Tuple[str]]
@@ -100,6 +330,11 @@ class Nonterm:
     def __hash__(self):
         return self.__hash
 
+    def __setstate__(self, state):
+        # string hashes differ between processes, so the cached hash is recomputed after unpickling
+        self.__dict__.update(state)
+        self.__hash = hash((self.__symbol, self.__productions))
+
     def __iter__(self) -> Iterator[Tuple[str]]:
         """
         Iterates through the productions in this Nonterm. The order is not guaranteed in any way.
@@ -112,10 +347,19 @@ class Nonterm:
 
 class Grammar:
     __rules: Dict[str, Nonterm] = {}
-    __terminals: Set[str] = set()
-    __ent: Set[str]
+    __terminals: FrozenSet[str] = frozenset()
+    __symbols: SymbolTable
+    __nonterms: Sequence[str]
+    __ent: Union[FrozenSet[str], None]
+    __first: Union[Mapping[str, FrozenSet[str]], None]
+    __follow: Union[Mapping[str, FrozenSet[str]], None]
+    __bits: Union[TerminalBits, None]
+    __first_masks: Union[Mapping[str, int], None]
+    __follow_masks: Union[Mapping[str, int], None]
+    __suffix_firsts: Union[Mapping[Tuple[str, ...], Sequence[Tuple[int, bool]]], None]
     __start: str = ""
     __hash: int
+    __lexers: Dict[Tuple[Tuple[str, str], ...], "Lexer"]
 
     def __init_iter_str(self, cfg: Iterable[str]) -> None:
         """
@@ -160,8 +404,6 @@ class Grammar:
 
         self.__rules = {nt: Nonterm(nt, *vals[nt]) for nt in vals}
 
-        self.__terminals = {x for _, prod in self for x in prod if x not in self.nonterms()}
-
     def __init_tuple(self, cfg: Iterable[Tuple[str, Sequence[str]]]) -> None:
         """
         Constructs a Grammar out of a list of (nonterm, ["a", "b", "c"])
@@ -181,8 +423,6 @@ class Grammar:
 
         self.__rules = {nt: Nonterm(nt, *vals[nt]) for nt in vals}
 
-        self.__terminals = {x for _, prod in self for x in prod if x not in self.nonterms()}
-
     def __init__(self, cfg: Union[Iterable[str], Iterable[Tuple[str, Sequence[str]]]]):
         tmp: Union[List[str], List[Tuple[str, Sequence[str]]]] = list(cfg)
         if isinstance(tmp[0], str):
@@ -192,27 +432,37 @@ class Grammar:
             tmp: List[Tuple[str, Sequence[str]]] = tmp
             self.__init_tuple(tmp)
 
-        self.__hash = hash((self.__rules.values(), self.__start))
-
-        # calculate epsilon nonterms
-        ret = {"#"}
-        # while the set is changing
-        while True:
-            len_tmp = len(ret)
-            for nt, prod in self:
-                hit = False
-                for token in prod:
-                    # if the token is not in our current set of epsilons, stop
-                    if token not in ret:
-                        hit = True
-                        break
-                # if all the tokens could produce epsilon, add it to our set
-                if not hit:
-                    ret |= {nt}
-            # if the set didn't change on this iteration, break
-            if len_tmp == len(ret):
-                self.__ent = ret
-                break
+        # every symbol is numbered once, so the rest of the grammar never rebuilds these lists
+        rhs = {x for nt in self.__rules.values() for prod in nt for x in prod}
+        self.__symbols = SymbolTable(self.__start, self.__rules, rhs)
+        self.__nonterms = tuple(x for x in self.__symbols if self.__symbols.is_nonterm(x))
+        self.__terminals = frozenset(rhs) - self.__symbols.nonterms()
+
+        self.__hash = hash((frozenset(self.__rules.values()), self.__start))
+        self.__clear_caches()
+
+    def __clear_caches(self) -> None:
+        # the analyses are computed the first time they are asked for
+        self.__lexers = {}
+        self.__ent = None
+        self.__first = None
+        self.__follow = None
+        self.__bits = None
+        self.__first_masks = None
+        self.__follow_masks = None
+        self.__suffix_firsts = None
+
+    def __getstate__(self):
+        # the cached analyses are read-only proxies, which cannot be pickled, so they are left behind and rebuilt on demand
+        state = dict(self.__dict__)
+        for key in ("lexers", "ent", "first", "follow", "bits", "first_masks", "follow_masks", "suffix_firsts"):
+            state.pop("_Grammar__" + key, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__hash = hash((frozenset(self.__rules.values()), self.__start))
+        self.__clear_caches()
 
     def start(self) -> str:
         """
@@ -220,115 +470,174 @@ class Grammar:
         """
         return self.__start
 
+    def fingerprint(self) -> str:
+        """
+        Returns a digest of the grammar that is the same in every process.
+        Unlike hash(), it does not depend on hash randomization or set iteration order, so it can key a cache on disk.
+        Equal grammars with the same start symbol have the same fingerprint.
+
+        :returns: A hex string
+        """
+        h = hashlib.sha256()
+        for nt in self.nonterms():
+            for prod in sorted(self[nt]):
+                # symbols cannot contain NUL, so the encoding is unambiguous
+                h.update(("\0".join((nt,) + tuple(prod)) + "\0\0").encode("utf-8"))
+        return h.hexdigest()
+
     def nonterms(self) -> Sequence[str]:
         """
         Returns all of the non-terminals in the grammar.
-        The first nonterm is always the start symbol.
+        The first nonterm is always the start symbol, and the rest are sorted.
 
         :returns: All of the non-terminals in the grammar.
         """
-        return [self.start()] + list(set(self.__rules) - {self.start()})
+        return self.__nonterms
 
-    def terminals(self) -> Iterable[str]:
+    def terminals(self) -> FrozenSet[str]:
         """
-        Returns all of the terminals in the grammar.
+        Returns all of the terminals in the grammar, including "#" if it is used.
         """
         return self.__terminals
 
-    def epsilon_nonterms(self) -> Set[str]:
+    def symbols(self) -> SymbolTable:
         """
-        Returns all of the non-terminals that can produce epsilon.
+        Returns the symbol table of the grammar.
         """
+        return self.__symbols
+
+    def epsilon_nonterms(self) -> FrozenSet[str]:
+        """
+        Returns all of the non-terminals that can produce epsilon, along with "#" itself.
+        """
+        if self.__ent is None:
+            self.__ent = frozenset(nullable(self))
         return self.__ent
 
-    def first_sets(self) -> Dict[str, Set[str]]:
+    def first_sets(self) -> Mapping[str, FrozenSet[str]]:
         """
         Returns all of the first sets in the grammar.
+        A first set contains "#" if the non-terminal can produce epsilon.
+        They are computed once and shared, so the result is read-only.
 
         :returns: A dictionary mapping each non-terminal to a set of terminals
         """
-
-        ret = {}
-        for nt in self.nonterms():
-            ret[nt] = set()
-        # treat terminals as having themselves in the first set.
-        for t in self.terminals():
-            ret[t] = {t}
-        epsilons = self.epsilon_nonterms()
-
-        # while the grammar is changing.
-        # a non recursive loop prevents this from choking on left recursive grammars
-        while True:
-            updated = False
+        if self.__first is None:
+            epsilons = self.epsilon_nonterms()
+            init: Dict[str, Set[str]] = {nt: set() for nt in self.__rules}
+            edges: Dict[str, Set[str]] = {nt: set() for nt in self.__rules}
             for nt, prod in self:
                 # go along this production until we hit a token that can't produce epsilon
                 for token in prod:
-                    tmp = len(ret[nt])
-
-                    # the current nt should include the first set of this token
-                    ret[nt] |= ret[token] - {"#"}
-
-                    # if the length of this set changed, set updated to true
-                    updated |= len(ret[nt]) != tmp
-
+                    if token in self.__rules:
+                        # the current nt should include the first set of this token
+                        edges[nt].add(token)
+                    elif token != "#":
+                        init[nt].add(token)
                     # stop if this token cannot produce epsilon
                     if token not in epsilons:
                         break
-                else:
-                    ret[nt] |= {"#"}
 
-            # when there are no longer any changes to make
-            if not updated:
-                # return the dictionary minus the terminals
-                return {x: ret[x] for x in ret if x not in self.terminals()}
+            ret = digraph(self.__rules, edges, init)
+            self.__first = MappingProxyType({
+                nt: ret[nt] | {"#"} if nt in epsilons else ret[nt] for nt in ret
+            })
+        return self.__first
 
-    def follow_sets(self) -> Dict[str, Set[str]]:
+    def follow_sets(self) -> Mapping[str, FrozenSet[str]]:
         """
         Returns all of the follow sets in the grammar.
+        They are computed once and shared, so the result is read-only.
 
         :returns: A dictionary mapping each non-terminal to a set of terminals
         """
+        if self.__follow is None:
+            fs = self.first_sets()
+            epsilons = self.epsilon_nonterms()
+            init: Dict[str, Set[str]] = {nt: set() for nt in self.__rules}
+            edges: Dict[str, Set[str]] = {nt: set() for nt in self.__rules}
+            # start symbol can always be followed by dollar sign
+            init[self.start()].add("$")
+
+            for nt, prod in self:
+                # trail is the first set of everything after the current token
+                trail: Set[str] = set()
+                trail_epsilon = True
+                for token in reversed(prod):
+                    if token in self.__rules:
+                        # the follow set of that nonterm includes what can come after it
+                        init[token] |= trail
+                        # and everything that can follow nt if the rest of the production can vanish
+                        if trail_epsilon:
+                            edges[token].add(nt)
+                    first = fs[token] - {"#"} if token in self.__rules else ({token} if token != "#" else set())
+                    if token in epsilons:
+                        trail = trail | first
+                    else:
+                        trail = set(first)
+                        trail_epsilon = False
 
-        # get first sets, add our terminals back in
-        fs = self.first_sets()
-        fs.update({x: {x} for x in self.terminals()})
+            self.__follow = MappingProxyType(digraph(self.__rules, edges, init))
+        return self.__follow
 
-        epsilons = self.epsilon_nonterms()
+    def terminal_bits(self) -> TerminalBits:
+        """
+        Returns the numbering of the terminals used by first_masks() and follow_masks().
+        It covers every terminal in the grammar, in sorted order, followed by the end of input "$".
+        """
+        if self.__bits is None:
+            self.__bits = TerminalBits(sorted(self.__terminals - {"$"}) + ["$"])
+        return self.__bits
 
-        ret = {}
-        for nt in self.nonterms():
-            ret[nt] = set()
-        # start symbol can always be followed by dollar sign
-        ret[self.start()] = {"$"}
+    def first_masks(self) -> Mapping[str, int]:
+        """
+        Returns the first sets as masks over terminal_bits().
+        """
+        if self.__first_masks is None:
+            bits = self.terminal_bits()
+            self.__first_masks = MappingProxyType({nt: bits.encode(x) for nt, x in self.first_sets().items()})
+        return self.__first_masks
 
-        # while the set is changing
-        while True:
-            updated = False
+    def follow_masks(self) -> Mapping[str, int]:
+        """
+        Returns the follow sets as masks over terminal_bits().
+        """
+        if self.__follow_masks is None:
+            bits = self.terminal_bits()
+            self.__follow_masks = MappingProxyType({nt: bits.encode(x) for nt, x in self.follow_sets().items()})
+        return self.__follow_masks
 
-            def update(s1: Set[str], s2: Set[str]) -> bool:
-                mpt = len(s1)
-                s1 |= s2
-                return len(s1) != mpt
+    def suffix_firsts(self) -> Mapping[Tuple[str, ...], Sequence[Tuple[int, bool]]]:
+        """
+        Returns the first set of every suffix of every production, as masks over terminal_bits().
+        For a production prod, entry i describes prod[i:], and there are len(prod) + 1 entries.
+        They are computed once, walking each production backwards.
 
-            for nt, prod in self:
-                # tmp is what can follow the current symbol
-                tmp = ret[nt]
+        :returns: A dictionary mapping each right hand side to [(first set of prod[i:] without "#", true if prod[i:] can vanish)...]
+        """
+        if self.__suffix_firsts is None:
+            bits = self.terminal_bits()
+            firsts = self.first_masks()
+            epsilons = self.epsilon_nonterms()
+            no_epsilon = ~bits.bit("#") if "#" in bits else -1
+
+            ret: Dict[Tuple[str, ...], Sequence[Tuple[int, bool]]] = {}
+            for _, prod in self:
+                prod = tuple(prod)
+                if prod in ret:
+                    continue
+                suffixes = [(0, True)]
                 for token in reversed(prod):
-                    # if the token is a nonterm
-                    if token in self.nonterms():
-                        # the follow set of that nonterm includes tmp
-                        updated |= update(ret[token], tmp)
-                    # if the token can produce epsilon
+                    mask, vanishes = suffixes[-1]
+                    first = firsts[token] & no_epsilon if token in self.__rules else (0 if token == "#" else bits.bit(token))
                     if token in epsilons:
-                        # tmp should include this token's first set, minus epsilon
-                        tmp |= fs[token] - {"#"}
+                        suffixes.append((first | mask, vanishes))
                     else:
-                        # forget about what we had earlier; tmp is now the first set of the current token
-                        tmp = fs[token]
-            # if the set didn't change
-            if not updated:
-                # stop
-                return ret
+                        suffixes.append((first, False))
+                suffixes.reverse()
+                ret[prod] = tuple(suffixes)
+            self.__suffix_firsts = MappingProxyType(ret)
+        return self.__suffix_firsts
 
     def lex(self, ip: Iterable[str], spcl: Dict[str, str] = None) -> Sequence[Tuple[str, str]]:
         """
@@ -350,38 +659,12 @@ class Grammar:
         if spcl is None:
             spcl = {}
 
-        # for each string, produce a regex
-        spcl = {x: re.compile(spcl[x]) for x in spcl}
-
-        # produce a list of tokens to check, exclude any specials as we check those later
-        terms = set(self.terminals()) - set(spcl)
-
-        ret: List[Tuple[str, str]] = []
-        for line in ip:
-            line = line.strip()
-            # while there are stil tokens to be read
-            while line != "":
-                longest: Tuple[str, str] = ("", "")
-                # for each terminal, check if the line starts with that terminal
-                for s in terms:
-                    if line.startswith(s):
-                        # if so, set longest to the longer of the two tokens
-                        longest = (s, s) if len(s) > len(longest[1]) else longest
-                # now check specials
-                for name in spcl:
-                    # match the beginning of the string with the regex
-                    r = spcl[name].match(line, 0)
-                    if r is not None:
-                        # set the longer of the two tokens
-                        longest = (name, r[0]) if len(r[0]) > len(longest[1]) else longest
-                # if we matched nothing, throw
-                if longest[0] == "":
-                    raise CFGException("Invalid token starting with \"" + line + "\"")
-                # save the token we read
-                ret.append(longest)
-                # now get rid of the token we just read from the line
-                line = line[len(longest[1]):].strip()
-        return ret
+        # the lexer compiles every terminal into one pattern, so keep it around for the next call
+        key = tuple(spcl.items())
+        if key not in self.__lexers:
+            from lexer import Lexer
+            self.__lexers[key] = Lexer(self, spcl)
+        return self.__lexers[key].lex(ip)
 
     """
     Returns true if a non-terminal is in the grammar.
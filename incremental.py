@@ -0,0 +1,590 @@
+from lexer import Lexer
+from parser import LR1Parser, ParseException, ParseTreeNode
+from typing import Dict, Iterator, List, Sequence, Tuple, Union
+
+
+class SyntaxNode:
+    """
+    A node of a tree that can be reparsed incrementally.
+    Nodes never change once they are built, so an edited tree shares every subtree the edit did not touch with the tree before it.
+    For that reason a node only knows its width, not where it is: its text is the text of its children,
+    and the text of a leaf is the whitespace before its token followed by the token itself.
+
+    A left-recursive list like "L -> L E | E" is not stored as one node per element, since then an edit would have to
+    build a node for every element after it again. A SyntaxNode.LIST node has two children: the node for the start of the list,
+    and a SyntaxNode.RUN node for everything after it. A run is a height-balanced tree of runs whose leaves each hold the
+    children after the first of one left-recursive reduction, so an edit only rebuilds the runs on its path.
+    tree() turns lists back into one node per reduction.
+    """
+
+    NODE = "node"
+    LIST = "list"
+    RUN = "run"
+
+    __slots__ = ("__symbol", "__children", "__width", "__state", "__first", "__padding", "__raw", "__kind", "__height")
+
+    def __init__(self, symbol: str, children: Union[Sequence["SyntaxNode"], None], state: int = -1, padding: int = 0, raw: str = "",
+                 kind: str = NODE):
+        """
+        :param symbol: The terminal or non-terminal.
+        :param children: The children of a non-terminal, or None for a leaf.
+        :param state: For a non-terminal, the parser state it was started in. For a run, the state its list was started in.
+        :param padding: For a leaf, the length of the whitespace before the token.
+        :param raw: For a leaf, the text of the token.
+        :param kind: SyntaxNode.NODE, SyntaxNode.LIST or SyntaxNode.RUN.
+        """
+        self.__symbol = symbol
+        self.__children = tuple(children) if children is not None else None
+        self.__state = state
+        self.__padding = padding
+        self.__raw = raw
+        self.__kind = kind
+        if self.__children is None:
+            self.__width = padding + len(raw)
+            # "#" is a leaf without a token
+            self.__first = symbol if self.__width > 0 else None
+            self.__height = 0
+        else:
+            width = 0
+            first = None
+            height = 0
+            for c in self.__children:
+                width += c.__width
+                if first is None:
+                    first = c.__first
+                if c.__height > height:
+                    height = c.__height
+            self.__width = width
+            self.__first = first
+            # a run of runs is one higher than the highest of them, and a run of one reduction has height 1
+            self.__height = height + 1 if kind == SyntaxNode.RUN else 0
+
+    def symbol(self) -> str:
+        return self.__symbol
+
+    def children(self) -> Sequence["SyntaxNode"]:
+        return self.__children if self.__children is not None else ()
+
+    def is_leaf(self) -> bool:
+        return self.__children is None
+
+    def kind(self) -> str:
+        """
+        Returns SyntaxNode.NODE, SyntaxNode.LIST or SyntaxNode.RUN.
+        """
+        return self.__kind
+
+    def height(self) -> int:
+        """
+        Returns the height of a run, or 0 for anything else.
+        """
+        return self.__height
+
+    def width(self) -> int:
+        """
+        Returns the length of the text this node spans, including the whitespace before its first token.
+        """
+        return self.__width
+
+    def state(self) -> int:
+        return self.__state
+
+    def first(self) -> Union[str, None]:
+        """
+        Returns the terminal of the first token under this node, or None if it spans no tokens.
+        """
+        return self.__first
+
+    def padding(self) -> int:
+        return self.__padding
+
+    def raw(self) -> str:
+        return self.__raw
+
+    def tree(self) -> ParseTreeNode:
+        """
+        Converts the tree under this node to ParseTreeNodes, the same as LR1Parser.parse() builds.
+        """
+        done: List[ParseTreeNode] = []
+        stk: List[Tuple[SyntaxNode, bool]] = [(self, False)]
+        while len(stk) > 0:
+            node, expanded = stk.pop()
+            if node.__children is None:
+                done.append(ParseTreeNode(node.__symbol, []))
+            elif node.__kind == SyntaxNode.LIST:
+                head, run = node.__children
+                segments = _segments(run)
+                if expanded:
+                    # each reduction takes the node for the list so far and the children of its segment
+                    n = sum(len(x.__children) for x in segments)
+                    rest = done[len(done) - n:]
+                    del done[len(done) - n:]
+                    i = 0
+                    for x in segments:
+                        k = len(x.__children)
+                        done[-1] = ParseTreeNode(node.__symbol, [done[-1]] + rest[i:i + k])
+                        i += k
+                else:
+                    stk.append((node, True))
+                    stk.extend((c, False) for x in reversed(segments) for c in reversed(x.__children))
+                    stk.append((head, False))
+            elif expanded:
+                n = len(node.__children)
+                children = done[len(done) - n:]
+                del done[len(done) - n:]
+                done.append(ParseTreeNode(node.__symbol, children))
+            else:
+                stk.append((node, True))
+                stk.extend((c, False) for c in reversed(node.__children))
+        return done[0]
+
+    def __str__(self) -> str:
+        return self.__symbol
+
+
+def _segments(run: SyntaxNode) -> List[SyntaxNode]:
+    """
+    Returns the runs of height 1 under a run, in order.
+    """
+    ret = []
+    stk = [run]
+    while len(stk) > 0:
+        x = stk.pop()
+        if x.height() == 1:
+            ret.append(x)
+        else:
+            stk.extend(reversed(x.children()))
+    return ret
+
+
+def _pair(left: SyntaxNode, right: SyntaxNode) -> SyntaxNode:
+    return SyntaxNode(left.symbol(), (left, right), left.state(), kind=SyntaxNode.RUN)
+
+
+def _balance(left: SyntaxNode, right: SyntaxNode) -> SyntaxNode:
+    """
+    Pairs two runs whose heights differ by at most 2, rotating if they differ by 2.
+    """
+    if left.height() > right.height() + 1:
+        ll, lr = left.children()
+        if ll.height() >= lr.height():
+            return _pair(ll, _pair(lr, right))
+        lrl, lrr = lr.children()
+        return _pair(_pair(ll, lrl), _pair(lrr, right))
+    if right.height() > left.height() + 1:
+        rl, rr = right.children()
+        if rr.height() >= rl.height():
+            return _pair(_pair(left, rl), rr)
+        rll, rlr = rl.children()
+        return _pair(_pair(left, rll), _pair(rlr, rr))
+    return _pair(left, right)
+
+
+def _join(left: SyntaxNode, right: SyntaxNode) -> SyntaxNode:
+    """
+    Returns a balanced run of the segments of one run followed by those of another.
+    It takes time proportional to the difference of their heights.
+    """
+    if left.height() > right.height() + 1:
+        ll, lr = left.children()
+        return _balance(ll, _join(lr, right))
+    if right.height() > left.height() + 1:
+        rl, rr = right.children()
+        return _balance(_join(left, rl), rr)
+    return _pair(left, right)
+
+
+def _extend(node: SyntaxNode, run: SyntaxNode) -> SyntaxNode:
+    """
+    Returns the list a node for the start of a list, or a list, becomes with a run after it.
+    """
+    if node.kind() == SyntaxNode.LIST:
+        head, rest = node.children()
+        return SyntaxNode(node.symbol(), (head, _join(rest, run)), run.state(), kind=SyntaxNode.LIST)
+    return SyntaxNode(node.symbol(), (node, run), run.state(), kind=SyntaxNode.LIST)
+
+
+class SyntaxTree:
+    """
+    The result of an incremental parse: the text and the tree built for it.
+    """
+
+    __text: str
+    __root: SyntaxNode
+    __reused: int
+    __lexed: int
+    __steps: int
+
+    def __init__(self, text: str, root: SyntaxNode, reused: int, lexed: int, steps: int):
+        """
+        :param text: The text that was parsed.
+        :param root: The root of the tree.
+        :param reused: How many subtrees were taken whole from the previous tree.
+        :param lexed: How many tokens were lexed.
+        :param steps: How many shifts, reductions and reused subtrees the parse took.
+        """
+        self.__text = text
+        self.__root = root
+        self.__reused = reused
+        self.__lexed = lexed
+        self.__steps = steps
+
+    def text(self) -> str:
+        return self.__text
+
+    def root(self) -> SyntaxNode:
+        return self.__root
+
+    def reused(self) -> int:
+        """
+        Returns how many subtrees were taken whole from the previous tree.
+        """
+        return self.__reused
+
+    def lexed(self) -> int:
+        """
+        Returns how many tokens had to be lexed to build this tree.
+        """
+        return self.__lexed
+
+    def steps(self) -> int:
+        """
+        Returns how many shifts, reductions and reused subtrees it took to build this tree.
+        """
+        return self.__steps
+
+    def tree(self) -> ParseTreeNode:
+        return self.__root.tree()
+
+
+def _last_leaf(node: SyntaxNode, offset: int) -> Tuple[SyntaxNode, int]:
+    """
+    Returns the last leaf with a token under a node, along with where it starts.
+    """
+    while not node.is_leaf():
+        end = offset + node.width()
+        node = next(c for c in reversed(node.children()) if c.width() > 0)
+        offset = end - node.width()
+    return node, offset
+
+
+def _leaves_from(root: SyntaxNode, offset: int) -> Iterator[Tuple[SyntaxNode, int]]:
+    """
+    Yields the leaves with tokens, and where each starts, beginning with the last one whose token ends before offset.
+    Everything before that is skipped without being visited.
+    """
+    stk = [(root, 0)]
+    # the last subtree found to end before offset
+    before: Union[Tuple[SyntaxNode, int], None] = None
+    started = False
+    while len(stk) > 0:
+        node, o = stk.pop()
+        w = node.width()
+        if w == 0:
+            continue
+        if not started and o + w < offset:
+            before = (node, o)
+            continue
+        if node.is_leaf():
+            if not started:
+                started = True
+                if before is not None:
+                    yield _last_leaf(*before)
+            yield node, o
+        else:
+            o += w
+            for c in reversed(node.children()):
+                o -= c.width()
+                stk.append((c, o))
+    if not started and before is not None:
+        yield _last_leaf(*before)
+
+
+class _Cursor:
+    """
+    Walks the previous tree in order, handing out whole subtrees where it can,
+    with the tokens lexed for the edited region standing in for the old tokens there.
+    """
+
+    __stk: List[Tuple[SyntaxNode, int]]
+    __lexed: Sequence[SyntaxNode]
+    __next: int
+    __start: int
+    __end: Union[int, float]
+    __head_same: bool
+    __current: Union[SyntaxNode, None]
+    __reusable: bool
+
+    def __init__(self, root: Union[SyntaxNode, None], lexed: Sequence[SyntaxNode], start: int, end: Union[int, float], head_same: bool):
+        """
+        :param root: The previous tree, or None to only use the lexed tokens.
+        :param lexed: The leaves for the tokens that were lexed again.
+        :param start: Where in the previous text the first of those tokens starts, counting the whitespace before it.
+        :param end: Where in the previous text the first token after them starts, counting the whitespace before it.
+        :param head_same: True if the first token that was lexed again came out the same as before.
+        """
+        self.__stk = [(root, 0)] if root is not None else []
+        self.__lexed = lexed
+        self.__next = 0
+        self.__start = start
+        self.__end = end
+        self.__head_same = head_same
+        self.__current = None
+        self.__reusable = False
+
+    def peek(self) -> Union[SyntaxNode, None]:
+        """
+        Returns the next leaf or subtree, or None at the end of the input.
+        """
+        stk = self.__stk
+        while True:
+            if self.__next < len(self.__lexed) and (len(stk) == 0 or stk[-1][1] >= self.__start):
+                self.__current = self.__lexed[self.__next]
+                self.__reusable = False
+                return self.__current
+            if len(stk) == 0:
+                self.__current = None
+                return None
+
+            node, o = stk[-1]
+            w = node.width()
+            if w == 0:
+                # the parser makes its own "#"s
+                stk.pop()
+            elif node.is_leaf():
+                if self.__start <= o < self.__end:
+                    # replaced by the lexed tokens
+                    stk.pop()
+                    continue
+                self.__current = node
+                self.__reusable = False
+                return node
+            # a subtree can be reused if neither its tokens nor the token after it changed
+            elif o + w < self.__start or (o + w == self.__start and self.__head_same) or o >= self.__end:
+                self.__current = node
+                self.__reusable = True
+                return node
+            else:
+                self.descend()
+
+    def reusable(self) -> bool:
+        """
+        Returns true if what peek() returned is a subtree that was not touched by the edit.
+        """
+        return self.__reusable
+
+    def advance(self) -> None:
+        if self.__next < len(self.__lexed) and self.__current is self.__lexed[self.__next]:
+            self.__next += 1
+        else:
+            self.__stk.pop()
+
+    def descend(self) -> None:
+        """
+        Replaces the subtree on top with its children.
+        """
+        node, o = self.__stk.pop()
+        o += node.width()
+        for c in reversed(node.children()):
+            o -= c.width()
+            self.__stk.append((c, o))
+
+
+class IncrementalParser:
+    """
+    Parses a text, and then parses it again after each edit, reusing the parts of the previous tree the edit did not touch.
+
+    Only the tokens around the edit are lexed again: lexing stops as soon as the new tokens line up with the old ones.
+    A subtree of the previous tree is reused whole when the parser reaches it in the same state it was started in before,
+    which tree-sitter also relies on: with the same state, the same tokens and the same token after them,
+    an LR parser builds the same subtree. Likewise, a run of list elements is added whole to a list that is on top of the
+    state the list was started in before. See SyntaxNode.
+    The cost of a reparse grows with the size of the edit and the depth of the edit in the tree, not with the length of the text:
+    lists are balanced, so each adds depth that only grows with the logarithm of its length.
+    """
+
+    __parser: LR1Parser
+    __lexer: Lexer
+
+    def __init__(self, parser: LR1Parser, spcl: Dict[str, str] = None):
+        """
+        :param parser: The parser to run.
+        :param spcl: Special rules to lex with. See Grammar.lex().
+        """
+        self.__parser = parser
+        self.__lexer = Lexer(parser.grammar(), spcl)
+
+    def parser(self) -> LR1Parser:
+        return self.__parser
+
+    def parse(self, text: str) -> SyntaxTree:
+        """
+        Parses a whole text.
+
+        :raise CFGException: The text contains something that does not match any terminal.
+        :raise ParseException: The text is not in the language.
+        """
+        leaves = []
+        pos = 0
+        for tok in self.__lexer.scan(text):
+            leaves.append(SyntaxNode(tok.terminal(), None, padding=tok.start() - pos, raw=tok.raw()))
+            pos = tok.end()
+        root, reused, steps = self.__run(_Cursor(None, leaves, 0, 0, False))
+        return SyntaxTree(text, root, reused, len(leaves), steps)
+
+    def reparse(self, previous: SyntaxTree, start: int, end: int, text: str) -> SyntaxTree:
+        """
+        Parses the text of a previous parse with previous.text()[start:end] replaced by text.
+        The previous tree is not changed.
+
+        :param previous: The result of the previous parse.
+        :param start: Where the replaced text starts.
+        :param end: Where the replaced text ends.
+        :param text: What replaces it.
+        :returns: The new result.
+        :raise CFGException: The new text contains something that does not match any terminal.
+        :raise ParseException: The new text is not in the language.
+        """
+        old = previous.text()
+        new_text = old[:start] + text + old[end:]
+        delta = len(text) - (end - start)
+
+        # the old tokens from the one before the edit on, which is where lexing starts again
+        old_leaves = _leaves_from(previous.root(), start)
+        head = next(old_leaves, None)
+        lex_from = head[1] if head is not None else 0
+        cur = head
+
+        leaves: List[SyntaxNode] = []
+        resume: Union[int, float] = float("inf")
+        pos = lex_from
+        for tok in self.__lexer.scan(new_text, lex_from):
+            leaf = SyntaxNode(tok.terminal(), None, padding=tok.start() - pos, raw=tok.raw())
+            if tok.start() >= start + len(text):
+                # past the edit, stop at the first token that lines up with an old one
+                while cur is not None and cur[1] + cur[0].padding() + delta < tok.start():
+                    cur = next(old_leaves, None)
+                if cur is not None and cur[1] + cur[0].padding() + delta == tok.start() and cur[1] >= end and \
+                        cur[0].symbol() == leaf.symbol() and cur[0].raw() == leaf.raw() and cur[0].padding() == leaf.padding():
+                    resume = cur[1]
+                    break
+            leaves.append(leaf)
+            pos = tok.end()
+
+        head_same = head is not None and len(leaves) > 0 and head[1] + head[0].width() < start and \
+            head[0].symbol() == leaves[0].symbol() and head[0].raw() == leaves[0].raw() and head[0].padding() == leaves[0].padding()
+        root, reused, steps = self.__run(_Cursor(previous.root(), leaves, lex_from, resume, head_same))
+        return SyntaxTree(new_text, root, reused, len(leaves), steps)
+
+    def __run(self, cursor: _Cursor) -> Tuple[SyntaxNode, int, int]:
+        """
+        Runs the LR tables over the leaves and subtrees the cursor hands out.
+
+        :returns: (the root, how many subtrees were reused, how many shifts, reductions and reused subtrees it took)
+        """
+        tables = self.__parser.tables()
+        term_ids = tables.term_ids()
+        nonterm_ids = tables.nonterm_ids()
+        action = tables.action()
+        goto = tables.goto()
+        epsilon = tables.epsilon()
+        prod_lhs = tables.prod_lhs()
+        prod_len = tables.prod_len()
+        nonterms = tables.nonterms()
+        nt = len(tables.terminals())
+        nn = len(nonterms)
+        # the productions like "L -> L E", whose nodes go into lists
+        left = [len(prod) > 1 and prod[0] == lhs for lhs, prod in tables.productions()]
+
+        states = [0]
+        nodes: List[SyntaxNode] = []
+        reused = 0
+        steps = 0
+        # (state, stack depth) of each "#" shifted since the last input whose state is still on the stack
+        looping: List[Tuple[int, int]] = []
+        while True:
+            item = cursor.peek()
+            state = states[-1]
+            if item is not None and item.kind() == SyntaxNode.RUN:
+                # the elements of a list each end with the list on top of the state it was started in,
+                # so with the list on top of that state again they are parsed the same way and can be added whole
+                if cursor.reusable() and len(states) > 1 and states[-2] == item.state() and nodes[-1].symbol() == item.symbol():
+                    nodes[-1] = _extend(nodes[-1], item)
+                    cursor.advance()
+                    reused += 1
+                    steps += 1
+                    looping.clear()
+                    continue
+                look = item.first()
+            elif item is not None and not item.is_leaf():
+                # a subtree started in the same state is built the same way, so it can be shifted whole
+                if cursor.reusable() and item.state() == state:
+                    target = goto[state * nn + nonterm_ids[item.symbol()]]
+                    if target >= 0:
+                        nodes.append(item)
+                        states.append(target)
+                        cursor.advance()
+                        reused += 1
+                        steps += 1
+                        looping.clear()
+                        continue
+                look = item.first()
+            else:
+                look = item.symbol() if item is not None else "$"
+
+            if look not in term_ids:
+                raise ParseException("No transition defined at state " + str(state) + " for symbol " + str(look))
+            a = action[state * nt + term_ids[look]]
+            # a state that was only found so far has no actions until it is built
+            if a == 0 and epsilon[state] < 0 and tables.expand(state):
+                continue
+
+            # reduce: pop the right hand side and push the non-terminal it produces
+            if a < 0:
+                steps += 1
+                p = -a - 1
+                n = prod_len[p]
+                children = nodes[len(nodes) - n:]
+                del nodes[len(nodes) - n:]
+                del states[len(states) - n:]
+                while len(looping) > 0 and looping[-1][1] > len(states):
+                    looping.pop()
+                # if we reduced to the augmented start symbol, parsing was successful
+                if p == 0:
+                    if look != "$":
+                        raise ParseException("No transition defined at state " + str(state) + " for symbol " + str(look))
+                    return children[0], reused, steps
+                lhs = prod_lhs[p]
+                target = goto[states[-1] * nn + lhs]
+                if target < 0:
+                    raise ParseException("Internal error: reduced item set does not have transition for \"" + nonterms[lhs] + "\"")
+                if left[p]:
+                    nodes.append(_extend(children[0], SyntaxNode(nonterms[lhs], children[1:], states[-1], kind=SyntaxNode.RUN)))
+                else:
+                    nodes.append(SyntaxNode(nonterms[lhs], children, states[-1]))
+                states.append(target)
+
+            # anything else has to happen one token at a time
+            elif item is not None and not item.is_leaf():
+                cursor.descend()
+
+            # shift the lookahead symbol and push the new state
+            elif a > 0:
+                steps += 1
+                nodes.append(item)
+                states.append(a - 1)
+                cursor.advance()
+                looping.clear()
+
+            # otherwise try shifting on epsilon
+            elif epsilon[state] >= 0:
+                # shifting "#" in a state that is still on the stack from the last time would repeat forever
+                if any(x[0] == state for x in looping):
+                    raise ParseException("No transition defined at state " + str(state) + " for symbol " + str(look))
+                looping.append((state, len(states)))
+                steps += 1
+                nodes.append(SyntaxNode("#", None))
+                states.append(epsilon[state])
+
+            else:
+                raise ParseException("No transition defined at state " + str(state) + " for symbol " + str(look))
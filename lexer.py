@@ -0,0 +1,507 @@
+import mmap
+import re
+from grammar import CFGException, Grammar
+from typing import IO, Dict, Generator, Iterable, Iterator, List, Pattern, Sequence, Tuple, Union
+
+
+Buffer = Union[str, bytes, bytearray, memoryview]
+
+
+def trie_pattern(literals: Iterable[str]) -> str:
+    """
+    Compiles a set of literal strings into a regex that always matches the longest literal.
+    The literals are arranged into a trie, and every node of the trie turns into a group.
+    Nodes that end a literal make their children optional, so the greedy regex engine walks as deep into the trie as it can.
+    For example, ["if", "in", "int"] turns into 'i(?:f|n(?:t)?)'
+
+    Matching costs O(length of the token) no matter how many literals there are.
+
+    :param literals: The literals to match
+    :returns: A regex string. If there are no literals, the regex never matches.
+    """
+
+    trie: Dict[str, dict] = {}
+    for lit in literals:
+        if lit == "":
+            continue
+        node = trie
+        for c in lit:
+            node = node.setdefault(c, {})
+        # the empty key marks the end of a literal
+        node[""] = {}
+
+    def emit(node: Dict[str, dict]) -> str:
+        alts = [re.escape(c) + emit(node[c]) for c in sorted(node) if c != ""]
+        if len(alts) == 0:
+            return ""
+        return "(?:" + "|".join(alts) + ")" + ("?" if "" in node else "")
+
+    if len(trie) == 0:
+        return "(?!)"
+    return emit(trie)
+
+
+def _special_pattern(regex: str, offset: int) -> str:
+    """
+    Rewrites the regex of a special so it means the same thing inside the pattern that merges every terminal.
+    Numbered backreferences and conditionals are moved up by offset, since that many groups come before its own.
+    Global flags at its start, like "(?i)", are turned into a group that only applies them to this regex.
+    A "^" or "\\A" at the start of a top level alternative is dropped, since the special is always matched where its token starts.
+    Anchors anywhere else keep their usual meaning in the merged pattern, so they look at the whole line or buffer.
+
+    :param regex: The regex, which must compile on its own.
+    :param offset: How many groups come before the first group of the regex in the merged pattern.
+    :returns: The rewritten regex.
+    """
+    flags = ""
+    m = re.match(r"\(\?([aiLmsux]+)\)", regex)
+    while m is not None:
+        flags += m.group(1)
+        regex = regex[m.end():]
+        m = re.match(r"\(\?([aiLmsux]+)\)", regex)
+
+    ret = []
+    i = 0
+    n = len(regex)
+    in_class = False
+    depth = 0
+    # true while nothing has been matched yet in the current top level alternative
+    branch_start = True
+    while i < n:
+        c = regex[i]
+        if branch_start and depth == 0 and not in_class and (c == "^" or regex.startswith("\\A", i)):
+            # the merged pattern is matched at the start of the token, which is where this anchor always held
+            i += 1 if c == "^" else 2
+            continue
+        branch_start = False
+        if c == "\\" and i + 1 < n:
+            digits = re.match(r"[0-7]{3}|[1-9][0-9]?", regex[i + 1:])
+            # a leading 0 or three octal digits are a character, anything else is a group
+            if in_class or digits is None or len(digits.group()) == 3 or regex[i + 1] == "0":
+                ret.append(regex[i:i + 2])
+                i += 2
+            else:
+                ret.append("(?:\\" + str(int(digits.group()) + offset) + ")")
+                i += 1 + len(digits.group())
+            continue
+        if in_class:
+            in_class = c != "]"
+            ret.append(c)
+            i += 1
+            continue
+        if c == "[":
+            # a "]" right after the opening bracket is part of the class
+            m = re.match(r"\[\^?\]?", regex[i:])
+            in_class = True
+            ret.append(m.group())
+            i += len(m.group())
+            continue
+        m = re.match(r"\(\?\(([0-9]+)\)", regex[i:])
+        if m is not None:
+            ret.append("(?(" + str(int(m.group(1)) + offset) + ")")
+            depth += 1
+            i += len(m.group())
+            continue
+        if c == "(":
+            depth += 1
+        elif c == ")":
+            depth -= 1
+        elif c == "|" and depth == 0:
+            branch_start = True
+        ret.append(c)
+        i += 1
+
+    regex = "".join(ret)
+    if flags != "":
+        # in verbose mode a comment could run to the end, so close the group on a new line
+        regex = "(?" + flags + ":" + regex + ("\n)" if "x" in flags else ")")
+    return regex
+
+
+def _unicode_escape(regex: str) -> Union[str, None]:
+    """
+    Finds an escape in a regex that means something different when the regex is matched against bytes.
+    These are the escapes that name a character by its code point, and the classes that only cover ASCII for bytes.
+    An escaped backslash is a literal backslash, so whatever comes after it is not part of an escape.
+
+    :param regex: The regex.
+    :returns: The first such escape, like "\\w", or None if there is none.
+    """
+    # with the ASCII flag, the classes mean the same thing for str and bytes
+    ascii_only = re.compile(regex).flags & re.ASCII != 0
+    i = 0
+    n = len(regex)
+    in_class = False
+    while i < n:
+        c = regex[i]
+        if c == "\\" and i + 1 < n:
+            e = regex[i + 1]
+            # inside of a class, \b is a backspace
+            if e in "uUN" or (not ascii_only and (e in "wWdDsS" or (e in "bB" and not in_class))):
+                return regex[i:i + 2]
+            i += 2
+            continue
+        if in_class:
+            in_class = c != "]"
+            i += 1
+            continue
+        if c == "[":
+            # a "]" right after the opening bracket is part of the class
+            i += len(re.match(r"\[\^?\]?", regex[i:]).group())
+            in_class = True
+            continue
+        i += 1
+    return None
+
+
+class Token:
+    """
+    A token read out of a buffer.
+    The raw text is not copied out of the buffer until raw() is called.
+    """
+
+    __slots__ = ("__terminal", "__buf", "__base", "__start", "__end", "__line", "__col")
+
+    def __init__(self, terminal: str, buf: Buffer, base: int, start: int, end: int, line: int, col: int):
+        """
+        :param terminal: The terminal in the grammar this token matched.
+        :param buf: The buffer the token was read from.
+        :param base: The offset of buf[0] in the input.
+        :param start: The offset of the first character of the token in the input.
+        :param end: The offset one past the last character of the token in the input.
+        :param line: The line the token starts on, starting at 1.
+        :param col: The offset of the token from the start of its line, starting at 0.
+        """
+        self.__terminal = terminal
+        self.__buf = buf
+        self.__base = base
+        self.__start = start
+        self.__end = end
+        self.__line = line
+        self.__col = col
+
+    def terminal(self) -> str:
+        return self.__terminal
+
+    def start(self) -> int:
+        return self.__start
+
+    def end(self) -> int:
+        return self.__end
+
+    def line(self) -> int:
+        return self.__line
+
+    def col(self) -> int:
+        return self.__col
+
+    def raw(self) -> str:
+        """
+        Returns the text of the token. Tokens read out of binary buffers are decoded as UTF-8.
+        """
+        ret = self.__buf[self.__start - self.__base:self.__end - self.__base]
+        if not isinstance(ret, str):
+            ret = bytes(ret).decode("utf-8")
+        return ret
+
+    def __iter__(self) -> Iterator[str]:
+        """
+        Unpacks into (terminal, raw token), the same as the tuples produced by Grammar.lex().
+        """
+        return iter((self.__terminal, self.raw()))
+
+    def __str__(self) -> str:
+        return self.raw()
+
+
+class Lexer:
+    __grammar: Grammar
+    __literals: Sequence[str]
+    __specials: Sequence[str]
+    __patterns: Sequence[str]
+    __master: Pattern
+    __groups: Sequence[Tuple[int, str]]
+    __ws: Pattern
+    __scanners: Dict[type, Tuple[Pattern, Pattern, Pattern, Pattern, Pattern, Dict[Union[str, bytes], str]]]
+
+    def __init__(self, grammar: Grammar, spcl: Dict[str, str] = None):
+        """
+        Builds a lexer for a grammar.
+        All of the literal terminals and special regexes are merged into one compiled pattern up front,
+        so a Lexer should be built once and reused.
+
+        :param grammar: The grammar whose terminals should be lexed.
+        :param spcl: Special rules to match. See Grammar.lex() for the format.
+        """
+
+        # cannot have mutable default arguments
+        if spcl is None:
+            spcl = {}
+
+        self.__grammar = grammar
+        # exclude any specials from the literals, as they are matched by their regex instead
+        self.__literals = tuple(sorted(set(grammar.terminals()) - set(spcl)))
+        self.__specials = tuple(spcl)
+        self.__patterns = tuple(spcl[x] for x in self.__specials)
+
+        # every candidate is matched inside of a lookahead, so one call runs all of them at the same position
+        # the literals come first so they win ties, followed by the specials in the order they were given
+        parts = ["(?:(?=(?P<_l>" + trie_pattern(self.__literals) + ")))?"]
+        groups = 1
+        for i, name in enumerate(self.__specials):
+            # compile each special on its own first to report errors against the right rule
+            try:
+                own = re.compile(spcl[name])
+            except re.error as e:
+                raise CFGException("Invalid regex for special \"" + name + "\": " + str(e))
+            # the groups of a special are numbered after every group before it and its own group
+            groups += 1
+            parts.append("(?:(?=(?P<_s" + str(i) + ">" + _special_pattern(spcl[name], groups) + ")))?")
+            groups += own.groups
+        try:
+            self.__master = re.compile("".join(parts))
+        except re.error as e:
+            # like two specials using the same group name
+            raise CFGException("The specials cannot be combined into one regex: " + str(e))
+
+        self.__groups = ((self.__master.groupindex["_l"], ""),) + tuple(
+            (self.__master.groupindex["_s" + str(i)], name) for i, name in enumerate(self.__specials)
+        )
+        self.__ws = re.compile(r"\s*")
+        self.__scanners = {}
+
+    def grammar(self) -> Grammar:
+        """
+        Returns the grammar this lexer was built from.
+        """
+        return self.__grammar
+
+    def literals(self) -> Sequence[str]:
+        """
+        Returns the terminals that are matched literally.
+        """
+        return self.__literals
+
+    def specials(self) -> Sequence[str]:
+        """
+        Returns the terminals that are matched by a regex.
+        """
+        return self.__specials
+
+    def pattern(self) -> str:
+        """
+        Returns the regex that matches every candidate token at once.
+        Group "_l" holds the longest literal, and group "_s" + str(i) holds the match of specials()[i].
+        """
+        return self.__master.pattern
+
+    def lex(self, ip: Iterable[str]) -> Sequence[Tuple[str, str]]:
+        """
+        Produces a sequence of terminals out of a raw string.
+        The longest match wins. On a tie, a literal beats a special, and a special beats the specials given after it.
+
+        :param ip: An iterable of lines to lex.
+        :returns: [(terminal in cfg, raw token)...]
+        :raise CFGException: A line contains text that does not match any terminal.
+        """
+
+        master = self.__master
+        groups = self.__groups
+        ws = self.__ws
+
+        ret: List[Tuple[str, str]] = []
+        for line in ip:
+            pos = ws.match(line).end()
+            n = len(line)
+            # while there are still tokens to be read
+            while pos < n:
+                m = master.match(line, pos)
+                best = pos
+                term = ""
+                for ind, name in groups:
+                    end = m.end(ind)
+                    # only a strictly longer match replaces the current one
+                    if end > best:
+                        best = end
+                        term = name
+                # if we matched nothing, throw
+                if best == pos:
+                    raise CFGException("Invalid token starting with \"" + line[pos:].strip() + "\"")
+                raw = line[pos:best]
+                # literals are their own terminal
+                ret.append((term if term != "" else raw, raw))
+                pos = ws.match(line, best).end()
+        return ret
+
+    def __scanner(self, buf: Buffer) -> Tuple[Pattern, Pattern, Pattern, Pattern, Dict[Union[str, bytes], str]]:
+        """
+        Returns the patterns used to scan a buffer, compiling them for binary buffers the first time they are needed.
+
+        :returns: (master pattern, newline pattern, whitespace pattern, line break search pattern, literal text to terminal)
+        """
+        kind = str if isinstance(buf, str) else bytes
+        if kind not in self.__scanners:
+            # whitespace is skipped one line at a time so the line count stays correct
+            nl = r"[^\S\n]*\n"
+            ws = r"[^\S\n]*"
+            if kind is str:
+                self.__scanners[kind] = (
+                    self.__master, re.compile(nl), re.compile(ws), re.compile("\n"), {x: x for x in self.__literals}
+                )
+            else:
+                # a literal is a plain sequence of bytes once encoded, but a special could put a multi-byte character
+                # in a class or under a repeat, where it would stand for its bytes one at a time
+                for name, regex in zip(self.__specials, self.__patterns):
+                    escape = _unicode_escape(regex)
+                    if not regex.isascii() or escape in ("\\u", "\\U", "\\N"):
+                        raise CFGException("The regex for special \"" + name + "\" has non-ASCII characters, "
+                                           "so it cannot be matched against binary input. Scan the decoded text instead.")
+                    # the classes would silently stop matching non-ASCII text, which scanning str matches
+                    if escape is not None:
+                        raise CFGException("The regex for special \"" + name + "\" uses \"" + escape + "\", which only matches ASCII "
+                                           "in binary input. Spell out the class, start the regex with \"(?a)\", "
+                                           "or scan the decoded text instead.")
+                self.__scanners[kind] = (
+                    re.compile(self.__master.pattern.encode("utf-8")),
+                    re.compile(nl.encode()),
+                    re.compile(ws.encode()),
+                    re.compile(b"\n"),
+                    {x.encode("utf-8"): x for x in self.__literals},
+                )
+        return self.__scanners[kind]
+
+    def __tokens(self, buf: Buffer, pos: int, base: int, line: int, line_start: int, final: bool, margin: int,
+                 max_token: int) -> Generator[Token, None, Tuple[int, int, int]]:
+        """
+        Reads tokens out of a buffer starting at an offset.
+
+        :param buf: The buffer to read.
+        :param pos: The offset in buf to start reading from.
+        :param base: The offset of buf[0] in the input.
+        :param line: The line pos is on.
+        :param line_start: The offset in the input of the start of that line.
+        :param final: True if nothing comes after buf.
+        If not, reading stops before any token that starts or ends within margin of the end of buf,
+        or that does not match and is shorter than max_token counting to the end of buf, because more input could still change what that token is.
+        :param margin: See final.
+        :param max_token: See final.
+        :returns: A generator of tokens that returns (offset in buf where reading stopped, line, line_start).
+        :raise CFGException: The buffer contains text that does not match any terminal.
+        """
+
+        master, nl, ws, lb, lits = self.__scanner(buf)
+        groups = self.__groups
+        binary = not isinstance(buf, str)
+        n = len(buf)
+        # past this point a token could still grow or change with more input
+        limit = n if final else n - margin
+
+        while True:
+            # skip whitespace, counting each line we pass
+            m = nl.match(buf, pos)
+            while m is not None:
+                line += 1
+                pos = m.end()
+                line_start = base + pos
+                m = nl.match(buf, pos)
+            pos = ws.match(buf, pos).end()
+            if pos >= limit:
+                return pos, line, line_start
+
+            m = master.match(buf, pos)
+            best = pos
+            term = ""
+            for ind, name in groups:
+                end = m.end(ind)
+                # only a strictly longer match replaces the current one
+                if end > best:
+                    best = end
+                    term = name
+            # a token that is cut off by the end of buf may still grow
+            if not final and (best > limit or best >= n):
+                return pos, line, line_start
+            # or it may not match yet, but only until max_token of it has been read
+            # otherwise an invalid token would make the caller read the rest of the input before failing
+            if not final and best == pos and n - pos < max_token:
+                return pos, line, line_start
+            # if we matched nothing, throw
+            if best == pos:
+                text = buf[pos:pos + 32]
+                if binary:
+                    text = bytes(text).decode("utf-8", "replace")
+                raise CFGException(
+                    "Invalid token at line " + str(line) + ", column " + str(base + pos - line_start) +
+                    " starting with \"" + text.split("\n")[0] + "\""
+                )
+
+            if term == "":
+                # literals are their own terminal
+                lit = buf[pos:best]
+                yield Token(lits[bytes(lit) if binary else lit], buf, base, base + pos, base + best, line, base + pos - line_start)
+            else:
+                yield Token(term, buf, base, base + pos, base + best, line, base + pos - line_start)
+                # a special can match across lines
+                for m in lb.finditer(buf, pos, best):
+                    line += 1
+                    line_start = base + m.end()
+            pos = best
+
+    def scan(self, buf: Buffer, pos: int = 0) -> Iterator[Token]:
+        """
+        Lazily reads tokens out of a single buffer.
+        The buffer is never copied; the scanner moves an offset along it and tokens only remember where they are.
+        Unlike lex(), tokens may span multiple lines if a special allows it.
+
+        Binary buffers (bytes, bytearray, memoryview, mmap) are matched with the UTF-8 encoded patterns,
+        so offsets and columns count bytes instead of characters.
+        The regexes of the specials must be ASCII to match binary buffers, though literals do not have to be.
+        They also cannot use \\w, \\d, \\s, \\b or their opposites unless they start with "(?a)",
+        since those classes only cover ASCII in binary buffers but cover all of Unicode in str ones.
+
+        :param buf: The buffer to read.
+        :param pos: The offset to start reading from.
+        :returns: An iterator of tokens.
+        :raise CFGException: The buffer contains text that does not match any terminal,
+        or it is binary and a special has a regex that would match differently against it.
+        """
+        yield from self.__tokens(buf, pos, 0, 1, 0, True, 0, 0)
+
+    def stream(self, fp: Union[IO, mmap.mmap], chunk_size: int = 65536, margin: int = 256, max_token: int = 1 << 20) -> Iterator[Token]:
+        """
+        Lazily reads tokens out of a file, holding at most a chunk plus one unfinished token in memory.
+        Text files give str tokens, binary files are matched the same way as binary buffers in scan().
+
+        An mmap is already random access, so it is scanned in place without copying it into chunks.
+
+        :param fp: A file object opened for reading, or an mmap.
+        :param chunk_size: How much to read from the file at once.
+        :param margin: How far past the end of a token the input has to be read before the token is final.
+        A token is only held back for more input when it comes within this distance of the end of a chunk,
+        so it must be at least as long as the longest stretch of text a special needs to look at past its own match.
+        :param max_token: How long a token that only matches once all of it has been read, such as a string, may be.
+        Text that does not match anything is held back for more input until this much of it has been read,
+        so such a token may be longer than a chunk, but invalid text is reported after reading at most this much past it.
+        :returns: An iterator of tokens. Offsets are from the start of the file.
+        :raise CFGException: The file contains text that does not match any terminal.
+        """
+
+        if isinstance(fp, mmap.mmap):
+            yield from self.scan(fp)
+            return
+
+        buf = fp.read(chunk_size)
+        base = 0
+        pos = 0
+        line = 1
+        line_start = 0
+        final = len(buf) == 0
+        while True:
+            pos, line, line_start = yield from self.__tokens(buf, pos, base, line, line_start, final, margin, max_token)
+            if final:
+                return
+            data = fp.read(chunk_size)
+            final = len(data) == 0
+            # only the unread tail of the old chunk is carried over
+            base += pos
+            buf = buf[pos:] + data
+            pos = 0
@@ -0,0 +1,259 @@
+from grammar import CFGException, Grammar
+from typing import Callable, Dict, List, Sequence, Set, Tuple, Union
+
+
+def augment(grammar: Grammar) -> Grammar:
+    """
+    Adds a new start symbol that produces the old one, which is what LR1Parser builds its states from.
+    The new symbol is the old start symbol followed by as many "'" as it takes to not clash with another symbol.
+
+    :param grammar: The grammar.
+    :returns: The augmented grammar. Its start symbol is the new one.
+    """
+    start = grammar.start() + "'"
+    while start in grammar.symbols():
+        start += "'"
+    return Grammar([(start, (grammar.start(),))] + [(nt, prod) for nt, prod in grammar])
+
+
+def _rules(grammar: Grammar) -> Dict[str, List[Tuple[str, ...]]]:
+    """
+    Returns the productions of every non-terminal in a fixed order, the start symbol first.
+    """
+    return {nt: sorted(tuple(prod) for prod in grammar[nt]) for nt in grammar.nonterms()}
+
+
+def _build(rules: Dict[str, List[Tuple[str, ...]]]) -> Grammar:
+    """
+    Turns rules back into a Grammar. The first non-terminal is the start symbol.
+    Epsilon is written as "#" on its own, so a production that ends up empty becomes ("#",).
+    """
+    ret = []
+    for nt, prods in rules.items():
+        for prod in prods:
+            prod = tuple(x for x in prod if x != "#")
+            ret.append((nt, prod if len(prod) > 0 else ("#",)))
+    return Grammar(ret)
+
+
+def remove_useless(grammar: Grammar) -> Grammar:
+    """
+    Removes every non-terminal that cannot produce a string of terminals, along with the productions that use one,
+    and then every non-terminal that cannot be reached from the start symbol.
+
+    :param grammar: The grammar.
+    :returns: A grammar with the same language.
+    :raise CFGException: The start symbol cannot produce anything, so the language is empty.
+    """
+    rules = _rules(grammar)
+
+    # a production is productive once all of its non-terminals are, so count the ones that are not yet known to be
+    remaining = []
+    uses: Dict[str, List[int]] = {}
+    prods = [(nt, prod) for nt in rules for prod in rules[nt]]
+    for i, (_, prod) in enumerate(prods):
+        remaining.append(0)
+        for x in prod:
+            if x in rules:
+                remaining[i] += 1
+                uses.setdefault(x, []).append(i)
+    productive: Set[str] = set()
+    todo = [nt for i, (nt, _) in enumerate(prods) if remaining[i] == 0]
+    while len(todo) > 0:
+        nt = todo.pop()
+        if nt in productive:
+            continue
+        productive.add(nt)
+        for i in uses.get(nt, []):
+            remaining[i] -= 1
+            if remaining[i] == 0:
+                todo.append(prods[i][0])
+
+    if grammar.start() not in productive:
+        raise CFGException("The start symbol \"" + grammar.start() + "\" does not produce any string")
+    rules = {nt: [prod for prod in rules[nt] if all(x in productive or x not in rules for x in prod)] for nt in rules if nt in productive}
+
+    reachable = {grammar.start()}
+    todo = [grammar.start()]
+    while len(todo) > 0:
+        for prod in rules[todo.pop()]:
+            for x in prod:
+                if x in rules and x not in reachable:
+                    reachable.add(x)
+                    todo.append(x)
+    return _build({nt: prods for nt, prods in rules.items() if nt in reachable})
+
+
+def inline_single_use(grammar: Grammar) -> Grammar:
+    """
+    Replaces every non-terminal that is used exactly once, other than the start symbol, with its productions.
+    The production that used it is copied once for each of them. A non-terminal that uses itself, directly or through
+    the productions inlined into it, is kept.
+
+    Parse trees of the result have no nodes for the inlined non-terminals: their children belong to the node above.
+
+    :param grammar: The grammar.
+    :returns: A grammar with the same language.
+    """
+    rules = _rules(grammar)
+
+    # how many times each non-terminal is used, and which non-terminal's productions hold it if that is once
+    counts: Dict[str, int] = {}
+    owner: Dict[str, str] = {}
+    for nt, prods in rules.items():
+        for prod in prods:
+            for x in prod:
+                if x in rules:
+                    counts[x] = counts.get(x, 0) + 1
+                    owner[x] = nt
+
+    for nt in list(rules):
+        if nt == grammar.start() or counts.get(nt, 0) != 1 or owner[nt] == nt:
+            continue
+        target = owner[nt]
+        body = rules.pop(nt)
+        prods = []
+        for prod in rules[target]:
+            if nt not in prod:
+                prods.append(prod)
+                continue
+            i = prod.index(nt)
+            before, after = prod[:i], prod[i + 1:]
+            prods += [before + x + after for x in body]
+            # the rest of the production is copied once per production of nt
+            for x in before + after:
+                if x in rules:
+                    counts[x] += len(body) - 1
+        rules[target] = prods
+        # what nt used now lives in target
+        for prod in body:
+            for x in prod:
+                if owner.get(x) == nt:
+                    owner[x] = target
+    return _build(rules)
+
+
+def merge_identical(grammar: Grammar) -> Grammar:
+    """
+    Merges non-terminals that have the same productions, treating non-terminals that are merged as the same symbol.
+    This also merges recursive non-terminals like "A -> a A | b" and "B -> a B | b".
+    Each group of merged non-terminals is replaced with the one that comes first in the grammar.
+
+    Parse trees of the result use that non-terminal's name for every one it replaced.
+
+    :param grammar: The grammar.
+    :returns: A grammar with the same language.
+    """
+    rules = _rules(grammar)
+
+    # refine a partition of the non-terminals until every group has the same productions in terms of the groups
+    group = {nt: 0 for nt in rules}
+    n = 1
+    while True:
+        ids: Dict[Tuple[int, frozenset], int] = {}
+        refined = {}
+        for nt, prods in rules.items():
+            key = (group[nt], frozenset(tuple(group[x] if x in rules else x for x in prod) for prod in prods))
+            refined[nt] = ids.setdefault(key, len(ids))
+        group = refined
+        if len(ids) == n:
+            break
+        n = len(ids)
+
+    first: Dict[int, str] = {}
+    for nt in rules:
+        first.setdefault(group[nt], nt)
+    rename = {nt: first[group[nt]] for nt in rules}
+    return _build({nt: sorted(set(tuple(rename.get(x, x) for x in prod) for prod in prods))
+                    for nt, prods in rules.items() if rename[nt] == nt})
+
+
+# the passes normalize() runs by default, in order
+PASSES: Sequence[Callable[[Grammar], Grammar]] = (remove_useless, merge_identical, inline_single_use)
+
+
+class PassReport:
+    """
+    What one normalization pass changed.
+    The sizes of the tables are only known if normalize() was asked to measure them.
+    """
+
+    __name: str
+    __productions: Tuple[int, int]
+    __states: Union[Tuple[int, int], None]
+    __entries: Union[Tuple[int, int], None]
+
+    def __init__(self, name: str, productions: Tuple[int, int], states: Tuple[int, int] = None, entries: Tuple[int, int] = None):
+        """
+        :param name: The name of the pass.
+        :param productions: How many productions the grammar had before and after the pass.
+        :param states: How many states the tables had before and after the pass.
+        :param entries: How many entries the tables had before and after the pass.
+        """
+        self.__name = name
+        self.__productions = productions
+        self.__states = states
+        self.__entries = entries
+
+    def name(self) -> str:
+        return self.__name
+
+    def productions_saved(self) -> int:
+        return self.__productions[0] - self.__productions[1]
+
+    def states_saved(self) -> Union[int, None]:
+        """
+        Returns how many fewer states the tables have after the pass, or None if they were not measured.
+        """
+        return None if self.__states is None else self.__states[0] - self.__states[1]
+
+    def entries_saved(self) -> Union[int, None]:
+        """
+        Returns how many fewer ACTION, GOTO and EPSILON entries the tables have after the pass, or None if they were not measured.
+        """
+        return None if self.__entries is None else self.__entries[0] - self.__entries[1]
+
+    def to_dict(self) -> Dict[str, object]:
+        return {
+            "name": self.__name,
+            "productions_saved": self.productions_saved(),
+            "states_saved": self.states_saved(),
+            "entries_saved": self.entries_saved(),
+        }
+
+    def __str__(self) -> str:
+        ret = "%-20s %6d productions" % (self.__name, self.productions_saved())
+        if self.__states is not None:
+            ret += " %6d states %8d entries" % (self.states_saved(), self.entries_saved())
+        return ret
+
+
+def normalize(grammar: Grammar, passes: Sequence[Callable[[Grammar], Grammar]] = PASSES, measure: bool = False,
+              mode: str = "lr1") -> Tuple[Grammar, Sequence[PassReport]]:
+    """
+    Runs grammar transformation passes one after another.
+    The result has the same language, but parse trees use its non-terminals, not the ones of the original grammar.
+    Which parse a conflict resolver picks can also change, since the conflicts happen in different states.
+
+    :param grammar: The grammar.
+    :param passes: The passes to run, in order. Each takes a grammar and returns a new one.
+    :param measure: True to build the tables of the grammar before and after every pass to count the states and entries it saved.
+    This costs a full build per pass.
+    :param mode: How the measured tables are built, with conflicts resolved by shifting. See LR1Parser.
+    :returns: (the normalized grammar, what each pass changed)
+    """
+    def size(g: Grammar) -> Tuple[int, int]:
+        # imported here since the parser augments with this module
+        from parser import LR1Parser, resolve_shift
+        tables = LR1Parser(g, resolve_shift, mode=mode).tables()
+        return tables.num_states(), len(tables.action()) + len(tables.goto()) + len(tables.epsilon())
+
+    reports = []
+    before = size(grammar) if measure else None
+    for p in passes:
+        after = p(grammar)
+        now = size(after) if measure else None
+        reports.append(PassReport(p.__name__, (sum(1 for _ in grammar), sum(1 for _ in after)),
+                                  None if now is None else (before[0], now[0]), None if now is None else (before[1], now[1])))
+        grammar, before = after, now
+    return grammar, reports
@@ -1,7 +1,13 @@
-from grammar import Grammar
+from array import array
+from grammar import CFGException, Grammar, TerminalBits, tokenize
+import hashlib
+from lexer import Token
+from normalize import augment
+from stats import BuildStats, ParseStats
+from tables import ParseTables, TableCache
 from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from typing import Callable, Deque, Dict, FrozenSet, Iterable, Iterator, List, Set, Tuple, Sequence, Union
-from copy import copy
 
 
 class ItemException(Exception):
@@ -12,126 +18,316 @@ class ParseException(Exception):
     pass
 
 
-def lookahead(prod: Sequence[str], dotpos: int, grammar: Grammar) -> Set[str]:
-    if dotpos >= (len(prod) - 1):
-        return {"$$"}
-
-    epsilons = grammar.epsilon_nonterms()
-    nonterms = grammar.nonterms()
-    ret = set()
-    nt_passed = set()
-    stk = deque()
-    stk.append(prod[dotpos + 1:])
-
-    while len(stk) > 0:
-        cur = stk.popleft()
-        hit = False
-        for token in cur:
-            if token in nonterms:
-                if token in nt_passed:
-                    if token in epsilons:
-                        continue
-                    else:
-                        hit = True
-                        break
-                else:
-                    nt_passed.add(token)
-                    for prod in grammar[token]:
-                        stk.append(prod)
-            else:
-                ret.add(token)
-            if token not in epsilons:
-                hit = True
-                break
-        if not hit:
-            ret.add("$$")
+class Diagnostic:
+    """
+    A syntax error found while parsing with recovery.
+    """
 
-    return ret
+    __slots__ = ("__index", "__terminal", "__token", "__state", "__expected")
+
+    def __init__(self, index: int, terminal: str, token: Union[Tuple[str, str], "Token", None], state: int, expected: Sequence[str]):
+        """
+        :param index: How many tokens came before the bad one.
+        :param terminal: The terminal of the bad token, or "$" if the input ended too early.
+        :param token: The bad token, or None if the input ended too early.
+        :param state: The state the parser was in.
+        :param expected: The terminals that could have come next.
+        """
+        self.__index = index
+        self.__terminal = terminal
+        self.__token = token
+        self.__state = state
+        self.__expected = expected
+
+    def index(self) -> int:
+        return self.__index
+
+    def terminal(self) -> str:
+        return self.__terminal
+
+    def token(self) -> Union[Tuple[str, str], "Token", None]:
+        return self.__token
+
+    def state(self) -> int:
+        return self.__state
+
+    def expected(self) -> Sequence[str]:
+        return self.__expected
+
+    def __str__(self) -> str:
+        if isinstance(self.__token, Token):
+            where = "line " + str(self.__token.line()) + ", column " + str(self.__token.col())
+        else:
+            where = "token " + str(self.__index)
+        found = "end of input" if self.__token is None else "\"" + self.__terminal + "\""
+        return where + ": unexpected " + found + ", expected one of " + ", ".join(self.__expected)
+
+
+class ParseErrors(ParseException):
+    """
+    Raised at the end of a parse with recovery if any syntax errors were found.
+    """
+
+    __errors: Sequence[Diagnostic]
+    __result: object
+
+    def __init__(self, errors: Sequence[Diagnostic], result: object):
+        super().__init__("\n".join(str(x) for x in errors))
+        self.__errors = errors
+        self.__result = result
+
+    def errors(self) -> Sequence[Diagnostic]:
+        """
+        Returns every error, in the order they were found.
+        """
+        return self.__errors
+
+    def result(self) -> object:
+        """
+        Returns what the parse produced with the bad input skipped, or None if it could not reach the end.
+        """
+        return self.__result
+
+
+class ItemCores:
+    """
+    Numbers every (production, dot position) pair of a grammar, so the LR(0) core of an item is a single int.
+    The cores of a production are numbered consecutively, so core + 1 moves the dot one symbol to the right.
+    Productions are numbered the same way as in compile_tables(): the start symbol first, then the rest sorted.
+    """
+
+    __grammar: Grammar
+    __bits: TerminalBits
+    __productions: Sequence[Tuple[str, Tuple[str, ...]]]
+    __prod_ids: Dict[Tuple[str, Tuple[str, ...]], int]
+    __first_core: Sequence[int]
+    __core_prod: Sequence[int]
+    __core_dot: Sequence[int]
+    __core_sym: Sequence[Union[str, None]]
+    __core_first: Sequence[int]
+    __core_vanishes: Sequence[bool]
+    __starts: Dict[str, Sequence[int]]
+    __shapes: Dict[FrozenSet[int], Tuple[Sequence[int], Dict[int, int], Dict[int, Sequence[int]]]]
+    __closures: int
+    __shape_hits: int
+    __closure_items: int
+
+    def __init__(self, grammar: Grammar):
+        """
+        :param grammar: The grammar. Its start symbol gets production 0.
+        """
+        self.__grammar = grammar
+        self.__bits = grammar.terminal_bits()
+        self.__productions = tuple((nt, tuple(prod)) for nt in grammar.nonterms() for prod in sorted(grammar[nt]))
+        self.__prod_ids = {x: i for i, x in enumerate(self.__productions)}
+
+        suffixes = grammar.suffix_firsts()
+        first_core = []
+        core_prod = []
+        core_dot = []
+        core_sym: List[Union[str, None]] = []
+        core_first: List[int] = []
+        core_vanishes: List[bool] = []
+        for p, (nt, prod) in enumerate(self.__productions):
+            first_core.append(len(core_prod))
+            for dot in range(len(prod) + 1):
+                core_prod.append(p)
+                core_dot.append(dot)
+                core_sym.append(prod[dot] if dot < len(prod) else None)
+                # what can come after the symbol past the dot
+                first, vanishes = suffixes[prod][min(dot + 1, len(prod))]
+                core_first.append(first)
+                core_vanishes.append(vanishes)
+        self.__first_core = array("i", first_core)
+        self.__core_prod = array("i", core_prod)
+        self.__core_dot = array("i", core_dot)
+        self.__core_sym = tuple(core_sym)
+        self.__core_first = tuple(core_first)
+        self.__core_vanishes = tuple(core_vanishes)
+        self.__starts = {nt: tuple(first_core[self.__prod_ids[(nt, tuple(prod))]] for prod in sorted(grammar[nt])) for nt in grammar.nonterms()}
+        self.__shapes = {}
+        self.__closures = 0
+        self.__shape_hits = 0
+        self.__closure_items = 0
+
+    def grammar(self) -> Grammar:
+        return self.__grammar
+
+    def bits(self) -> TerminalBits:
+        return self.__bits
+
+    def productions(self) -> Sequence[Tuple[str, Tuple[str, ...]]]:
+        return self.__productions
+
+    def core(self, nt: str, prod: Sequence[str], dotpos: int) -> int:
+        """
+        Returns the core of an item.
+        """
+        return self.__first_core[self.__prod_ids[(nt, tuple(prod))]] + dotpos
+
+    def production(self, core: int) -> int:
+        return self.__core_prod[core]
+
+    def dotpos(self, core: int) -> int:
+        return self.__core_dot[core]
+
+    def symbol(self, core: int) -> Union[str, None]:
+        """
+        Returns the symbol after the dot, or None if the dot is at the end.
+        """
+        return self.__core_sym[core]
+
+    def counters(self) -> Dict[str, int]:
+        """
+        Returns how much work closing item sets has taken so far. See BuildStats.counters().
+        """
+        return {
+            "closures": self.__closures,
+            "closure_shape_hits": self.__shape_hits,
+            "closure_items": self.__closure_items,
+            "lookahead_masks": len(self.__core_first),
+        }
+
+    def __shape(self, kernel: FrozenSet[int]) -> Tuple[Sequence[int], Dict[int, int], Dict[int, Sequence[int]]]:
+        """
+        Works out the part of a closure that only depends on the cores of the kernel.
+
+        :returns: (every core in the closure in the order they were found, starting with the kernel in sorted order,
+        the lookaheads each core gets no matter what the kernel's lookaheads are,
+        the cores each core passes its lookaheads on to)
+        """
+        if kernel in self.__shapes:
+            self.__shape_hits += 1
+            return self.__shapes[kernel]
+
+        syms = self.__core_sym
+        starts = self.__starts
+        order = sorted(kernel)
+        spont: Dict[int, int] = {}
+        passes: Dict[int, List[int]] = {}
+        q: Deque[int] = deque(order)
+        seen = set(order)
+
+        while len(q) > 0:
+            c = q.popleft()
+            sym = syms[c]
+            if sym is None or sym not in starts:
+                continue
+            lh = self.__core_first[c]
+            if self.__core_vanishes[c]:
+                passes[c] = list(starts[sym])
+            for child in starts[sym]:
+                spont[child] = spont.get(child, 0) | lh
+                if child not in seen:
+                    seen.add(child)
+                    order.append(child)
+                    q.append(child)
+
+        self.__shapes[kernel] = (tuple(order), spont, passes)
+        return self.__shapes[kernel]
+
+    def closure(self, kernel: Dict[int, int]) -> Dict[int, int]:
+        """
+        Closes a set of LR(1) items, given as a dictionary mapping each core to its lookahead mask.
+        Items with the same core share one entry, and the lookaheads of an entry are merged as they are found,
+        so checking whether an item is already in the closure is a dictionary lookup.
+
+        Which cores end up in the closure and how lookaheads flow between them only depends on the cores of the kernel,
+        so that is worked out once per set of kernel cores and reused for every set of lookaheads.
+
+        :param kernel: The items to close.
+        :returns: The closure. The kernel comes first, followed by the other items in the order they were found.
+        """
+        order, spont, passes = self.__shape(frozenset(kernel))
+        self.__closures += 1
+        self.__closure_items += len(order)
+        ret = {c: kernel.get(c, 0) | spont.get(c, 0) for c in order}
+
+        # pass lookaheads along until nothing changes
+        q = [c for c in order if c in passes]
+        while len(q) > 0:
+            c = q.pop()
+            m = ret[c]
+            for child in passes[c]:
+                if ret[child] | m != ret[child]:
+                    ret[child] |= m
+                    if child in passes:
+                        q.append(child)
+        return ret
 
 
 class Item:
-    __nt: str
-    __prod: Sequence[str]
-    __follow: Set[str]
-    __dotpos: int
-    __hash: int
+    """
+    An LR(1) item: a core from an ItemCores and a lookahead mask.
+    """
 
-    def nt(self):
-        return self.__nt
+    __slots__ = ("__cores", "__core", "__follow")
 
-    def prod(self):
-        return self.__prod
+    def nt(self) -> str:
+        return self.__cores.productions()[self.__cores.production(self.__core)][0]
 
-    def follow(self):
-        return self.__follow
+    def prod(self) -> Tuple[str, ...]:
+        return self.__cores.productions()[self.__cores.production(self.__core)][1]
 
-    def dotpos(self):
-        return self.__dotpos
+    def core(self) -> int:
+        return self.__core
 
-    def current(self):
-        return self.__prod[self.__dotpos]
+    def cores(self) -> ItemCores:
+        return self.__cores
 
-    def advanced(self):
-        return Item(self.__nt, self.__prod, self.__follow, self.__dotpos + 1)
+    def follow(self) -> FrozenSet[str]:
+        return self.__cores.bits().decode(self.__follow)
 
-    def is_reduce(self):
-        return self.__dotpos >= len(self.__prod)
+    def follow_mask(self) -> int:
+        """
+        Returns the follow set as a mask over bits().
+        """
+        return self.__follow
 
-    def closure(self, grammar: Grammar) -> Sequence["Item"]:
-        ret: List["Item"] = []
-        hit: Set["Item"] = set()
-        q: Deque["Item"] = deque([self])
-        nonterms = set(grammar.nonterms())
-        lookahead_buf: Dict[Sequence[str], Set[str]] = {}
+    def bits(self) -> TerminalBits:
+        """
+        Returns the numbering of the terminals in the follow set.
+        """
+        return self.__cores.bits()
 
-        parent_follows = {self: lookahead(self.prod(), self.dotpos(), grammar)}
-        if "$$" in parent_follows[self]:
-            parent_follows[self] -= {"$$"}
-            parent_follows[self] |= self.__follow
+    def dotpos(self) -> int:
+        return self.__cores.dotpos(self.__core)
 
-        while len(q) > 0:
-            n = q.popleft()
-            if n in ret:
-                continue
-            ret.append(n)
-            hit.add(n)
-            if n.is_reduce():
-                continue
-            sym = n.current()
-            if sym in nonterms:
-                for prod in grammar[sym]:
-                    tmp = Item(sym, prod, parent_follows[n], 0)
-                    q.append(tmp)
-
-                    if prod in lookahead_buf:
-                        lh = copy(lookahead_buf[prod])
-                    else:
-                        lh = lookahead(prod, 0, grammar)
-                        lookahead_buf[prod] = copy(lh)
+    def current(self) -> str:
+        return self.__cores.symbol(self.__core)
 
-                    if "$$" in lh:
-                        lh -= {"$$"}
-                        lh |= parent_follows[n]
-                    parent_follows[tmp] = lh
-        return tuple(ret)
+    def advanced(self) -> "Item":
+        return Item(self.__cores, self.__core + 1, self.__follow)
+
+    def is_reduce(self) -> bool:
+        return self.__cores.symbol(self.__core) is None
+
+    def closure(self) -> Sequence["Item"]:
+        closed = self.__cores.closure({self.__core: self.__follow})
+        return tuple(Item(self.__cores, c, f) for c, f in closed.items())
 
     def __hash__(self):
-        return self.__hash
+        return hash((self.__core, self.__follow))
 
     def __eq__(self, other):
         if not isinstance(other, Item):
             return False
-        return self.__nt == other.__nt and self.__prod == other.__prod and self.__follow == other.__follow and self.__dotpos == other.__dotpos
-
-    def __init__(self, nt: str, prod: Sequence[str], follow: Set[str], dotpos: int):
-        self.__nt = nt
-        self.__prod = prod
+        return self.__core == other.__core and self.__follow == other.__follow and self.__cores is other.__cores
+
+    def __init__(self, cores: ItemCores, core: int, follow: int):
+        """
+        :param cores: The numbering of the cores of the grammar.
+        :param core: The production and dot position, as numbered by cores.
+        :param follow: The terminals that can follow the production, as a mask over cores.bits().
+        """
+        self.__cores = cores
+        self.__core = core
         self.__follow = follow
-        self.__dotpos = dotpos
-        self.__hash = hash((self.__nt, self.__prod, tuple(sorted(self.__follow)), self.__dotpos))
 
     def __str__(self):
-        return self.__nt + " -> " + " ".join(self.__prod[0:self.__dotpos]) + " . " + " ".join(self.__prod[self.__dotpos:]) + " {" + ",".join(self.__follow) + "}"
+        prod = self.prod()
+        dotpos = self.dotpos()
+        return self.nt() + " -> " + " ".join(prod[0:dotpos]) + " . " + " ".join(prod[dotpos:]) + " {" + ",".join(sorted(self.follow())) + "}"
 
 
 def resolve_shift(i1: Item, i2: Item) -> Item:
@@ -152,6 +348,25 @@ def resolve_throw(i1: Item, i2: Item) -> Item:
     raise ItemException("shift/reduce conflict (\"" + str(i1) + "\", \"" + str(i2) + "\")")
 
 
+# the item cores each closing process works with, set up once by _init_closer()
+_closer: Union[ItemCores, None] = None
+
+
+def _init_closer(rules: Sequence[Tuple[str, Tuple[str, ...]]]) -> None:
+    """
+    Runs once in each process that closes item sets for ItemSet.generate().
+    The cores are numbered from the grammar alone, so they match the ones in the parent.
+
+    :param rules: The rules of the grammar as (nonterm, production), start symbol first.
+    """
+    global _closer
+    _closer = ItemCores(Grammar(rules))
+
+
+def _close(kernel: Dict[int, int]) -> Dict[int, int]:
+    return _closer.closure(kernel)
+
+
 class ItemSet:
     __items: Sequence[Item]
     __shift: Dict[str, Tuple[int, Item]]
@@ -159,60 +374,250 @@ class ItemSet:
     __hash: int
 
     @staticmethod
-    def generate(base: Sequence[Item], grammar: Grammar, resolver: Callable[[Item, Item], Item] = resolve_throw) -> Sequence["ItemSet"]:
+    def generate(base: Sequence[Item], grammar: Grammar, resolver: Callable[[Item, Item], Item] = resolve_throw, mode: str = "lr1",
+                 stats: BuildStats = None, workers: int = None) -> Sequence["ItemSet"]:
+        """
+        Generates the states of an LR parser.
+
+        :param base: The closure of the start item.
+        :param grammar: The grammar.
+        :param resolver: Picks between two conflicting items.
+        :param mode: "lr1" for the canonical LR(1) states.
+        "lalr" merges every set of states that share the same LR(0) core, which can introduce reduce/reduce conflicts.
+        "minimal" only merges states that do not introduce reduce/reduce conflicts, so it parses the same language as "lr1".
+        :param stats: If given, the "transitions", "kernel_hits", "states" and "merged_states" counters and the "merge" phase are added to it.
+        :param workers: If more than 1, the closures of new states are computed in this many processes.
+        Closures computed there are not added to the counters of the item cores.
+        The states are found one breadth-first level at a time, and each level is numbered in the same order as the
+        states would be found one at a time, so the result is the same as without workers.
+        :returns: The states. The start state is first.
+        """
+        if mode not in ("lr1", "lalr", "minimal"):
+            raise ValueError("Unknown construction mode \"" + mode + "\"")
+
         ret: List["ItemSet"] = [ItemSet(base, {}, {})]
-        hit: Dict[Sequence[Item], int] = {base: 0}
+        # states are found by their kernel: the items reached by shifting, before closing them
+        hit: Dict[FrozenSet[Tuple[int, int]], int] = {frozenset((x.core(), x.follow_mask()) for x in base): 0}
+        transitions = 0
+
+        if workers is not None and workers > 1:
+            transitions = ItemSet.__generate_parallel(ret, hit, grammar, resolver, workers)
+        else:
+            i = 0
+            while i < len(ret):
+                transitions += ItemSet.expand(ret, i, hit, resolver)
+                i += 1
+
+        if stats is not None:
+            stats.count("transitions", transitions)
+            stats.count("kernel_hits", transitions - (len(ret) - 1))
+            stats.count("states", len(ret))
+        if mode != "lr1":
+            if stats is not None:
+                with stats.phase("merge"):
+                    ret = ItemSet.__merge(ret, resolver, mode == "minimal")
+                stats.count("merged_states", len(ret))
+            else:
+                ret = ItemSet.__merge(ret, resolver, mode == "minimal")
+            for itemset in ret:
+                itemset.__calc_hash()
+        return ret
 
-        i = 0
-        while i < len(ret):
-            for item in ret[i]:
-                if item.is_reduce():
-                    for char in item.follow():
-                        if char in ret[i].__reduce and ret[i].__reduce[char].nt() != item.nt():
-                            ret[i].__reduce[char] = resolver(ret[i].__reduce[char], item)
-                        if char in ret[i].__shift:
-                            res = resolver(ret[i].__shift[char][1], item)
-                            if res.is_reduce():
-                                del ret[i].__shift[char]
-                                ret[i].__reduce[char] = item
-                            else:
-                                # shift is already in correct spot
-                                pass
-                        ret[i].__reduce[char] = item
+    @staticmethod
+    def expand(sets: List[Union["ItemSet", None]], i: int, hit: Dict[FrozenSet[Tuple[int, int]], int], resolver: Callable[[Item, Item], Item],
+               pending: List[Tuple[int, Dict[int, int]]] = None) -> int:
+        """
+        Works out the shifts and reductions of one state.
+        States it shifts to that have not been seen before are closed and appended to sets, without being expanded themselves.
+
+        :param sets: The states found so far.
+        :param i: The state to expand.
+        :param hit: The number of each state found so far, keyed by its kernel as a frozenset of (core, lookahead mask).
+        :param resolver: Picks between two conflicting items.
+        :param pending: If given, new states are not closed. They are numbered and appended to sets as None,
+        and (number, kernel) is appended here so the caller can close them later.
+        :returns: How many transitions the state has.
+        """
+        itemset = sets[i]
+        cores = itemset.__items[0].cores()
+        # the items that shift on each symbol, advanced past it, make up the kernel of the next state
+        kernels: Dict[str, Dict[int, int]] = {}
+        for item in itemset:
+            if item.is_reduce():
+                itemset.__add_reduce(item, resolver)
+            else:
+                char = item.current()
+                if not itemset.__can_shift(item, resolver):
+                    # do nothing with the current shift
+                    continue
+                kernel = kernels.setdefault(char, {})
+                kernel[item.core() + 1] = kernel.get(item.core() + 1, 0) | item.follow_mask()
+                # the target is filled in once every item has been seen
+                itemset.__shift[char] = (-1, item)
+
+        transitions = 0
+        for char, kernel in kernels.items():
+            # a later reduction may have won the symbol
+            if char not in itemset.__shift:
+                continue
+            key = frozenset(kernel.items())
+            transitions += 1
+            if key not in hit:
+                if pending is None:
+                    closed = cores.closure(kernel)
+                    sets.append(ItemSet(tuple(Item(cores, c, f) for c, f in closed.items()), {}, {}))
                 else:
-                    char = item.current()
-                    if char in ret[i].__reduce:
-                        res = resolver(ret[i].__reduce[char], item)
-                        if res.is_reduce():
-                            # do nothing with the current shift
-                            continue
-                        else:
-                            del ret[i].__reduce[char]
-                            # now deal with the shift
+                    sets.append(None)
+                    pending.append((len(sets) - 1, kernel))
+                hit[key] = len(sets) - 1
+            itemset.__shift[char] = (hit[key], itemset.__shift[char][1])
+        itemset.__calc_hash()
+        return transitions
 
-                    target = item.advanced().closure(grammar)
-
-                    if char in ret[i].__shift:
-                        target_ind = ret[i].__shift[char][0]
-
-                        tmp = list(ret[target_ind].__items)
-                        tmpset = set(tmp)
-                        for x in target:
-                            if x not in tmpset:
-                                tmp.append(x)
-                                tmpset.add(x)
+    @staticmethod
+    def __generate_parallel(sets: List["ItemSet"], hit: Dict[FrozenSet[Tuple[int, int]], int], grammar: Grammar,
+                            resolver: Callable[[Item, Item], Item], workers: int) -> int:
+        """
+        Finds every state reachable from sets[0] one level at a time.
+        This process works out the transitions of a whole level and numbers the new states in order,
+        and a pool of processes closes their kernels, which is where most of the time goes.
+
+        :returns: How many transitions there are.
+        """
+        cores = sets[0].__items[0].cores()
+        transitions = 0
+        # plain tuples pickle under every start method, so the workers rebuild the grammar themselves
+        rules = [(nt, tuple(prod)) for nt, prod in grammar]
+        with ProcessPoolExecutor(workers, initializer=_init_closer, initargs=(rules,)) as pool:
+            frontier = [0]
+            while len(frontier) > 0:
+                pending: List[Tuple[int, Dict[int, int]]] = []
+                for i in frontier:
+                    transitions += ItemSet.expand(sets, i, hit, resolver, pending)
+                kernels = [kernel for _, kernel in pending]
+                # a small level is not worth sending anywhere
+                if len(kernels) < workers * 4:
+                    closed = [cores.closure(x) for x in kernels]
+                else:
+                    closed = pool.map(_close, kernels, chunksize=max(1, len(kernels) // (workers * 4)))
+                for (i, _), closure in zip(pending, closed):
+                    sets[i] = ItemSet(tuple(Item(cores, c, f) for c, f in closure.items()), {}, {})
+                frontier = [i for i, _ in pending]
+        return transitions
+
+    def __add_reduce(self, item: Item, resolver: Callable[[Item, Item], Item]) -> None:
+        for char in item.follow():
+            if char in self.__reduce and self.__reduce[char].nt() != item.nt():
+                self.__reduce[char] = resolver(self.__reduce[char], item)
+            if char in self.__shift:
+                res = resolver(self.__shift[char][1], item)
+                if res.is_reduce():
+                    del self.__shift[char]
+                    self.__reduce[char] = item
+                else:
+                    # shift is already in correct spot
+                    pass
+            self.__reduce[char] = item
+
+    def __can_shift(self, item: Item, resolver: Callable[[Item, Item], Item]) -> bool:
+        char = item.current()
+        if char in self.__reduce:
+            res = resolver(self.__reduce[char], item)
+            if res.is_reduce():
+                return False
+            del self.__reduce[char]
+        return True
+
+    def core(self) -> FrozenSet[int]:
+        """
+        Returns the LR(0) core of the state: the cores of its items without their lookaheads.
+        """
+        return frozenset(x.core() for x in self.__items)
 
-                        ret[target_ind].__items = tuple(tmp)
-                        target = ret[target_ind].__items
-                        hit[target] = target_ind
+    @staticmethod
+    def __merge(sets: Sequence["ItemSet"], resolver: Callable[[Item, Item], Item], split_conflicts: bool) -> Sequence["ItemSet"]:
+        """
+        Merges states that share an LR(0) core.
+        States start out grouped by core. If split_conflicts is set, a group is split up wherever merging it would make
+        two different productions reduce on the same lookahead, or give a production ending in "#" lookaheads it did not have.
+        "#" is shifted whenever nothing else can be, so such a lookahead would let the parser shift "#" and reduce
+        over and over without reading the token. Groups are then split until every state in a group
+        moves to the same group on each symbol, so the merged states are still deterministic.
+        """
+
+        def reductions(itemset: "ItemSet") -> Dict[str, Set[Tuple[str, Sequence[str]]]]:
+            ret: Dict[str, Set[Tuple[str, Sequence[str]]]] = {}
+            for x in itemset:
+                if x.is_reduce():
+                    for char in x.follow():
+                        ret.setdefault(char, set()).add((x.nt(), x.prod()))
+            return ret
+
+        def epsilon_reductions(itemset: "ItemSet") -> FrozenSet[Tuple[int, int]]:
+            return frozenset((x.core(), x.follow_mask()) for x in itemset if x.is_reduce() and x.prod()[-1] == "#")
+
+        # group by core, numbering the groups by their first state
+        group: List[int] = []
+        by_core: Dict[FrozenSet[int], int] = {}
+        for itemset in sets:
+            group.append(by_core.setdefault(itemset.core(), len(by_core)))
+
+        if split_conflicts:
+            # each group keeps a list of (members, merged reductions, reductions ending in "#")
+            subgroups: Dict[int, List[Tuple[List[int], Dict[str, Set[Tuple[str, Sequence[str]]]], FrozenSet[Tuple[int, int]]]]] = {}
+            for i, itemset in enumerate(sets):
+                red = reductions(itemset)
+                eps = epsilon_reductions(itemset)
+                for members, merged, merged_eps in subgroups.setdefault(group[i], []):
+                    # compatible if no lookahead ends up reducing by more productions than it already did on one side,
+                    # and the productions ending in "#" reduce on exactly the same lookaheads
+                    if eps == merged_eps and all(merged.get(c, set()) <= red[c] or red[c] <= merged[c] for c in red):
+                        members.append(i)
+                        for c in red:
+                            merged.setdefault(c, set()).update(red[c])
+                        break
+                else:
+                    subgroups[group[i]].append(([i], red, eps))
+            ids: Dict[Tuple[int, int], int] = {}
+            for i in range(len(sets)):
+                for j, (members, _, _) in enumerate(subgroups[group[i]]):
+                    if i in members:
+                        group[i] = ids.setdefault((group[i], j), len(ids))
+                        break
 
-                    if target not in hit:
-                        ret.append(ItemSet(target, {}, {}))
-                        hit[target] = len(ret) - 1
-                    ret[i].__shift[char] = (hit[target], item)
-            i += 1
-        for itemset in ret:
-            itemset.__calc_hash()
+        # split groups until every member of a group moves to the same groups
+        while True:
+            keys: Dict[Tuple[int, Tuple[Tuple[str, int], ...]], int] = {}
+            new_group = [
+                keys.setdefault((group[i], tuple(sorted((c, group[t]) for c, (t, _) in sets[i].__shift.items()))), len(keys))
+                for i in range(len(sets))
+            ]
+            if len(keys) == len(set(group)):
+                break
+            group = new_group
+
+        # merge the items of each group, unioning the lookaheads of equal cores
+        members: List[List[int]] = [[] for _ in range(len(set(group)))]
+        for i, g in enumerate(group):
+            members[g].append(i)
+
+        ret: List["ItemSet"] = []
+        for g, ms in enumerate(members):
+            follows: Dict[int, int] = {}
+            for i in ms:
+                for x in sets[i]:
+                    follows[x.core()] = follows.get(x.core(), 0) | x.follow_mask()
+            cores = sets[ms[0]].__items[0].cores()
+            items = tuple(Item(cores, core, follow) for core, follow in follows.items())
+            targets = {c: group[t] for i in ms for c, (t, _) in sets[i].__shift.items()}
+
+            merged = ItemSet(items, {}, {})
+            for item in items:
+                if item.is_reduce():
+                    merged.__add_reduce(item, resolver)
+                elif item.current() in targets and merged.__can_shift(item, resolver):
+                    merged.__shift[item.current()] = (targets[item.current()], item)
+            ret.append(merged)
         return ret
 
     def reduce(self):
@@ -256,7 +661,164 @@ class ItemSet:
         return ret.strip()
 
 
+def table_symbols(grammar: Grammar, accept: str) -> Tuple[Sequence[str], Sequence[str], Sequence[Tuple[str, Tuple[str, ...]]]]:
+    """
+    Numbers the symbols and productions of an augmented grammar the way compile_tables() lays them out.
+
+    :returns: (terminals, non-terminals, productions)
+    """
+    nonterms = [accept] + sorted(set(grammar.nonterms()) - {accept})
+    productions = [(nt, tuple(prod)) for nt in nonterms for prod in sorted(grammar[nt])]
+    # lookaheads and shifted terminals all come from the grammar, apart from the end of input
+    terminals = sorted(set(grammar.terminals()) | {"$"})
+    return terminals, nonterms, productions
+
+
+def compile_state(itemset: ItemSet, state: int, tables: ParseTables) -> None:
+    """
+    Fills in the ACTION, GOTO and EPSILON entries of one state.
+    The row of the state must still be empty.
+
+    :param itemset: The state, with its shifts and reductions worked out.
+    :param state: The number of the state.
+    :param tables: The tables to write to. Their arrays must be writable.
+    """
+    term_ids = tables.term_ids()
+    nonterm_ids = tables.nonterm_ids()
+    action = tables.action()
+    goto = tables.goto()
+    epsilon = tables.epsilon()
+    nt = len(tables.terminals())
+    nn = len(tables.nonterms())
+
+    for char, (target, _) in itemset.shift().items():
+        if char in nonterm_ids:
+            goto[state * nn + nonterm_ids[char]] = target
+        else:
+            action[state * nt + term_ids[char]] = target + 1
+            if char == "#":
+                epsilon[state] = target
+    # most reductions of a state share an item, so look each item's production up once
+    reduces: Dict[int, int] = {}
+    for char, item in itemset.reduce().items():
+        if action[state * nt + term_ids[char]] == 0:
+            r = reduces.get(id(item))
+            if r is None:
+                r = reduces[id(item)] = -tables.production_id(item.nt(), item.prod()) - 1
+            action[state * nt + term_ids[char]] = r
+    # a reduction on epsilon applies to any lookahead without an action of its own
+    if "#" in itemset.reduce():
+        item = itemset.reduce()["#"]
+        r = -tables.production_id(item.nt(), item.prod()) - 1
+        for t in range(nt):
+            if action[state * nt + t] == 0:
+                action[state * nt + t] = r
+
+
+def compile_tables(sets: Sequence[ItemSet], grammar: Grammar, accept: str) -> ParseTables:
+    """
+    Interns every symbol and production of a set of states into integers and lays the states out as dense tables.
+    The conflicts were already settled when the states were generated, so every entry has at most one action.
+
+    :param sets: The states, as generated by ItemSet.generate(). The start state is first.
+    :param grammar: The augmented grammar the states were generated from.
+    :param accept: The augmented start symbol.
+    :returns: The compiled tables.
+    """
+    terminals, nonterms, productions = table_symbols(grammar, accept)
+    action = array("i", [0]) * (len(sets) * len(terminals))
+    goto = array("i", [-1]) * (len(sets) * len(nonterms))
+    epsilon = array("i", [-1]) * len(sets)
+
+    ret = ParseTables(terminals, nonterms, productions, action, goto, epsilon)
+    for state, itemset in enumerate(sets):
+        compile_state(itemset, state, ret)
+    return ret
+
+
+class LazyTables(ParseTables):
+    """
+    Tables for the canonical LR(1) states of a grammar that are only built when a parse first reaches them.
+    Only the start state is built up front. Every state that is found gets a number and an empty row,
+    and its row is filled in by expand() the first time the parser has to act in it.
+    An empty row has no actions, so parsers only need to call expand() where they would otherwise report an error.
+
+    The states are numbered in the order they are found, so the numbering depends on what has been parsed,
+    but the language and the trees are the same as with the "lr1" tables.
+    """
+
+    __sets: List[ItemSet]
+    __hit: Dict[FrozenSet[Tuple[int, int]], int]
+    __resolver: Callable[[Item, Item], Item]
+    __expanded: List[bool]
+
+    def __init__(self, base: Sequence[Item], grammar: Grammar, accept: str, resolver: Callable[[Item, Item], Item] = resolve_throw):
+        """
+        :param base: The closure of the start item.
+        :param grammar: The augmented grammar.
+        :param accept: The augmented start symbol.
+        :param resolver: Picks between two conflicting items.
+        """
+        terminals, nonterms, productions = table_symbols(grammar, accept)
+        super().__init__(terminals, nonterms, productions, array("i", [0]) * len(terminals), array("i", [-1]) * len(nonterms), array("i", [-1]))
+        self.__sets = [ItemSet(base, {}, {})]
+        self.__hit = {frozenset((x.core(), x.follow_mask()) for x in base): 0}
+        self.__resolver = resolver
+        self.__expanded = [False]
+        self.expand(0)
+
+    def expand(self, state: int) -> bool:
+        """
+        Builds a state that has been found but not built yet.
+
+        :returns: True if the state was built now, False if it already was.
+        :raise ItemException: The resolver rejected a conflict in the state. The state stays unbuilt, so it raises again next time.
+        """
+        if state >= len(self.__expanded) or self.__expanded[state]:
+            return False
+        sets = self.__sets
+        ItemSet.expand(sets, state, self.__hit, self.__resolver)
+        self.__expanded[state] = True
+
+        # the states found just now get empty rows
+        new = len(sets) - len(self.__expanded)
+        if new > 0:
+            self.action().extend(array("i", [0]) * (new * len(self.terminals())))
+            self.goto().extend(array("i", [-1]) * (new * len(self.nonterms())))
+            self.epsilon().extend(array("i", [-1]) * new)
+            self.__expanded.extend([False] * new)
+        compile_state(sets[state], state, self)
+        return True
+
+    def complete(self) -> None:
+        i = 0
+        while i < len(self.__expanded):
+            self.expand(i)
+            i += 1
+
+    def num_expanded(self) -> int:
+        """
+        Returns how many states have been built. num_states() also counts the ones that have only been found.
+        """
+        return sum(self.__expanded)
+
+    def item_sets(self) -> Sequence[ItemSet]:
+        """
+        Returns the states found so far. The ones that have not been built have no shifts or reductions yet.
+        """
+        return self.__sets
+
+
+# the value "#" is shifted with, since it does not come from the input
+EPSILON_TOKEN = ("#", "")
+
+
 class ASTNode:
+    """
+    The value a reduction produces in "actions" mode when its production has no action.
+    The children are the values of the right hand side: tokens for terminals, and whatever the actions returned for non-terminals.
+    """
+
     __rule: str
     __children: Sequence[Union[Tuple[str, str], "ASTNode"]]
 
@@ -267,9 +829,54 @@ class ASTNode:
     def rule(self) -> str:
         return self.__rule
 
+    def children(self) -> Sequence[Union[Tuple[str, str], "ASTNode"]]:
+        return self.__children
+
     def __iter__(self) -> Iterator[Union[Tuple[str, str], "ASTNode"]]:
         return iter(self.__children)
 
+    def __eq__(self, other):
+        if not isinstance(other, ASTNode):
+            return False
+        return self.__rule == other.__rule and list(self.__children) == list(other.__children)
+
+    def __str__(self):
+        return self.__rule
+
+
+class ParseHandler:
+    """
+    Receives the events of a parse in "events" mode, in the order the parser takes its actions.
+    Subclasses override the events they care about; every method does nothing by default.
+    """
+
+    def shift(self, token: Union[Tuple[str, str], Token]) -> None:
+        """
+        Called when a token is shifted. "#" is shifted as EPSILON_TOKEN.
+        """
+        pass
+
+    def reduce(self, nt: str, prod: Tuple[str, ...]) -> None:
+        """
+        Called when the last len(prod) symbols are reduced to nt.
+        """
+        pass
+
+    def error(self, diagnostic: Diagnostic) -> None:
+        """
+        Called when a syntax error is found while parsing with recovery.
+        Events for the symbols that are thrown away to recover have already been sent.
+        """
+        pass
+
+    def accept(self) -> object:
+        """
+        Called when the input is accepted.
+
+        :returns: What ParseSession.finish() returns.
+        """
+        return None
+
 
 class ParseTreeNode:
     __sym: str
@@ -297,78 +904,715 @@ class ParseTreeNode:
         return self.__sym
 
 
+class CompactTree:
+    """
+    A parse tree kept in flat arrays in postorder, without an object for each node.
+    Node i has a symbol id, the index of the token it was shifted from (-1 for non-terminals and "#"), and a number of children.
+    The children of a node are the subtrees right before it, so the root is always the last node.
+    """
+
+    __names: Sequence[str]
+    __symbols: array
+    __tokens: array
+    __counts: array
+    __starts: Union[array, None]
+
+    def __init__(self, names: Sequence[str], symbols: array, tokens: array, counts: array):
+        """
+        :param names: The name of each symbol id.
+        :param symbols: The symbol id of each node.
+        :param tokens: The token index of each node.
+        :param counts: The number of children of each node.
+        """
+        self.__names = names
+        self.__symbols = symbols
+        self.__tokens = tokens
+        self.__counts = counts
+        self.__starts = None
+
+    def names(self) -> Sequence[str]:
+        return self.__names
+
+    def symbols(self) -> array:
+        return self.__symbols
+
+    def tokens(self) -> array:
+        return self.__tokens
+
+    def counts(self) -> array:
+        return self.__counts
+
+    def root(self) -> int:
+        return len(self.__symbols) - 1
+
+    def name(self, node: int) -> str:
+        """
+        Returns the symbol of a node.
+        """
+        return self.__names[self.__symbols[node]]
+
+    def children(self, node: int) -> Sequence[int]:
+        """
+        Returns the children of a node, in order.
+        The first call indexes where every subtree starts, so later calls only walk the children themselves.
+        """
+        if self.__starts is None:
+            starts = array("i", self.__symbols)
+            stk: List[int] = []
+            for i, n in enumerate(self.__counts):
+                starts[i] = starts[stk[-n]] if n > 0 else i
+                if n > 0:
+                    del stk[-n:]
+                stk.append(i)
+            self.__starts = starts
+
+        ret = []
+        c = node - 1
+        for _ in range(self.__counts[node]):
+            ret.append(c)
+            c = self.__starts[c] - 1
+        ret.reverse()
+        return ret
+
+    def to_tree(self) -> "ParseTreeNode":
+        """
+        Builds the same tree out of ParseTreeNodes.
+        """
+        values: List[ParseTreeNode] = []
+        for s, n in zip(self.__symbols, self.__counts):
+            children = values[len(values) - n:]
+            del values[len(values) - n:]
+            values.append(ParseTreeNode(self.__names[s], children))
+        return values[-1]
+
+    def __len__(self) -> int:
+        return len(self.__symbols)
+
+
+class ParseSession:
+    """
+    A parse that is fed its input a piece at a time.
+    The LR stack is kept between calls to feed(), so tokens can be pushed in as they are produced.
+
+    What the parse produces depends on its mode:
+        "tree" builds a ParseTreeNode for every symbol,
+        "compact" fills the arrays of a CompactTree,
+        "recognize" only checks the input and allocates nothing per token,
+        "actions" runs a semantic action on every reduction and produces the value of the start symbol,
+        "events" reports every shift and reduction to a ParseHandler and builds nothing.
+
+    Without recovery, the first syntax error raises a ParseException.
+    With recovery, the session records a Diagnostic and resynchronizes in panic mode.
+    It throws away input until a synchronizing token, then pops the stack until a state can act on that token.
+    The end of input always synchronizes. So every error is found in one pass, and finish() raises ParseErrors with all of them.
+    """
+
+    __tables: ParseTables
+    __mode: str
+    __states: List[int]
+    __values: List[object]
+    __symbols: array
+    __tokens: array
+    __counts: array
+    __epsilon_id: int
+    __actions: Sequence[Union[Callable[..., object], None]]
+    __handler: Union[ParseHandler, None]
+    __sync: Union[FrozenSet[str], None]
+    __errors: List[Diagnostic]
+    __skipping: bool
+    __position: int
+    __result: object
+    __stats: Union[ParseStats, None]
+
+    def __init__(self, parser: Union["LR1Parser", ParseTables], mode: str = "tree",
+                 actions: Dict[Union[str, Tuple[str, Sequence[str]]], Callable[..., object]] = None, handler: ParseHandler = None,
+                 sync: Iterable[str] = None, stats: ParseStats = None):
+        """
+        :param parser: The parser, or just the tables it runs on.
+        :param mode: "tree", "compact", "recognize", "actions" or "events".
+        :param actions: In "actions" mode, what to run on each reduction, keyed by production.
+        A production is given as a string like "E -> E + T" or a tuple like ("E", ("E", "+", "T")).
+        An action is called with one value per symbol on the right hand side and returns the value of the non-terminal.
+        Terminals are valued as the token that was fed in, and "#" as EPSILON_TOKEN.
+        Productions without an action produce an ASTNode of their values.
+        :param handler: In "events" mode, what receives the events.
+        :param sync: The terminals to resynchronize on after a syntax error, such as ";" and "}".
+        If None, there is no recovery and the first error is raised.
+        :param stats: If given, the shifts, reductions, stack depth and states used are counted in it.
+        :raise ValueError: The mode is not one of those, or the mode is "events" and there is no handler.
+        :raise CFGException: An action is given for a production that is not in the grammar.
+        """
+        if mode not in ("tree", "compact", "recognize", "actions", "events"):
+            raise ValueError("Unknown parse mode \"" + mode + "\"")
+        if mode == "events" and handler is None:
+            raise ValueError("The \"events\" mode needs a handler")
+        self.__tables = parser if isinstance(parser, ParseTables) else parser.tables()
+        self.__mode = mode
+        self.__states = [0]
+        self.__values = []
+        self.__symbols = array("i")
+        self.__tokens = array("i")
+        self.__counts = array("i")
+        self.__epsilon_id = self.__tables.term_ids().get("#", -1)
+        self.__handler = handler
+        self.__sync = frozenset(sync) | {"$"} if sync is not None else None
+        self.__errors = []
+        self.__skipping = False
+        self.__position = 0
+        self.__result = None
+        self.__stats = stats
+
+        # look the actions up by production id once, instead of by production on every reduction
+        prods = self.__tables.productions()
+        ids = {x: i for i, x in enumerate(prods)}
+        self.__actions = [None] * len(prods)
+        for key, fn in (actions or {}).items():
+            if isinstance(key, str):
+                sides = [x.strip() for x in key.split("->")]
+                if len(sides) != 2:
+                    raise CFGException("Action for \"" + key + "\" is not a single production")
+                key = (sides[0], tokenize(sides[1]))
+            key = (key[0], tuple(key[1]))
+            if key not in ids:
+                raise CFGException("Action for \"" + key[0] + " -> " + " ".join(key[1]) + "\" is not a production in the grammar")
+            self.__actions[ids[key]] = fn
+
+    def mode(self) -> str:
+        return self.__mode
+
+    def done(self) -> bool:
+        """
+        Returns true if the input has been accepted.
+        """
+        return len(self.__states) == 0
+
+    def errors(self) -> Sequence[Diagnostic]:
+        """
+        Returns the syntax errors found so far while parsing with recovery.
+        """
+        return self.__errors
+
+    def feed(self, tokens: Iterable[Union[Tuple[str, str], Token]]) -> None:
+        """
+        Pushes tokens into the parse.
+        The iterable is consumed one token at a time, so parsing stops at the first error without reading the rest of it.
+
+        :param tokens: (terminal, raw token) pairs or Tokens, like the ones Grammar.lex() or Lexer.scan() produce.
+        :raise ParseException: Without recovery, a token cannot come next. The session cannot be used after this.
+        :raise ItemException: With LazyTables, a token reached a state with a conflict the resolver rejected.
+        """
+        for token in tokens:
+            self.__push(token.terminal() if isinstance(token, Token) else token[0], token)
+            self.__position += 1
+
+    def finish(self) -> object:
+        """
+        Ends the input.
+
+        :returns: The root of the parse tree in "tree" mode, a CompactTree in "compact" mode, True in "recognize" mode,
+        the value of the start symbol in "actions" mode, or what the handler's accept() returns in "events" mode.
+        :raise ParseException: Without recovery, the input ended too early.
+        :raise ParseErrors: With recovery, there were syntax errors. The result with the bad input skipped is attached to it.
+        :raise ItemException: With LazyTables, the end of the input reached a state with a conflict the resolver rejected.
+        """
+        if not self.done():
+            self.__push("$", None)
+        if len(self.__errors) > 0:
+            raise ParseErrors(self.__errors, self.__result)
+        return self.__result
+
+    def __expected(self, state: int) -> Sequence[str]:
+        """
+        Returns the terminals a state has an action for.
+        """
+        tables = self.__tables
+        tables.expand(state)
+        nt = len(tables.terminals())
+        action = tables.action()
+        return [x for i, x in enumerate(tables.terminals()) if action[state * nt + i] != 0 and x != "#"]
+
+    def __error(self, look: str, token: Union[Tuple[str, str], Token, None], state: int) -> None:
+        """
+        Records a token the parser cannot act on, and starts throwing away input.
+
+        :raise ParseException: There is no recovery.
+        """
+        if self.__sync is None:
+            raise ParseException("No transition defined at state " + str(state) + " for symbol " + str(look))
+
+        # an error before anything was shifted after recovering is part of the same mistake
+        if not self.__skipping:
+            diagnostic = Diagnostic(self.__position, look, token, state, self.__expected(state))
+            self.__errors.append(diagnostic)
+            if self.__mode == "events":
+                self.__handler.error(diagnostic)
+        self.__skipping = True
+
+    def __resync(self, t: int) -> bool:
+        """
+        Pops the stack until the top state can act on a synchronizing terminal.
+
+        :returns: False if no state on the stack can.
+        """
+        tables = self.__tables
+        states = self.__states
+        nt = len(tables.terminals())
+        action = tables.action()
+        epsilon = tables.epsilon()
+
+        depth = len(states) - 1
+        while depth >= 0 and action[states[depth] * nt + t] == 0 and epsilon[states[depth]] < 0:
+            depth -= 1
+        if depth < 0:
+            return False
+
+        # throw away the values of the popped states
+        n = len(states) - 1 - depth
+        if self.__mode == "compact":
+            counts = self.__counts
+            end = len(counts)
+            for _ in range(n):
+                # walk back over one whole subtree
+                need = 1
+                while need > 0:
+                    end -= 1
+                    need += counts[end] - 1
+            del self.__symbols[end:]
+            del self.__tokens[end:]
+            del counts[end:]
+        elif self.__mode in ("tree", "actions") and n > 0:
+            del self.__values[len(self.__values) - n:]
+        del states[depth + 1:]
+        return True
+
+    def __push(self, look: str, token: Union[Tuple[str, str], Token, None]) -> None:
+        if self.done():
+            raise ParseException("Cannot feed more tokens after the input was accepted")
+
+        tables = self.__tables
+        states = self.__states
+
+        if look not in tables.term_ids():
+            self.__error(look, token, states[-1])
+            return
+        t = tables.term_ids()[look]
+
+        if not self.__skipping:
+            if self.__step(look, t, token):
+                return
+            self.__error(look, token, states[-1])
+
+        # throw away input until something to resynchronize on, and then find a state that can take it
+        if look in self.__sync and self.__resync(t) and self.__step(look, t, token):
+            return
+        if look == "$":
+            # nothing is left to skip, so this is as far as the parse gets
+            states.clear()
+            raise ParseErrors(self.__errors, None)
+
+    def __step(self, look: str, t: int, token: Union[Tuple[str, str], Token, None]) -> bool:
+        """
+        Runs the parser on one lookahead until it is shifted or the input is accepted.
+
+        :returns: False if there is no action for the lookahead. The stack is left where the error was found.
+        """
+        tables = self.__tables
+        states = self.__states
+        action = tables.action()
+        goto = tables.goto()
+        epsilon = tables.epsilon()
+        prod_lhs = tables.prod_lhs()
+        prod_len = tables.prod_len()
+        nonterms = tables.nonterms()
+        nt = len(tables.terminals())
+        nn = len(nonterms)
+
+        mode = self.__mode
+        build = mode != "recognize"
+        tree = mode == "tree"
+        compact = mode == "compact"
+        values = self.__values
+        symbols = self.__symbols
+        tokens = self.__tokens
+        counts = self.__counts
+
+        counting = self.__stats is not None
+        if counting:
+            state_hits, production_hits = self.__stats.histograms(len(epsilon), len(prod_len))
+        shifts = reduces = epsilons = 0
+        depth = len(states)
+        # (state, stack depth) of each "#" shifted for this lookahead whose state is still on the stack
+        looping: List[Tuple[int, int]] = []
+
+        try:
+            while True:
+                state = states[-1]
+                a = action[state * nt + t]
+                if counting:
+                    state_hits[state] += 1
+                    depth = max(depth, len(states))
+                    if a > 0:
+                        shifts += 1
+                    elif a < 0 and (a != -1 or look == "$"):
+                        reduces += 1
+                        production_hits[-a - 1] += 1
+                    elif a == 0 and epsilon[state] >= 0:
+                        epsilons += 1
+
+                # shift the lookahead symbol and push the new state
+                if a > 0:
+                    if not build:
+                        pass
+                    elif tree:
+                        values.append(ParseTreeNode(look, []))
+                    elif compact:
+                        symbols.append(t)
+                        tokens.append(self.__position)
+                        counts.append(0)
+                    elif mode == "actions":
+                        values.append(token)
+                    else:
+                        self.__handler.shift(token)
+                    states.append(a - 1)
+                    self.__skipping = False
+                    return True
+
+                # reduce: pop the right hand side and push the non-terminal it produces
+                elif a < 0:
+                    p = -a - 1
+                    # the start symbol can only be reduced at the end of the input
+                    if p == 0 and look != "$":
+                        return False
+                    n = prod_len[p]
+                    del states[len(states) - n:]
+                    while len(looping) > 0 and looping[-1][1] > len(states):
+                        looping.pop()
+                    if tree or mode == "actions":
+                        children = values[len(values) - n:]
+                        del values[len(values) - n:]
+                    # if we reduced to the augmented start symbol, parsing was successful
+                    if p == 0:
+                        if not build:
+                            self.__result = True
+                        elif compact:
+                            self.__result = CompactTree(tables.terminals() + nonterms, symbols, tokens, counts)
+                        elif mode == "events":
+                            self.__result = self.__handler.accept()
+                        else:
+                            self.__result = children[0]
+                        # an empty stack marks the parse as done
+                        states.clear()
+                        return True
+                    lhs = prod_lhs[p]
+                    target = goto[states[-1] * nn + lhs]
+                    # if the new state cannot shift on what was reduced, there is an error in the parser
+                    if target < 0:
+                        raise ParseException("Internal error: reduced item set does not have transition for \"" + nonterms[lhs] + "\"")
+                    if not build:
+                        pass
+                    elif tree:
+                        values.append(ParseTreeNode(nonterms[lhs], children))
+                    elif compact:
+                        symbols.append(nt + lhs)
+                        tokens.append(-1)
+                        counts.append(n)
+                    elif mode == "actions":
+                        fn = self.__actions[p]
+                        values.append(fn(*children) if fn is not None else ASTNode(nonterms[lhs], children))
+                    else:
+                        self.__handler.reduce(nonterms[lhs], tables.productions()[p][1])
+                    states.append(target)
+
+                # otherwise try shifting on epsilon
+                elif epsilon[state] >= 0:
+                    # shifting "#" in a state that is still on the stack from the last time would repeat forever,
+                    # which merged states can do on a lookahead the canonical states would have rejected
+                    if any(x[0] == state for x in looping):
+                        return False
+                    looping.append((state, len(states)))
+                    if not build:
+                        pass
+                    elif tree:
+                        values.append(ParseTreeNode("#", []))
+                    elif compact:
+                        symbols.append(self.__epsilon_id)
+                        tokens.append(-1)
+                        counts.append(0)
+                    elif mode == "actions":
+                        values.append(EPSILON_TOKEN)
+                    else:
+                        self.__handler.shift(EPSILON_TOKEN)
+                    states.append(epsilon[state])
+
+                # a state that was only found so far has no actions until it is built
+                elif tables.expand(state):
+                    if counting:
+                        # building it can add states, and it is counted again when its action is looked up
+                        self.__stats.histograms(len(epsilon), len(prod_len))
+                        state_hits[state] -= 1
+                    continue
+
+                else:
+                    return False
+        finally:
+            if counting:
+                self.__stats.add(shifts, reduces, epsilons, max(depth, len(states)))
+
+
+# bumped whenever a change to how states are built or compiled can change the tables of a grammar,
+# so tables cached by an older version are not reused
+CONSTRUCTION_VERSION = 3
+
+
+def _code_key(code) -> str:
+    """
+    Returns a string that identifies the bytecode of a function, including the functions defined inside of it.
+    """
+    consts = []
+    for x in code.co_consts:
+        if hasattr(x, "co_code"):
+            consts.append(_code_key(x))
+        elif isinstance(x, frozenset):
+            # the order of a set of strings changes between processes
+            consts.append("frozenset" + repr(sorted(repr(y) for y in x)))
+        else:
+            consts.append(repr(x))
+    return code.co_code.hex() + "\0" + "\0".join(consts) + "\0" + "\0".join(code.co_names)
+
+
+def resolver_key(resolver: Callable[[Item, Item], Item]) -> Union[str, None]:
+    """
+    Returns a string that identifies a resolver the same way in every process.
+    A function is identified by its module, qualified name and bytecode, so two lambdas with different bodies differ.
+    Values it captures from an enclosing function are included if they are plain constants.
+
+    :returns: The key, or None if the resolver cannot be identified across processes,
+    like a callable object or a closure over anything but plain constants.
+    """
+    name = getattr(resolver, "__module__", None), getattr(resolver, "__qualname__", None)
+    if name[0] is None or name[1] is None:
+        return None
+    ret = name[0] + "." + name[1]
+    code = getattr(resolver, "__code__", None)
+    if code is not None:
+        ret += "\0" + _code_key(code)
+        for cell in getattr(resolver, "__closure__", None) or ():
+            try:
+                value = cell.cell_contents
+            except ValueError:
+                return None
+            if value is not None and not isinstance(value, (bool, int, float, str, bytes)):
+                return None
+            ret += "\0" + repr(value)
+    return ret
+
+
+def parser_fingerprint(grammar: Grammar, resolver: Callable[[Item, Item], Item], mode: str = "lr1") -> str:
+    """
+    Returns a digest of everything the tables of an LR1Parser depend on, stable across processes.
+    The resolver is identified by resolver_key(). If it has no key, the digest is only valid in this process.
+
+    :returns: A hex string
+    """
+    key = resolver_key(resolver)
+    h = hashlib.sha256()
+    h.update(("%d\0" % CONSTRUCTION_VERSION).encode("utf-8"))
+    h.update(grammar.fingerprint().encode())
+    h.update(("\0" + (key if key is not None else "id " + str(id(resolver)))).encode("utf-8"))
+    h.update(("\0" + mode).encode("utf-8"))
+    return h.hexdigest()
+
+
 class LR1Parser:
-    __sets: Sequence[ItemSet]
+    __sets: Union[Sequence[ItemSet], None]
     __grammar: Grammar
-
-    def __init__(self, grammar: Grammar, resolver: Callable[[Item, Item], Item]):
+    __augmented: Grammar
+    __resolver: Callable[[Item, Item], Item]
+    __mode: str
+    __accept: str
+    __tables: ParseTables
+    __stats: Union[BuildStats, None]
+    __workers: Union[int, None]
+
+    def __init__(self, grammar: Grammar, resolver: Callable[[Item, Item], Item], cache: TableCache = None, mode: str = "lr1",
+                 stats: BuildStats = None, warmup: Iterable[Union[str, Iterable[Union[Tuple[str, str], Token]]]] = None, workers: int = None):
+        """
+        Builds the parse tables for a grammar.
+
+        :param grammar: The grammar to parse.
+        :param resolver: Picks between two conflicting items.
+        :param cache: If given, the tables are loaded from here instead of being built, and saved here after being built.
+        It is not used in "lazy" mode, or if the resolver has no resolver_key().
+        :param mode: How the states are built. See ItemSet.generate().
+        "lazy" builds the canonical LR(1) states as parses reach them, starting from just the start state. See LazyTables.
+        Conflicts are then only found when a parse reaches a state that has them, so with resolve_throw,
+        parse() and the sessions raise ItemException on every input that reaches such a state, instead of this raising it up front.
+        :param stats: If given, how long each phase of building takes and how much work it does are recorded in it.
+        :param warmup: Inputs to parse right away, so the states they need are built before the first real parse. See warm_up().
+        :param workers: How many processes to build the states with. See ItemSet.generate(). It is not used in "lazy" mode.
+        The tables are the same whatever it is.
+        """
         self.__grammar = grammar
-        old_start = grammar.start()
-        new_start = old_start + "'"
-        new_start_rule = new_start + " -> " + old_start
-        g = Grammar([new_start_rule] + str(grammar).split("\n"))
-        start_item = Item(new_start, (old_start,), {"$"}, 0)
-        self.__sets = ItemSet.generate(start_item.closure(g), g, resolver)
-
-    def parse(self, arg: Union[str, Sequence[Tuple[str, str]]]):
+        self.__resolver = resolver
+        self.__mode = mode
+        self.__stats = stats
+        self.__workers = workers
+        stats = stats if stats is not None else BuildStats()
+
+        with stats.phase("augment"):
+            self.__augmented = augment(grammar)
+        self.__accept = self.__augmented.start()
+        self.__sets = None
+
+        # tables built with a resolver that cannot be told apart from others in another process are never cached
+        if resolver_key(resolver) is None:
+            cache = None
+        tables = None
+        if cache is not None and mode != "lazy":
+            with stats.phase("cache"):
+                key = self.fingerprint()
+                tables = cache.load(key)
+        if tables is None:
+            self.__build()
+            if cache is not None and mode != "lazy":
+                with stats.phase("store"):
+                    cache.store(key, self.__tables)
+        else:
+            self.__tables = tables
+
+        if warmup is not None:
+            self.warm_up(warmup)
+
+    def __build(self) -> None:
+        stats = self.__stats
+        if self.__mode == "lazy":
+            stats = stats if stats is not None else BuildStats()
+            resolver = stats.counting(self.__resolver) if self.__stats is not None else self.__resolver
+            with stats.phase("cores"):
+                cores = ItemCores(self.__augmented)
+            with stats.phase("generate"):
+                start_item = Item(cores, cores.core(self.__accept, (self.__grammar.start(),), 0), cores.bits().bit("$"))
+                self.__tables = LazyTables(start_item.closure(), self.__augmented, self.__accept, resolver)
+            return
+
+        if stats is None:
+            cores = ItemCores(self.__augmented)
+            start_item = Item(cores, cores.core(self.__accept, (self.__grammar.start(),), 0), cores.bits().bit("$"))
+            self.__sets = ItemSet.generate(start_item.closure(), self.__augmented, self.__resolver, self.__mode, workers=self.__workers)
+            self.__tables = compile_tables(self.__sets, self.__augmented, self.__accept)
+            return
+
+        with stats.phase("cores"):
+            cores = ItemCores(self.__augmented)
+        merged = stats.phases().get("merge", 0.0)
+        with stats.phase("generate"):
+            start_item = Item(cores, cores.core(self.__accept, (self.__grammar.start(),), 0), cores.bits().bit("$"))
+            self.__sets = ItemSet.generate(start_item.closure(), self.__augmented, stats.counting(self.__resolver), self.__mode, stats,
+                                             self.__workers)
+        # merging is a phase of its own
+        stats.phases()["generate"] -= stats.phases().get("merge", 0.0) - merged
+        with stats.phase("tables"):
+            self.__tables = compile_tables(self.__sets, self.__augmented, self.__accept)
+        for k, v in cores.counters().items():
+            stats.count(k, v)
+        stats.set_items_per_state([sum(1 for _ in x) for x in self.__sets])
+
+    def grammar(self) -> Grammar:
+        """
+        Returns the grammar this parser was built from.
+        """
+        return self.__grammar
+
+    def item_sets(self) -> Sequence[ItemSet]:
+        """
+        Returns the states of the parser. The start state is first.
+        If the tables were loaded from a cache, the states are generated now and the tables are rebuilt to match them.
+        In "lazy" mode, every state that has not been built yet is built now.
+        """
+        if isinstance(self.__tables, LazyTables):
+            self.__tables.complete()
+            return self.__tables.item_sets()
+        if self.__sets is None:
+            self.__build()
+        return self.__sets
+
+    def warm_up(self, inputs: Iterable[Union[str, Iterable[Union[Tuple[str, str], Token]]]]) -> None:
+        """
+        Parses inputs and throws away the results, so that in "lazy" mode the states they reach are built.
+        Inputs with errors are parsed up to the error.
+        A conflict the resolver rejects is a problem with the grammar, not the input, so it is not thrown away.
+
+        :param inputs: Each is a string to lex, or (terminal, raw token) pairs or Tokens.
+        :raise ItemException: In "lazy" mode, an input reached a state with a conflict the resolver rejected.
+        """
+        for x in inputs:
+            try:
+                self.parse(x, "recognize")
+            except (ParseException, CFGException):
+                pass
+
+    def mode(self) -> str:
+        """
+        Returns how the states were built. See ItemSet.generate().
+        """
+        return self.__mode
+
+    def fingerprint(self) -> str:
+        """
+        Returns the digest the tables of this parser are cached under. See parser_fingerprint().
+        """
+        return parser_fingerprint(self.__grammar, self.__resolver, self.__mode)
+
+    def accept_symbol(self) -> str:
+        """
+        Returns the start symbol of the augmented grammar. Reducing to it accepts the input.
+        """
+        return self.__accept
+
+    def tables(self) -> ParseTables:
+        """
+        Returns the integer ACTION/GOTO tables the parser runs on.
+        """
+        return self.__tables
+
+    def session(self, mode: str = "tree", actions: Dict[Union[str, Tuple[str, Sequence[str]]], Callable[..., object]] = None,
+                handler: ParseHandler = None, sync: Iterable[str] = None, stats: ParseStats = None) -> ParseSession:
+        """
+        Starts an incremental parse. Tokens are pushed in with feed() and the input is ended with finish().
+
+        :param mode: What the parse produces. See ParseSession.
+        :param actions: The semantic actions for "actions" mode. See ParseSession.
+        :param handler: What receives the events in "events" mode.
+        :param sync: The terminals to resynchronize on after a syntax error, or None to stop at the first one. See ParseSession.
+        :param stats: If given, what the parser does is counted in it.
+        """
+        return ParseSession(self, mode, actions, handler, sync, stats)
+
+    def parse(self, arg: Union[str, Iterable[Union[Tuple[str, str], Token]]], mode: str = "tree",
+              actions: Dict[Union[str, Tuple[str, Sequence[str]]], Callable[..., object]] = None, handler: ParseHandler = None,
+              sync: Iterable[str] = None, stats: ParseStats = None) -> object:
+        """
+        Parses a whole input.
+
+        :param arg: A string to lex, or (terminal, raw token) pairs or Tokens.
+        :param mode: "tree" for a tree of ParseTreeNodes, "compact" for a CompactTree, "recognize" to only check the input,
+        "actions" to run semantic actions, or "events" to report the parse to a handler. See ParseSession.
+        :param actions: The semantic actions for "actions" mode.
+        :param handler: What receives the events in "events" mode.
+        :param sync: The terminals to resynchronize on after a syntax error.
+        If given, the whole input is parsed even if it has errors, and all of them are raised together at the end.
+        :param stats: If given, the shifts, reductions, stack depth and states used are counted in it.
+        :returns: What ParseSession.finish() returns for the mode.
+        :raise ParseException: The input is not in the language.
+        :raise ParseErrors: With sync, the input had syntax errors.
+        :raise ItemException: In "lazy" mode, the input reached a state with a conflict the resolver rejected.
+        """
         if isinstance(arg, str):
             arg = self.__grammar.lex([arg])
-        arg: Sequence[Tuple[str, str]] = arg
-
-        triples: Deque[Tuple[str, str]] = deque(arg)
-        triples.append(("$", "$"))
-
-        stack: Deque[Union[ParseTreeNode, int]] = deque(["$", 0])
 
-        while True:
-            look, raw = triples[0]
-            state: int = stack[len(stack) - 1]
-
-            # if we can shift on the lookahead symbol
-            if look in self.__sets[state].shift():
-                # pop the state
-                triples.popleft()
-                # push the symbol
-                stack.append(ParseTreeNode(look, []))
-                # push the new state
-                stack.append(self.__sets[state].shift()[look][0])
-
-            # if we can reduce on the lookahead symbol or epsilon
-            elif look in self.__sets[state].reduce() or "#" in self.__sets[state].reduce():
-                # get the item associated with the current lookahead
-                item = self.__sets[state].reduce()[look if look in self.__sets[state].reduce() else "#"]
-                # save the children
-                children = []
-                # pop each symbol in reverse
-                for x in reversed(item.prod()):
-                    if len(stack) < 3:
-                        raise ParseException("Cannot reduce on stack without at least 3 elements")
-                    if not isinstance(stack.pop(), int):
-                        raise ParseException("Internal error: expected to pop state, but popped token was not of type int")
-                    tmp = stack.pop()
-                    if tmp.sym() != x:
-                        raise ParseException("Internal error: popped token \"" + tmp.sym() + "\" does not match expected token \"" + x + "\"")
-                    children.append(tmp)
-                # set the state to what's on top of the stack
-                state = stack[len(stack) - 1]
-                # if the new state cannot shift on what was reduced, there is an error in the parser
-                if item.nt() not in self.__sets[state].shift():
-                    raise ParseException("Internal error: reduced item set does not have transition for \"" + item.nt() + "\"")
-                # if we reduced on the start symbol and there are no more symbols to read, parsing was successful
-                if item.nt() == self.__grammar.start() and look == "$":
-                    return
-                # push the symbol we reduced to
-                stack.append(ParseTreeNode(item.nt(), children))
-                # shift on the symbol we pushed, push the new state
-                stack.append(self.__sets[state].shift()[item.nt()][0])
-
-            # otherwise try shifting on epsilon
-            elif "#" in self.__sets[state].shift():
-                stack.append(ParseTreeNode("#", []))
-                stack.append(self.__sets[state].shift()["#"][0])
-
-            else:
-                raise ParseException("No transition defined at state " + str(state) + " for symbol " + str(look))
+        session = self.session(mode, actions, handler, sync, stats)
+        session.feed(arg)
+        return session.finish()
 
     def __str__(self) -> str:
-        return "\n".join(str(x[0]) + ":\n" + str(x[1]) + "\n" for x in enumerate(self.__sets)).strip()
+        return "\n".join(str(x[0]) + ":\n" + str(x[1]) + "\n" for x in enumerate(self.item_sets())).strip()
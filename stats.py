@@ -0,0 +1,206 @@
+from contextlib import contextmanager
+import time
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple, TypeVar
+
+
+T = TypeVar("T")
+
+
+class BuildStats:
+    """
+    What happened while an LR1Parser was being built: how long each phase took and how much work it did.
+    Pass one to LR1Parser to fill it in. Building without one does not pay for any of this.
+
+    The phases are:
+        "augment", adding the new start symbol to the grammar,
+        "cache", looking the tables up in a TableCache,
+        "cores", numbering the items and computing the FIRST sets of every suffix they need,
+        "generate", building the canonical collection,
+        "merge", merging states in the "lalr" and "minimal" modes,
+        "tables", compiling the states into ParseTables,
+        "store", saving the tables to a TableCache.
+    """
+
+    __phases: Dict[str, float]
+    __counters: Dict[str, int]
+    __items_per_state: List[int]
+
+    def __init__(self):
+        self.__phases = {}
+        self.__counters = {}
+        self.__items_per_state = []
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """
+        Times the code in a with block, adding it to a phase.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.__phases[name] = self.__phases.get(name, 0.0) + time.perf_counter() - start
+
+    def count(self, name: str, n: int = 1) -> None:
+        """
+        Adds to a counter.
+        """
+        self.__counters[name] = self.__counters.get(name, 0) + n
+
+    def counting(self, resolver: Callable[[T, T], T]) -> Callable[[T, T], T]:
+        """
+        Wraps a conflict resolver so every conflict it settles is counted under "conflicts".
+        """
+
+        def counted(i1: T, i2: T) -> T:
+            self.count("conflicts")
+            return resolver(i1, i2)
+
+        return counted
+
+    def set_items_per_state(self, counts: Sequence[int]) -> None:
+        self.__items_per_state = list(counts)
+
+    def phases(self) -> Dict[str, float]:
+        """
+        Returns the time spent in each phase, in seconds.
+        """
+        return self.__phases
+
+    def counters(self) -> Dict[str, int]:
+        """
+        Returns the counters:
+            "closures", item sets closed,
+            "closure_shape_hits", closures whose shape was already worked out for the same kernel cores,
+            "closure_items", items produced by closures,
+            "lookahead_masks", items whose lookahead FIRST set was precomputed,
+            "transitions", transitions between states,
+            "kernel_hits", transitions that led to a state that already existed,
+            "states", states in the canonical collection,
+            "merged_states", states left after merging,
+            "conflicts", conflicts settled by the resolver.
+        """
+        return self.__counters
+
+    def items_per_state(self) -> Sequence[int]:
+        """
+        Returns how many items each final state has.
+        """
+        return self.__items_per_state
+
+    def to_dict(self) -> Dict[str, object]:
+        """
+        Returns everything as plain dictionaries, ready to be written as JSON or sent to a metrics system.
+        """
+        items = self.__items_per_state
+        return {
+            "phases_ms": {k: v * 1000 for k, v in self.__phases.items()},
+            "counters": dict(self.__counters),
+            "items_per_state": {
+                "states": len(items),
+                "total": sum(items),
+                "min": min(items, default=0),
+                "max": max(items, default=0),
+                "mean": sum(items) / len(items) if len(items) > 0 else 0.0,
+            },
+        }
+
+    def __str__(self) -> str:
+        d = self.to_dict()
+        lines = ["%-20s %10.2f ms" % (k, v) for k, v in d["phases_ms"].items()]
+        lines += ["%-20s %10d" % (k, v) for k, v in d["counters"].items()]
+        lines += ["items per state      min %d, max %d, mean %.1f" % (d["items_per_state"]["min"], d["items_per_state"]["max"], d["items_per_state"]["mean"])]
+        return "\n".join(lines)
+
+
+class ParseStats:
+    """
+    What a parser did while parsing: how many shifts and reductions, how deep the stack got and which states were used.
+    Pass one to LR1Parser.parse() or a ParseSession to fill it in. The same object can collect over many parses.
+    """
+
+    __shifts: int
+    __reduces: int
+    __epsilons: int
+    __max_depth: int
+    __state_hits: List[int]
+    __production_hits: List[int]
+
+    def __init__(self):
+        self.__shifts = 0
+        self.__reduces = 0
+        self.__epsilons = 0
+        self.__max_depth = 0
+        self.__state_hits = []
+        self.__production_hits = []
+
+    def histograms(self, states: int, productions: int) -> Tuple[List[int], List[int]]:
+        """
+        Returns the lists the parser counts state and production hits in, making sure they are long enough for its tables.
+        """
+        if len(self.__state_hits) < states:
+            self.__state_hits.extend([0] * (states - len(self.__state_hits)))
+        if len(self.__production_hits) < productions:
+            self.__production_hits.extend([0] * (productions - len(self.__production_hits)))
+        return self.__state_hits, self.__production_hits
+
+    def add(self, shifts: int, reduces: int, epsilons: int, depth: int) -> None:
+        """
+        Adds the counts of one run of the parser.
+        """
+        self.__shifts += shifts
+        self.__reduces += reduces
+        self.__epsilons += epsilons
+        self.__max_depth = max(self.__max_depth, depth)
+
+    def shifts(self) -> int:
+        """
+        Returns how many terminals were shifted, not counting "#".
+        """
+        return self.__shifts
+
+    def reduces(self) -> int:
+        return self.__reduces
+
+    def epsilons(self) -> int:
+        """
+        Returns how many times "#" was shifted.
+        """
+        return self.__epsilons
+
+    def max_depth(self) -> int:
+        """
+        Returns the most states that were ever on the stack at once.
+        """
+        return self.__max_depth
+
+    def state_hits(self) -> Sequence[int]:
+        """
+        Returns how many actions were taken in each state, indexed by state.
+        """
+        return self.__state_hits
+
+    def production_hits(self) -> Sequence[int]:
+        """
+        Returns how many times each production was reduced, indexed like ParseTables.productions().
+        """
+        return self.__production_hits
+
+    def to_dict(self) -> Dict[str, object]:
+        """
+        Returns everything as plain dictionaries, ready to be written as JSON or sent to a metrics system.
+        Only the states and productions that were used are listed.
+        """
+        return {
+            "shifts": self.__shifts,
+            "reduces": self.__reduces,
+            "epsilons": self.__epsilons,
+            "max_depth": self.__max_depth,
+            "state_hits": {i: n for i, n in enumerate(self.__state_hits) if n > 0},
+            "production_hits": {i: n for i, n in enumerate(self.__production_hits) if n > 0},
+        }
+
+    def __str__(self) -> str:
+        hot = sorted(((n, i) for i, n in enumerate(self.__state_hits) if n > 0), reverse=True)[:5]
+        return "shifts %d, reduces %d, epsilons %d, max depth %d, busiest states %s" % (
+            self.__shifts, self.__reduces, self.__epsilons, self.__max_depth, ", ".join("%d (%d)" % (i, n) for n, i in hot))
@@ -0,0 +1,296 @@
+from array import array
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from typing import BinaryIO, Dict, Sequence, Tuple, Union
+
+
+# magic, format version, byte order, item size, fingerprint, states, terminals, nonterms, productions, names length, symbols on right hand sides
+_HEADER = struct.Struct("<8sBBBx32sIIIIII")
+_MAGIC = b"QUICCLRT"
+_VERSION = 1
+
+
+class ParseTables:
+    """
+    Dense LR tables with every symbol and production replaced by a small integer.
+
+    ACTION is a flat array indexed by state * len(terminals) + terminal:
+        0 is an error,
+        n > 0 shifts and goes to state n - 1,
+        n < 0 reduces by production -n - 1.
+    GOTO is a flat array indexed by state * len(nonterms) + nonterm, holding the next state or -1.
+    EPSILON holds, for each state, the state reached by shifting "#" when the lookahead has no action, or -1.
+
+    Production 0 is always the augmented start rule. Reducing by it accepts the input.
+
+    The tables can be written out with dump() and read back with load().
+    Loading maps the tables straight out of the buffer, so loading from an mmap does not copy them.
+    """
+
+    __terminals: Sequence[str]
+    __nonterms: Sequence[str]
+    __productions: Sequence[Tuple[str, Tuple[str, ...]]]
+    __action: Sequence[int]
+    __goto: Sequence[int]
+    __epsilon: Sequence[int]
+    __prod_lhs: array
+    __prod_len: array
+    __term_ids: Dict[str, int]
+    __nonterm_ids: Dict[str, int]
+    __prod_ids: Dict[Tuple[str, Tuple[str, ...]], int]
+
+    def __init__(self, terminals: Sequence[str], nonterms: Sequence[str], productions: Sequence[Tuple[str, Tuple[str, ...]]],
+                 action: Sequence[int], goto: Sequence[int], epsilon: Sequence[int]):
+        """
+        :param terminals: The terminals, indexed by id.
+        :param nonterms: The non-terminals, indexed by id. The first is the augmented start symbol.
+        :param productions: (non-terminal, right hand side) for each production, indexed by id.
+        :param action: The ACTION table. Any flat sequence of ints, such as an array or a memoryview.
+        :param goto: The GOTO table.
+        :param epsilon: The epsilon shift for each state.
+        """
+        self.__terminals = tuple(terminals)
+        self.__nonterms = tuple(nonterms)
+        self.__productions = tuple((nt, tuple(prod)) for nt, prod in productions)
+        self.__action = action
+        self.__goto = goto
+        self.__epsilon = epsilon
+        self.__term_ids = {x: i for i, x in enumerate(self.__terminals)}
+        self.__nonterm_ids = {x: i for i, x in enumerate(self.__nonterms)}
+        self.__prod_ids = {x: i for i, x in enumerate(self.__productions)}
+        self.__prod_lhs = array("i", (self.__nonterm_ids[nt] for nt, _ in self.__productions))
+        self.__prod_len = array("i", (len(prod) for _, prod in self.__productions))
+
+        if len(self.__action) != len(self.__epsilon) * len(self.__terminals) or len(self.__goto) != len(self.__epsilon) * len(self.__nonterms):
+            raise ValueError("Table sizes do not match the number of states and symbols")
+
+    def terminals(self) -> Sequence[str]:
+        return self.__terminals
+
+    def nonterms(self) -> Sequence[str]:
+        return self.__nonterms
+
+    def productions(self) -> Sequence[Tuple[str, Tuple[str, ...]]]:
+        return self.__productions
+
+    def term_ids(self) -> Dict[str, int]:
+        """
+        Returns a dictionary mapping each terminal to its id.
+        """
+        return self.__term_ids
+
+    def nonterm_ids(self) -> Dict[str, int]:
+        """
+        Returns a dictionary mapping each non-terminal to its id.
+        """
+        return self.__nonterm_ids
+
+    def production_id(self, nt: str, prod: Sequence[str]) -> int:
+        """
+        Returns the id of a production.
+        """
+        return self.__prod_ids[(nt, tuple(prod))]
+
+    def action(self) -> Sequence[int]:
+        return self.__action
+
+    def goto(self) -> Sequence[int]:
+        return self.__goto
+
+    def epsilon(self) -> Sequence[int]:
+        return self.__epsilon
+
+    def prod_lhs(self) -> array:
+        """
+        Returns the id of the non-terminal each production reduces to.
+        """
+        return self.__prod_lhs
+
+    def prod_len(self) -> array:
+        """
+        Returns the amount of symbols on the right hand side of each production.
+        """
+        return self.__prod_len
+
+    def num_states(self) -> int:
+        return len(self.__epsilon)
+
+    def expand(self, state: int) -> bool:
+        """
+        Builds a state that was left out when the tables were made, if they are built on demand.
+        Parsers call this when a state has no action for the lookahead, before reporting an error.
+
+        :returns: True if the state was built now and its row should be read again.
+        These tables are always complete, so this is always False.
+        """
+        return False
+
+    def complete(self) -> None:
+        """
+        Builds every state that was left out, so the tables can be read without calling expand().
+        These tables are always complete, so this does nothing.
+        """
+        pass
+
+    def dump(self, fp: BinaryIO, fingerprint: str) -> None:
+        """
+        Writes the tables in a compact binary format.
+        The names of the symbols come first, followed by each table as native 32-bit ints.
+
+        :param fp: A file opened for writing in binary mode.
+        :param fingerprint: The fingerprint of what the tables were built from, as a 64 digit hex string.
+        """
+        self.complete()
+        syms = {x: i for i, x in enumerate(self.__terminals)}
+        syms.update({x: len(self.__terminals) + i for i, x in enumerate(self.__nonterms)})
+        rhs = array("i", (syms[x] for _, prod in self.__productions for x in prod))
+        names = "\0".join(self.__terminals + self.__nonterms).encode("utf-8")
+        # pad so the tables are aligned
+        names += bytes(-(_HEADER.size + len(names)) % 8)
+
+        fp.write(_HEADER.pack(
+            _MAGIC, _VERSION, sys.byteorder == "little", array("i").itemsize, bytes.fromhex(fingerprint),
+            self.num_states(), len(self.__terminals), len(self.__nonterms), len(self.__productions), len(names), len(rhs),
+        ))
+        fp.write(names)
+        for arr in (self.__action, self.__goto, self.__epsilon, self.__prod_lhs, self.__prod_len, rhs):
+            fp.write(array("i", arr).tobytes())
+
+    @staticmethod
+    def load(buf: Union[bytes, memoryview, mmap.mmap], fingerprint: str) -> "ParseTables":
+        """
+        Reads tables written by dump().
+        The ACTION, GOTO and EPSILON tables are views into buf, so buf has to stay open while they are in use.
+
+        :param buf: The contents of the file.
+        :param fingerprint: The fingerprint the tables should have been written with.
+        :returns: The tables
+        :raise ValueError: buf is not a table file, was written by another platform or has a different fingerprint.
+        """
+        mv = memoryview(buf)
+        if len(mv) < _HEADER.size:
+            raise ValueError("Not a table file")
+        magic, version, little, itemsize, fp, ns, nt, nn, npr, nlen, nrhs = _HEADER.unpack_from(mv)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError("Not a table file")
+        if little != (sys.byteorder == "little") or itemsize != array("i").itemsize:
+            raise ValueError("Table file was written on a different platform")
+        if fp != bytes.fromhex(fingerprint):
+            raise ValueError("Table file has a different fingerprint")
+
+        pos = _HEADER.size
+        names = bytes(mv[pos:pos + nlen]).rstrip(b"\0").decode("utf-8").split("\0")
+        pos += nlen
+        if len(names) != nt + nn:
+            raise ValueError("Table file is corrupt")
+
+        def take(n: int) -> memoryview:
+            nonlocal pos
+            if pos + n * itemsize > len(mv):
+                raise ValueError("Table file is truncated")
+            ret = mv[pos:pos + n * itemsize].cast("i")
+            pos += n * itemsize
+            return ret
+
+        action = take(ns * nt)
+        goto = take(ns * nn)
+        epsilon = take(ns)
+        prod_lhs = take(npr)
+        prod_len = take(npr)
+        rhs = take(nrhs)
+
+        terminals = names[:nt]
+        nonterms = names[nt:]
+        productions = []
+        i = 0
+        for p in range(npr):
+            productions.append((nonterms[prod_lhs[p]], tuple(names[x] for x in rhs[i:i + prod_len[p]])))
+            i += prod_len[p]
+        return ParseTables(terminals, nonterms, productions, action, goto, epsilon)
+
+    def __eq__(self, other):
+        if not isinstance(other, ParseTables):
+            return False
+        return self.__terminals == other.__terminals and self.__nonterms == other.__nonterms and \
+            self.__productions == other.__productions and list(self.__action) == list(other.__action) and \
+            list(self.__goto) == list(other.__goto) and list(self.__epsilon) == list(other.__epsilon)
+
+    def __str__(self) -> str:
+        ret = ""
+        nt = len(self.__terminals)
+        nn = len(self.__nonterms)
+        for state in range(self.num_states()):
+            entries = []
+            for t in range(nt):
+                a = self.__action[state * nt + t]
+                if a > 0:
+                    entries.append(self.__terminals[t] + ":S" + str(a - 1))
+                elif a < 0:
+                    entries.append(self.__terminals[t] + ":R" + str(-a - 1))
+            for n in range(nn):
+                g = self.__goto[state * nn + n]
+                if g >= 0:
+                    entries.append(self.__nonterms[n] + ":G" + str(g))
+            if self.__epsilon[state] >= 0:
+                entries.append("#:E" + str(self.__epsilon[state]))
+            ret += str(state) + ": " + " ".join(entries) + "\n"
+        return ret.strip()
+
+
+class TableCache:
+    """
+    A directory of table files, each named after the fingerprint of what it was built from.
+    """
+
+    __directory: str
+
+    def __init__(self, directory: str):
+        """
+        :param directory: Where the tables are kept. It is created if it does not exist.
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.__directory = directory
+
+    def directory(self) -> str:
+        return self.__directory
+
+    def path(self, fingerprint: str) -> str:
+        return os.path.join(self.__directory, fingerprint + ".lrt")
+
+    def load(self, fingerprint: str) -> Union[ParseTables, None]:
+        """
+        Maps cached tables into memory.
+
+        :param fingerprint: The fingerprint of the tables.
+        :returns: The tables, or None if they are not cached or the file cannot be used.
+        """
+        try:
+            with open(self.path(fingerprint), "rb") as f:
+                # the mapping stays valid after the file is closed
+                m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+        try:
+            return ParseTables.load(m, fingerprint)
+        except ValueError:
+            return None
+
+    def store(self, fingerprint: str, tables: ParseTables) -> None:
+        """
+        Saves tables to the cache.
+        The file is written under a temporary name and renamed into place, so a reader never sees a partial file.
+
+        :param fingerprint: The fingerprint of the tables.
+        :param tables: The tables.
+        """
+        fd, tmp = tempfile.mkstemp(dir=self.__directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                tables.dump(f, fingerprint)
+            os.replace(tmp, self.path(fingerprint))
+        except BaseException:
+            os.unlink(tmp)
+            raise
@@ -0,0 +1,86 @@
+from batch import main, parse_many
+from grammar import Grammar
+from parser import LR1Parser, resolve_shift
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+
+
+class ParseManyTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.parser = LR1Parser(Grammar([
+            "S -> S ( S ) | #",
+        ]), resolve_shift)
+        self.paths = []
+        for i, text in enumerate(["()", "(()\n())", "(", "())", "(x)", ""] * 5):
+            path = os.path.join(self.dir.name, str(i) + ".txt")
+            with open(path, "w") as f:
+                f.write(text)
+            self.paths.append(path)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_in_process(self):
+        results = list(parse_many(self.parser, self.paths, workers=1))
+        self.assertEqual([r.path() for r in results], self.paths)
+        self.assertEqual([r.ok() for r in results[:6]], [True, True, False, False, False, True])
+        self.assertEqual(results[1].tokens(), 6)
+        self.assertRegex(results[2].error(), "at end of input")
+        self.assertRegex(results[3].error(), "at line 1, column 2")
+        self.assertRegex(results[4].error(), "Invalid token")
+
+    def test_pool_matches(self):
+        expected = [str(r) for r in parse_many(self.parser, self.paths, workers=1)]
+        self.assertEqual([str(r) for r in parse_many(self.parser, self.paths, workers=2, chunksize=4)], expected)
+
+    def test_quoted_terminal(self):
+        # the workers must see "a b" as one terminal, not two
+        x = LR1Parser(Grammar([
+            "S -> \"a b\" c",
+        ]), resolve_shift)
+        path = os.path.join(self.dir.name, "quoted.txt")
+        with open(path, "w") as f:
+            f.write("a b c")
+        for workers in (1, 2):
+            self.assertEqual([str(r) for r in parse_many(x, [path], workers=workers)], [path + ": ok"])
+
+    def test_streams_paths(self):
+        read = []
+
+        def paths():
+            for path in self.paths:
+                read.append(path)
+                yield path
+
+        results = parse_many(self.parser, paths(), workers=2, chunksize=2)
+        next(results)
+        # only a few batches per worker are read ahead
+        self.assertLess(len(read), len(self.paths))
+        self.assertEqual(len(list(results)), len(self.paths) - 1)
+
+    def test_sync(self):
+        path = os.path.join(self.dir.name, "errors.txt")
+        with open(path, "w") as f:
+            f.write("()) ()) ()")
+        result = list(parse_many(self.parser, [path], workers=1, sync=[")"]))[0]
+        self.assertEqual(result.error().count("unexpected"), 2)
+
+    def test_missing_file(self):
+        results = list(parse_many(self.parser, [os.path.join(self.dir.name, "missing")], workers=1))
+        self.assertFalse(results[0].ok())
+
+    def test_cli(self):
+        grammar = os.path.join(self.dir.name, "grammar")
+        with open(grammar, "w") as f:
+            f.write("S -> S ( S ) | #\n")
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            self.assertEqual(main([grammar] + self.paths[:2] + ["-j", "1"]), 0)
+            self.assertEqual(main([grammar] + self.paths[:3] + ["-j", "2", "-q"]), 1)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines, [self.paths[0] + ": ok", self.paths[1] + ": ok", lines[2]])
+        self.assertTrue(lines[2].startswith(self.paths[2] + ": "))
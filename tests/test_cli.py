@@ -0,0 +1,30 @@
+from cli import add_grammar_arguments, parse_specials, read_rules
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+
+
+class CliTest(unittest.TestCase):
+    def test_read_rules(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "rules")
+            with open(path, "w") as f:
+                f.write("S -> a S | #\n\n  S -> b  \n")
+            self.assertEqual(read_rules(path), ["S -> a S | #", "S -> b"])
+
+    def test_specials(self):
+        ap = argparse.ArgumentParser()
+        add_grammar_arguments(ap)
+        args = ap.parse_args(["rules", "-sNUM=[0-9]+", "-s", "EQ==", "-m", "lalr"])
+        self.assertEqual(args.mode, "lalr")
+        # only the first "=" splits the name from the regex
+        self.assertEqual(parse_specials(ap, args.special), {"NUM": "[0-9]+", "EQ": "="})
+        with contextlib.redirect_stderr(io.StringIO()):
+            self.assertRaises(SystemExit, lambda: parse_specials(ap, ["NUM"]))
+
+
+if __name__ == '__main__':
+    unittest.main()
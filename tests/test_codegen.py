@@ -0,0 +1,109 @@
+from codegen import generate, main
+from grammar import Grammar
+from parser import LR1Parser, ParseTreeNode, resolve_shift
+from main import CMINUS_RULES, CMINUS_SOURCE, CMINUS_SPECIALS
+import importlib.util
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+import warnings
+
+
+def load(path):
+    spec = importlib.util.spec_from_file_location(os.path.basename(path)[:-3], path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def convert(node):
+    return ParseTreeNode(node.symbol, [convert(x) for x in node.children])
+
+
+class CodegenTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def module(self, parser, spcl=None):
+        path = os.path.join(self.dir.name, "generated_parser.py")
+        with open(path, "w") as f:
+            f.write(generate(parser, spcl))
+        return load(path)
+
+    def test_matches_parser(self):
+        g = Grammar(CMINUS_RULES)
+        for mode in ("lr1", "lalr"):
+            x = LR1Parser(g, resolve_shift, mode=mode)
+            y = self.module(x, CMINUS_SPECIALS)
+            tokens = y.lex("\n".join(CMINUS_SOURCE))
+            self.assertEqual([t[:2] for t in tokens], list(g.lex(CMINUS_SOURCE, CMINUS_SPECIALS)))
+            self.assertEqual(convert(y.parse(tokens)), x.parse(tokens))
+            self.assertTrue(y.parse(tokens, tree=False))
+            self.assertEqual(list(y.ACTION), list(x.tables().action()))
+
+    def test_epsilon(self):
+        x = LR1Parser(Grammar([
+            "S -> a S b | #",
+        ]), resolve_shift)
+        y = self.module(x)
+        self.assertEqual(convert(y.parse("a a b b")), x.parse("a a b b"))
+        self.assertEqual(y.parse("").symbol, "S")
+        self.assertEqual(y.parse("a b").children[0].value, "a")
+
+    def test_epsilon_loop(self):
+        # the merged states would shift "#" and reduce B forever on c
+        x = LR1Parser(Grammar([
+            "A -> a a | B C c",
+            "B -> #",
+            "C -> A b B | b",
+        ]), resolve_shift, mode="lalr")
+        y = self.module(x)
+        self.assertEqual(convert(y.parse("b c")), x.parse("b c"))
+        self.assertRaises(y.ParseError, lambda: y.parse("c"))
+        self.assertRaises(y.ParseError, lambda: y.parse("a a c"))
+
+    def test_escapes(self):
+        # terminals are pasted into the module, so backslashes and quotes must not break its syntax
+        x = LR1Parser(Grammar([
+            ("S", ("\\x", "S")),
+            ("S", ("\\d", "S")),
+            ("S", ('"""', "S")),
+            ("S", ("end",)),
+        ]), resolve_shift)
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            y = self.module(x)
+        text = '\\x \\d """ end'
+        self.assertEqual(convert(y.parse(text)), x.parse(text))
+
+    def test_errors(self):
+        y = self.module(LR1Parser(Grammar(CMINUS_RULES), resolve_shift), CMINUS_SPECIALS)
+        with self.assertRaises(y.ParseError) as e:
+            y.parse("int main(void) {\n  return 0\n}")
+        self.assertIn("line 3, column 0", str(e.exception))
+        self.assertRaises(y.ParseError, lambda: y.parse("int main(void) { $ }"))
+        self.assertRaises(y.ParseError, lambda: y.parse([("int", "int"), ("nope", "nope")]))
+
+    def test_standalone(self):
+        rules = os.path.join(self.dir.name, "grammar.txt")
+        with open(rules, "w") as f:
+            f.write("\n".join(CMINUS_RULES))
+        out = os.path.join(self.dir.name, "cminus.py")
+        main([rules, "-o", out] + ["-s" + k + "=" + v for k, v in CMINUS_SPECIALS.items()])
+
+        # run from the output directory, where none of this package can be imported
+        script = "import sys, cminus; print(cminus.parse(sys.stdin.read()).symbol, 'grammar' in sys.modules, 'parser' in sys.modules)"
+        env = {k: v for k, v in os.environ.items() if k != "PYTHONPATH"}
+        res = subprocess.run([sys.executable, "-c", script], cwd=self.dir.name, env=env, input="\n".join(CMINUS_SOURCE),
+                             capture_output=True, text=True)
+        self.assertEqual(res.returncode, 0, res.stderr)
+        self.assertEqual(res.stdout.split(), ["program", "False", "False"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+from glr import GLRParser
+from grammar import Grammar
+from parser import LR1Parser, ParseException, resolve_shift
+from main import CMINUS_RULES, CMINUS_SOURCE, CMINUS_SPECIALS
+import unittest
+
+
+class GLRTest(unittest.TestCase):
+    def test_ambiguous(self):
+        x = GLRParser(Grammar([
+            "E -> E + E | n",
+        ]))
+        # the number of ways to bracket a sum is a Catalan number
+        for terms, trees in ((1, 1), (3, 2), (4, 5), (10, 4862)):
+            forest = x.parse([("n", "n")] + [("+", "+"), ("n", "n")] * (terms - 1))
+            self.assertEqual(forest.count_trees(), trees)
+        self.assertRaises(ParseException, lambda: x.parse([("n", "n"), ("+", "+")]))
+
+    def test_shared(self):
+        x = GLRParser(Grammar([
+            "E -> E + E | n",
+        ]))
+        # exponentially many trees, packed into a forest that stays polynomial
+        forest = x.parse([("n", "n")] + [("+", "+"), ("n", "n")] * 40)
+        self.assertEqual(forest.count_trees(), 2622127042276492108820)
+        self.assertTrue(forest.ambiguous())
+        self.assertEqual((forest.symbol(), forest.start(), forest.end()), ("E", 0, 81))
+
+    def test_matches_lr(self):
+        x = Grammar(CMINUS_RULES)
+        tokens = x.lex(CMINUS_SOURCE, CMINUS_SPECIALS)
+        y = GLRParser(x)
+        forest = y.parse(tokens)
+        self.assertEqual(forest.count_trees(), 1)
+        self.assertEqual(forest.tree(), LR1Parser(x, resolve_shift).parse(tokens))
+        # only the dangling else is left as a conflict
+        self.assertEqual(len(y.conflicts()), 1)
+
+    def test_dangling_else(self):
+        x = Grammar(CMINUS_RULES)
+        tokens = x.lex(["void f(void) { if (1) if (2) x = 1; else x = 2; }"], CMINUS_SPECIALS)
+        for mode in ("lr1", "lalr"):
+            self.assertEqual(GLRParser(x, mode).parse(tokens).count_trees(), 2)
+
+    def test_epsilon(self):
+        x = GLRParser(Grammar([
+            "S -> A S b | #",
+            "A -> a | #",
+        ]))
+        self.assertEqual(x.parse("").count_trees(), 1)
+        self.assertEqual(x.parse([("a", "a"), ("b", "b"), ("b", "b")]).count_trees(), 2)
+        self.assertRaises(ParseException, lambda: x.parse([("a", "a")]))
+
+    def test_cyclic(self):
+        x = GLRParser(Grammar([
+            "S -> S | a",
+        ]))
+        forest = x.parse([("a", "a")])
+        self.assertEqual([c.sym() for c in forest.tree().children()], ["a"])
+        self.assertRaises(ValueError, forest.count_trees)
@@ -1,4 +1,5 @@
-from grammar import CFGException, Grammar
+from grammar import CFGException, Grammar, SymbolTable, TerminalBits
+import pickle
 import unittest
 
 
@@ -44,6 +45,124 @@ class FirstFollowTests(unittest.TestCase):
             "D": {"d", "#"},
         })
 
+    def test_follow(self):
+        x = Grammar([
+            "S -> A B C",
+            "A -> a | #",
+            "B -> A D | b",
+            "C -> c d",
+            "D -> d | #"
+        ])
+        self.assertEqual(x.follow_sets(), {
+            "S": {"$"},
+            "A": {"a", "d", "b", "c"},
+            "B": {"c"},
+            "C": {"$"},
+            "D": {"c"},
+        })
+
+    def test_cached(self):
+        x = Grammar([
+            "S -> A b",
+            "A -> a | #",
+        ])
+        self.assertIs(x.first_sets(), x.first_sets())
+        self.assertIs(x.follow_sets(), x.follow_sets())
+        self.assertEqual(x.epsilon_nonterms(), {"#", "A"})
+
+        def assign():
+            x.first_sets()["S"] = set()
+        self.assertRaises(TypeError, assign)
+        self.assertRaises(AttributeError, lambda: x.first_sets()["A"].add("c"))
+
+    def test_pickle_after_analysis(self):
+        x = Grammar([
+            "S -> A b",
+            "A -> a | #",
+        ])
+        x.first_sets()
+        x.follow_sets()
+        x.suffix_firsts()
+        x.lex(["ab"])
+        y = pickle.loads(pickle.dumps(x))
+        self.assertEqual(x, y)
+        self.assertEqual(hash(x), hash(y))
+        self.assertEqual(y.first_sets(), x.first_sets())
+        self.assertEqual(y.follow_sets(), x.follow_sets())
+
+    def test_long_chain(self):
+        # every non-terminal is in one cycle, which has to be handled without recursion
+        n = 2000
+        x = Grammar(["N" + str(i) + " -> N" + str((i + 1) % n) + " x" + str(i) + " | y" + str(i) for i in range(n)])
+        self.assertEqual(len(x.first_sets()["N0"]), n)
+        self.assertEqual(x.first_sets()["N0"], x.first_sets()["N1"])
+        self.assertEqual(x.follow_sets()["N0"], {"$", "x" + str(n - 1)})
+        self.assertEqual(x.follow_sets()["N1"], {"x0"})
+
+
+class BitsTests(unittest.TestCase):
+    def test_roundtrip(self):
+        x = TerminalBits(["a", "b", "c", "$"])
+        self.assertEqual(x.encode(["a", "c"]), 0b101)
+        self.assertEqual(x.decode(0b1010), {"b", "$"})
+        self.assertEqual(x.decode(0), set())
+        self.assertEqual(x.bit("$"), 0b1000)
+
+    def test_masks(self):
+        x = Grammar([
+            "S -> A B C",
+            "A -> a | #",
+            "B -> A D | b",
+            "C -> c d",
+            "D -> d | #"
+        ])
+        bits = x.terminal_bits()
+        self.assertEqual(bits.terminals()[-1], "$")
+        self.assertEqual({nt: bits.decode(m) for nt, m in x.first_masks().items()}, x.first_sets())
+        self.assertEqual({nt: bits.decode(m) for nt, m in x.follow_masks().items()}, x.follow_sets())
+
+    def test_suffix_firsts(self):
+        x = Grammar([
+            "S -> A B c | B A",
+            "A -> a | #",
+            "B -> b | #",
+        ])
+        bits = x.terminal_bits()
+        suffixes = [(bits.decode(m), v) for m, v in x.suffix_firsts()[("A", "B", "c")]]
+        self.assertEqual(suffixes, [({"a", "b", "c"}, False), ({"b", "c"}, False), ({"c"}, False), (set(), True)])
+        # "#" never shows up as a lookahead, it only makes the suffix vanish
+        self.assertEqual(x.suffix_firsts()[("#",)], ((0, True), (0, True)))
+        self.assertEqual([(bits.decode(m), v) for m, v in x.suffix_firsts()[("B", "A")]], [({"a", "b"}, True), ({"a"}, True), (set(), True)])
+
+
+class SymbolTableTests(unittest.TestCase):
+    def test_order(self):
+        x = Grammar([
+            "S -> B a | #",
+            "B -> c S | A",
+            "A -> b",
+        ])
+        self.assertEqual(x.nonterms(), ("S", "A", "B"))
+        self.assertEqual(x.symbols().symbols(), ("S", "A", "B", "a", "b", "c", "#"))
+        self.assertEqual(x.terminals(), {"a", "b", "c", "#"})
+        self.assertEqual(x.symbols().terminals(), {"a", "b", "c"})
+        self.assertEqual(x.symbols().nonterms(), {"S", "A", "B"})
+
+    def test_kinds(self):
+        x = Grammar([
+            "S -> A a | #",
+            "A -> b",
+        ])
+        table = x.symbols()
+        self.assertEqual(table.kind("S"), SymbolTable.NONTERM)
+        self.assertEqual(table.kind("a"), SymbolTable.TERMINAL)
+        self.assertEqual(table.kind("#"), SymbolTable.EPSILON)
+        self.assertTrue(table.is_nonterm("A"))
+        self.assertFalse(table.is_terminal("#"))
+        self.assertEqual(table.symbol(table.id("b")), "b")
+        self.assertNotIn("c", table)
+        self.assertRaises(KeyError, lambda: table.kind("c"))
+
 
 class LexTests(unittest.TestCase):
     def test_lexer_prefix1(self):
@@ -72,3 +191,27 @@ class LexTests(unittest.TestCase):
         ])
 
         self.assertRaises(CFGException, lambda: x.lex(["d A"]))
+
+
+class FingerprintTests(unittest.TestCase):
+    def test_stable(self):
+        x = Grammar([
+            "S -> a b | c",
+            "S -> d",
+            "T -> S"
+        ])
+        y = Grammar([
+            "S -> d | c | a b",
+            "T -> S"
+        ])
+        self.assertEqual(x.fingerprint(), y.fingerprint())
+        self.assertEqual(hash(x), hash(y))
+
+    def test_different(self):
+        x = Grammar([
+            "S -> a b",
+        ])
+        y = Grammar([
+            "S -> ab",
+        ])
+        self.assertNotEqual(x.fingerprint(), y.fingerprint())
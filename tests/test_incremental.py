@@ -0,0 +1,117 @@
+from grammar import Grammar
+from incremental import IncrementalParser, SyntaxNode
+from lexer import Lexer
+from parser import LR1Parser, ParseException, resolve_shift
+from main import CMINUS_RULES, CMINUS_SOURCE, CMINUS_SPECIALS
+import random
+import unittest
+
+
+class IncrementalTest(unittest.TestCase):
+    def setUp(self):
+        self.grammar = Grammar(CMINUS_RULES)
+        self.parser = LR1Parser(self.grammar, resolve_shift)
+        self.lexer = Lexer(self.grammar, CMINUS_SPECIALS)
+        self.inc = IncrementalParser(self.parser, CMINUS_SPECIALS)
+        self.source = "\n".join(CMINUS_SOURCE)
+
+    def full(self, text):
+        return self.parser.parse(list(self.lexer.scan(text)))
+
+    def test_parse(self):
+        x = self.inc.parse(self.source)
+        self.assertEqual(x.tree(), self.full(self.source))
+        self.assertEqual(x.root().width(), len(self.source.rstrip()))
+        self.assertEqual(x.reused(), 0)
+
+    def test_edit(self):
+        x = self.inc.parse(self.source)
+        pos = self.source.index("return")
+        y = self.inc.reparse(x, pos, pos, "x = 1; ")
+        self.assertEqual(y.text(), self.source[:pos] + "x = 1; " + self.source[pos:])
+        self.assertEqual(y.tree(), self.full(y.text()))
+        self.assertGreater(y.reused(), 0)
+        # only the tokens around the edit are lexed
+        self.assertLess(y.lexed(), 10)
+        # the previous result is left alone
+        self.assertEqual(x.tree(), self.full(self.source))
+
+    def test_shares_subtrees(self):
+        src = "\n".join(CMINUS_SOURCE * 20)
+        x = self.inc.parse(src)
+        pos = src.rindex("return")
+        y = self.inc.reparse(x, pos, pos + len("return"), "return")
+        self.assertEqual(y.tree(), x.tree())
+        # the declarations before the edit are reused as the start of the list and a few runs, so the new tree shares them with the old one
+        old, new = x.root().children()[0], y.root().children()[0]
+        self.assertEqual(new.kind(), SyntaxNode.LIST)
+        self.assertIs(new.children()[0], old.children()[0])
+        self.assertIs(new.children()[1].children()[0], old.children()[1].children()[0])
+
+    def test_epsilon_loop(self):
+        # the merged states would shift "#" and reduce B forever on c
+        inc = IncrementalParser(LR1Parser(Grammar(["A -> a a | B C c", "B -> #", "C -> A b B | b"]), resolve_shift, mode="lalr"))
+        x = inc.parse("b c")
+        self.assertRaises(ParseException, lambda: inc.reparse(x, 0, 2, ""))
+        self.assertRaises(ParseException, lambda: inc.parse("c"))
+
+    def test_lists(self):
+        for rules in (["L -> E L | E", "E -> d ;"], ["L -> L E | E", "E -> d ;"]):
+            inc = IncrementalParser(LR1Parser(Grammar(rules), resolve_shift))
+            reused = []
+            for n in (100, 300):
+                text = "d ; " * n
+                y = inc.reparse(inc.parse(text), 40, 41, "d")
+                self.assertEqual(y.tree(), inc.parse(y.text()).tree())
+                self.assertEqual(y.lexed(), 2)
+                reused.append(y.reused())
+            # the elements after the edit are reused as a few runs, not one at a time
+            self.assertLess(reused[1], 20)
+            self.assertLessEqual(reused[1] - reused[0], 4)
+
+    def test_long_source(self):
+        # an edit costs about as much in a long text as in a short one
+        costs = []
+        for copies in (10, 1000):
+            src = "\n".join(CMINUS_SOURCE * copies)
+            x = self.inc.parse(src)
+            pos = src.index("return", len(src) // 2)
+            y = self.inc.reparse(x, pos, pos, "x = 1; ")
+            self.assertEqual(y.text(), src[:pos] + "x = 1; " + src[pos:])
+            self.assertEqual(y.lexed(), 6)
+            if copies == 10:
+                self.assertEqual(y.tree(), self.full(y.text()))
+            costs.append((y.reused(), y.steps()))
+        self.assertLess(costs[1][0], 2 * costs[0][0])
+        self.assertLess(costs[1][1], costs[0][1] + 20)
+        self.assertLess(costs[1][1], 100)
+
+    def test_random_edits(self):
+        tokens = [t.raw() for t in self.lexer.scan(self.source)]
+        rnd = random.Random(1)
+        x = self.inc.parse(self.source)
+        for _ in range(300):
+            text = x.text()
+            start = rnd.randrange(len(text) + 1)
+            end = min(len(text), start + rnd.choice((0, 1, 3, 10)))
+            ins = rnd.choice(("", " ", rnd.choice(tokens), text[start:end]))
+            new = text[:start] + ins + text[end:]
+            try:
+                expected = self.full(new)
+            except ParseException:
+                self.assertRaises(ParseException, lambda: self.inc.reparse(x, start, end, ins))
+                continue
+            x = self.inc.reparse(x, start, end, ins)
+            self.assertEqual(x.tree(), expected)
+
+    def test_epsilon(self):
+        x = IncrementalParser(LR1Parser(Grammar(["S -> a S b S | #"]), resolve_shift))
+        y = x.parse("a a b b")
+        z = x.reparse(y, 2, 2, "a b ")
+        self.assertEqual(z.text(), "a a b a b b")
+        self.assertEqual(z.tree(), x.parser().parse("a a b a b b"))
+        self.assertRaises(ParseException, lambda: x.reparse(z, 0, 1, ""))
+
+
+if __name__ == '__main__':
+    unittest.main()
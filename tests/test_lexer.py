@@ -0,0 +1,236 @@
+from grammar import CFGException, Grammar
+from lexer import Lexer, trie_pattern
+import io
+import mmap
+import re
+import tempfile
+import unittest
+
+
+class TriePatternTests(unittest.TestCase):
+    def test_longest(self):
+        x = re.compile(trie_pattern(["if", "in", "int", "i"]))
+        self.assertEqual(x.match("int").group(), "int")
+        self.assertEqual(x.match("inx").group(), "in")
+        self.assertEqual(x.match("ix").group(), "i")
+        self.assertIsNone(x.match("x"))
+
+    def test_empty(self):
+        self.assertIsNone(re.compile(trie_pattern([])).match("abc"))
+
+
+class LexerTests(unittest.TestCase):
+    def test_tie_prefers_literal(self):
+        x = Grammar([
+            "S -> abc | ID"
+        ])
+        y = Lexer(x, {"ID": "[a-z]+"})
+        self.assertEqual(
+            y.lex(["abc abcd", " abcab "]),
+            [("abc", "abc"), ("ID", "abcd"), ("ID", "abcab")],
+        )
+
+    def test_tie_prefers_first_special(self):
+        x = Grammar([
+            "S -> A B",
+        ])
+        y = Lexer(x, {"A": "[a-z]+", "B": "[a-z0-9]+"})
+        self.assertEqual(
+            y.lex(["ab ab1"]),
+            [("A", "ab"), ("B", "ab1")],
+        )
+
+    def test_matches_grammar_lex(self):
+        x = Grammar([
+            "S -> S T | T",
+            "T -> < | <= | = | == | NUM",
+        ])
+        y = Lexer(x, {"NUM": "[0-9]+"})
+        ip = ["<=<==", "12 = =="]
+        self.assertEqual(y.lex(ip), x.lex(ip, {"NUM": "[0-9]+"}))
+        self.assertEqual(y.lex(ip), [("<=", "<="), ("<=", "<="), ("=", "="), ("NUM", "12"), ("=", "="), ("==", "==")])
+
+    def test_invalid(self):
+        x = Grammar([
+            "S -> a b",
+        ])
+        self.assertRaises(CFGException, lambda: Lexer(x).lex(["a c"]))
+        self.assertRaises(CFGException, lambda: Lexer(x, {"ID": "[a-z"}))
+        # each special is fine alone, but the group name is taken twice in the combined pattern
+        self.assertRaises(CFGException, lambda: Lexer(x, {"A": "(?P<q>a)", "B": "(?P<q>b)"}))
+
+    def test_groups_and_flags(self):
+        x = Grammar([
+            "S -> S T | T",
+            "T -> STR | KW | TAG",
+        ])
+        y = Lexer(x, {"STR": "(['\"]).*?\\1", "KW": "(?i)select", "TAG": "<([a-z]+)>[^<]*</\\1>|[\\1]"})
+        self.assertEqual(
+            y.lex(["'a\"b' SeLeCt <p>x</p> \"c\" \x01"]),
+            [("STR", "'a\"b'"), ("KW", "SeLeCt"), ("TAG", "<p>x</p>"), ("STR", '"c"'), ("TAG", "\x01")],
+        )
+        self.assertRaises(CFGException, lambda: y.lex(["<p>x</b>"]))
+
+    def test_leading_anchor(self):
+        # specials used to be matched against the rest of the line, so a leading anchor held at every token
+        x = Grammar([
+            "S -> S x | x",
+        ])
+        self.assertEqual(x.lex(["ab cd"], {"x": "^[a-z]+"}), [("x", "ab"), ("x", "cd")])
+        y = Lexer(x, {"x": "\\A[a-z]+|^[0-9]+"})
+        self.assertEqual(y.lex(["ab 12 cd"]), [("x", "ab"), ("x", "12"), ("x", "cd")])
+        self.assertEqual([tuple(t) for t in y.scan(b"ab\n12")], [("x", "ab"), ("x", "12")])
+        # anywhere else an anchor still looks at the whole line
+        self.assertRaises(CFGException, lambda: Lexer(x, {"x": "(^[a-z]+)"}).lex(["ab cd"]))
+
+
+class ScanTests(unittest.TestCase):
+    def test_spans(self):
+        x = Grammar([
+            "S -> S T | T",
+            "T -> ( | ) | ID",
+        ])
+        y = Lexer(x, {"ID": "[a-z]+"})
+        tokens = list(y.scan("(ab\n  cd )"))
+        self.assertEqual([tuple(t) for t in tokens], [("(", "("), ("ID", "ab"), ("ID", "cd"), (")", ")")])
+        self.assertEqual([(t.start(), t.end()) for t in tokens], [(0, 1), (1, 3), (6, 8), (9, 10)])
+        self.assertEqual([(t.line(), t.col()) for t in tokens], [(1, 0), (1, 1), (2, 2), (2, 5)])
+
+    def test_binary(self):
+        x = Grammar([
+            "S -> S T | T",
+            "T -> ( | ) | ID",
+        ])
+        y = Lexer(x, {"ID": "[a-z]+"})
+        text = "(ab (cd))\n(ef)"
+        expected = [tuple(t) for t in y.scan(text)]
+        self.assertEqual([tuple(t) for t in y.scan(text.encode())], expected)
+        self.assertEqual([tuple(t) for t in y.scan(memoryview(text.encode()))], expected)
+        self.assertEqual([tuple(t) for t in y.scan(bytearray(text.encode()))], expected)
+
+    def test_binary_non_ascii(self):
+        x = Grammar([
+            "S -> S T | T",
+            "T -> é | ID",
+        ])
+        # encoded, the class would be two separate bytes and match half of "é" or "è"
+        y = Lexer(x, {"ID": "[éa]+"})
+        self.assertEqual([tuple(t) for t in y.scan("aé é")], [("ID", "aé"), ("é", "é")])
+        self.assertRaisesRegex(CFGException, "non-ASCII", lambda: list(y.scan("aé".encode())))
+        self.assertRaises(CFGException, lambda: list(Lexer(x, {"ID": "[\\u00e9a]+"}).scan(b"a")))
+        # an escaped backslash followed by u is not a code point
+        w = Lexer(x, {"ID": "\\\\u[0-9]+"})
+        self.assertEqual([tuple(t) for t in w.scan(b"\\u12 \\u3")], [("ID", "\\u12"), ("ID", "\\u3")])
+        # literals are fine on their own
+        z = Lexer(x, {"ID": "[a-z]+"})
+        self.assertEqual([tuple(t) for t in z.scan("é ab é".encode())], [("é", "é"), ("ID", "ab"), ("é", "é")])
+
+    def test_binary_unicode_classes(self):
+        x = Grammar([
+            "S -> S ID | ID",
+        ])
+        # for str, \w matches "é", but for bytes it would only match ASCII
+        y = Lexer(x, {"ID": "\\w+"})
+        self.assertEqual([tuple(t) for t in y.scan("aé b")], [("ID", "aé"), ("ID", "b")])
+        self.assertRaisesRegex(CFGException, "only matches ASCII", lambda: list(y.scan(b"ab")))
+        for regex in ("[\\d]+", "\\S+", "a\\b"):
+            self.assertRaises(CFGException, lambda: list(Lexer(x, {"ID": regex}).scan(b"a")))
+        # inside of a class \b is a backspace, and the ASCII flag makes both kinds of input agree
+        self.assertEqual([tuple(t) for t in Lexer(x, {"ID": "[a\\b]+"}).scan(b"a")], [("ID", "a")])
+        z = Lexer(x, {"ID": "(?a)\\w+"})
+        self.assertEqual([tuple(t) for t in z.scan(b"ab c")], [tuple(t) for t in z.scan("ab c")])
+
+    def test_multiline_token(self):
+        x = Grammar([
+            "S -> S T | T",
+            "T -> STR | ID",
+        ])
+        y = Lexer(x, {"STR": "'[^']*'", "ID": "[a-z]+"})
+        tokens = list(y.scan("a 'b\nc' d"))
+        self.assertEqual([t.raw() for t in tokens], ["a", "'b\nc'", "d"])
+        self.assertEqual([(t.line(), t.col()) for t in tokens], [(1, 0), (1, 2), (2, 3)])
+
+    def test_invalid(self):
+        x = Grammar([
+            "S -> a b",
+        ])
+        tokens = Lexer(x).scan("a\n b c")
+        self.assertEqual(tuple(next(tokens)), ("a", "a"))
+        self.assertEqual(tuple(next(tokens)), ("b", "b"))
+        self.assertRaisesRegex(CFGException, "line 2, column 3", lambda: next(tokens))
+
+
+class StreamTests(unittest.TestCase):
+    def setUp(self):
+        x = Grammar([
+            "S -> S T | T",
+            "T -> < | <= | <== | ( | ) | ID | NUM",
+        ])
+        self.lexer = Lexer(x, {"ID": "[a-z]+", "NUM": "[0-9]+\\.[0-9]+|[0-9]+"})
+        self.text = "(abc <== 12.5)\n\n  <=< defghij\n(3.14 ( 7 ) ) xyz<"
+
+    def spans(self, tokens):
+        return [(t.terminal(), t.raw(), t.start(), t.end(), t.line(), t.col()) for t in tokens]
+
+    def test_chunk_boundaries(self):
+        expected = self.spans(self.lexer.scan(self.text))
+        for size in range(1, 9):
+            self.assertEqual(self.spans(self.lexer.stream(io.StringIO(self.text), size, 2)), expected)
+            self.assertEqual(self.spans(self.lexer.stream(io.BytesIO(self.text.encode()), size, 2)), expected)
+
+    def test_lazy(self):
+        tokens = self.lexer.stream(io.StringIO("abc 1 ?"), 2, 2)
+        self.assertEqual(tuple(next(tokens)), ("ID", "abc"))
+        self.assertEqual(tuple(next(tokens)), ("NUM", "1"))
+        self.assertRaises(CFGException, lambda: next(tokens))
+
+    def test_long_token(self):
+        # the string is longer than both a chunk and the margin, so it only matches once it has all been read
+        lexer = Lexer(Grammar([
+            "S -> S STR | STR | S ID | ID",
+        ]), {"STR": "'[^']*'", "ID": "[a-z]+"})
+        text = "ab '" + "x" * 1000 + "'\ncd"
+        expected = self.spans(lexer.scan(text))
+        self.assertEqual([t[0] for t in expected], ["ID", "STR", "ID"])
+        for size, margin in ((300, 256), (7, 0)):
+            self.assertEqual(self.spans(lexer.stream(io.StringIO(text), size, margin)), expected)
+            self.assertEqual(self.spans(lexer.stream(io.BytesIO(text.encode()), size, margin)), expected)
+        self.assertRaises(CFGException, lambda: list(lexer.stream(io.StringIO("ab '" + "x" * 1000), 300, 256)))
+
+        # spaces inside the string do not stop it from being held back until it is complete
+        text = "; " * 5 + "'" + "word " * 20 + "' ;"
+        lexer = Lexer(Grammar([
+            "S -> S STR | STR | S ; | ;",
+        ]), {"STR": "'[^']*'"})
+        expected = self.spans(lexer.scan(text))
+        self.assertEqual([t[0] for t in expected], [";"] * 5 + ["STR", ";"])
+        for size in (8, 16, 32, 64):
+            self.assertEqual(self.spans(lexer.stream(io.StringIO(text), size, 8)), expected)
+            self.assertEqual(self.spans(lexer.stream(io.BytesIO(text.encode()), size, 8)), expected)
+        # but only up to max_token
+        self.assertRaises(CFGException, lambda: list(lexer.stream(io.StringIO(text), 8, 8, 64)))
+
+    def test_invalid_stops_early(self):
+        # an invalid token at the start has to be reported without reading the rest of the file
+        class Counting(io.StringIO):
+            reads = 0
+
+            def read(self, size=-1):
+                Counting.reads += 1
+                return super().read(size)
+
+        text = "? " + "abc 12 <= (x)\n" * 20000
+        self.assertRaisesRegex(CFGException, "line 1, column 0", lambda: list(self.lexer.stream(Counting(text), 1024, 16, 1024)))
+        self.assertLessEqual(Counting.reads, 2)
+
+    def test_mmap(self):
+        expected = self.spans(self.lexer.scan(self.text))
+        with tempfile.TemporaryFile() as f:
+            f.write(self.text.encode())
+            f.flush()
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                self.assertEqual(self.spans(self.lexer.stream(m)), expected)
+
+    def test_empty(self):
+        self.assertEqual(list(self.lexer.stream(io.StringIO(""))), [])
+        self.assertEqual(list(self.lexer.stream(io.StringIO(" \n "), 1, 1)), [])
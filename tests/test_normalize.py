@@ -0,0 +1,96 @@
+from grammar import CFGException, Grammar
+from normalize import augment, inline_single_use, merge_identical, normalize, remove_useless
+from parser import LR1Parser, ParseException, resolve_shift
+from main import CMINUS_RULES, CMINUS_SOURCE, CMINUS_SPECIALS
+import unittest
+
+
+class AugmentTest(unittest.TestCase):
+    def test_augment(self):
+        x = augment(Grammar([
+            "S -> a S | #",
+        ]))
+        self.assertEqual(x.start(), "S'")
+        self.assertEqual(x, Grammar([
+            "S' -> S",
+            "S -> a S | #",
+        ]))
+
+    def test_clash(self):
+        x = augment(Grammar([
+            "S -> S' b",
+            "S' -> a",
+        ]))
+        self.assertEqual(x.start(), "S''")
+        LR1Parser(Grammar([
+            "S -> S' b",
+            "S' -> a",
+        ]), resolve_shift).parse("ab")
+
+
+class PassTest(unittest.TestCase):
+    def test_remove_useless(self):
+        x = remove_useless(Grammar([
+            "S -> A b | B",
+            "A -> a",
+            "B -> b B",
+            "C -> c",
+        ]))
+        self.assertEqual(x, Grammar([
+            "S -> A b",
+            "A -> a",
+        ]))
+        self.assertRaises(CFGException, lambda: remove_useless(Grammar([
+            "S -> a S",
+        ])))
+
+    def test_inline_single_use(self):
+        x = inline_single_use(Grammar([
+            "S -> a A | B c",
+            "A -> b | #",
+            "B -> d B | C",
+            "C -> e",
+        ]))
+        # B uses itself, C is only used by B
+        self.assertEqual(x, Grammar([
+            "S -> a b | a | B c",
+            "B -> d B | e",
+        ]))
+
+    def test_merge_identical(self):
+        x = merge_identical(Grammar([
+            "S -> A x | B y",
+            "A -> a A | b",
+            "B -> a B | b",
+        ]))
+        self.assertEqual(x, Grammar([
+            "S -> A x | A y",
+            "A -> a A | b",
+        ]))
+
+
+class NormalizeTest(unittest.TestCase):
+    def test_cminus(self):
+        g = Grammar(CMINUS_RULES)
+        x, reports = normalize(g, measure=True)
+        self.assertEqual([r.name() for r in reports], ["remove_useless", "merge_identical", "inline_single_use"])
+        self.assertEqual(sum(r.states_saved() for r in reports), LR1Parser(g, resolve_shift).tables().num_states() - LR1Parser(x, resolve_shift).tables().num_states())
+        self.assertGreater(sum(r.entries_saved() for r in reports), 0)
+        LR1Parser(x, resolve_shift).parse(x.lex(CMINUS_SOURCE, CMINUS_SPECIALS))
+        self.assertRaises(ParseException, lambda: LR1Parser(x, resolve_shift).parse(x.lex(["int main(void) { return 0 }"], CMINUS_SPECIALS)))
+
+    def test_unmeasured(self):
+        x, reports = normalize(Grammar([
+            "S -> A",
+            "A -> a | b",
+            "B -> c",
+        ]))
+        self.assertEqual(x, Grammar([
+            "S -> a | b",
+        ]))
+        self.assertEqual([r.productions_saved() for r in reports], [1, 0, 1])
+        self.assertIsNone(reports[0].states_saved())
+
+
+if __name__ == '__main__':
+    unittest.main()
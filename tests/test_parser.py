@@ -1,5 +1,17 @@
-from grammar import Grammar
-from parser import LR1Parser, ParseException
+from grammar import CFGException, Grammar
+from lexer import Lexer
+from parser import ASTNode, EPSILON_TOKEN, Item, ItemCores, ItemException, LR1Parser, ParseErrors, ParseException, ParseHandler, parser_fingerprint, resolve_shift, resolve_throw
+from stats import ParseStats
+from tables import ParseTables, TableCache
+from main import CMINUS_RULES, CMINUS_SOURCE, CMINUS_SPECIALS
+from concurrent.futures import ProcessPoolExecutor
+from unittest import mock
+import functools
+import io
+import itertools
+import multiprocessing
+import os
+import tempfile
 import unittest
 
 class ParserTest(unittest.TestCase):
@@ -8,7 +20,7 @@ class ParserTest(unittest.TestCase):
             "S -> C C",
             "C -> e C | d",
         ])
-        y = LR1Parser(x)
+        y = LR1Parser(x, resolve_shift)
 
         y.parse("edeeed")
         y.parse("dd")
@@ -20,5 +32,469 @@ class ParserTest(unittest.TestCase):
             "E -> E + T | E",
             "T -> T x F | F"
         ])
-        y = LR1Parser(x)
+        y = LR1Parser(x, resolve_shift)
 
+
+
+class SessionTest(unittest.TestCase):
+    def setUp(self):
+        self.grammar = Grammar([
+            "S -> C C",
+            "C -> e C | d",
+        ])
+        self.parser = LR1Parser(self.grammar, resolve_shift)
+
+    def test_feed(self):
+        x = self.parser.session()
+        for c in "edeed":
+            self.assertFalse(x.done())
+            x.feed([(c, c)])
+        tree = x.finish()
+        self.assertTrue(x.done())
+        self.assertEqual(tree.sym(), "S")
+        self.assertEqual([c.sym() for c in tree.children()], ["C", "C"])
+        self.assertEqual([c.sym() for c in tree.children()[0].children()], ["e", "C"])
+
+    def test_early_error(self):
+        read = []
+
+        def tokens():
+            for c in "ddeee":
+                read.append(c)
+                yield (c, c)
+
+        x = self.parser.session()
+        self.assertRaises(ParseException, lambda: x.feed(tokens()))
+        self.assertEqual(read, ["d", "d", "e"])
+
+    def test_incomplete(self):
+        x = self.parser.session()
+        x.feed([("e", "e"), ("d", "d")])
+        self.assertRaises(ParseException, x.finish)
+
+
+class ParseModeTest(unittest.TestCase):
+    def setUp(self):
+        self.parser = LR1Parser(Grammar([
+            "S -> C C",
+            "C -> e C | d | ( A )",
+            "A -> A d | #",
+        ]), resolve_shift)
+
+    def test_recognize(self):
+        self.assertIs(self.parser.parse("ed(dd)", "recognize"), True)
+        self.assertRaises(ParseException, lambda: self.parser.parse("ed(", "recognize"))
+        self.assertRaises(ValueError, lambda: self.parser.session("fast"))
+
+    def test_compact(self):
+        for s in ("edd", "()ed", "(dd)(d)"):
+            tree = self.parser.parse(s)
+            compact = self.parser.parse(s, "compact")
+            self.assertEqual(compact.to_tree(), tree)
+
+    def test_compact_layout(self):
+        x = self.parser.parse("e()d", "compact")
+        self.assertEqual([x.name(i) for i in range(len(x))], ["e", "(", "#", "A", ")", "C", "C", "d", "C", "S"])
+        self.assertEqual(list(x.tokens()), [0, 1, -1, -1, 2, -1, -1, 3, -1, -1])
+        self.assertEqual(x.root(), 9)
+        self.assertEqual(x.children(x.root()), [6, 8])
+        self.assertEqual(x.children(6), [0, 5])
+        self.assertEqual(x.children(5), [1, 3, 4])
+
+
+class ActionTest(unittest.TestCase):
+    def setUp(self):
+        self.grammar = Grammar([
+            "E -> E + T | T",
+            "T -> T x F | F",
+            "F -> ( E ) | NUM",
+        ])
+        self.parser = LR1Parser(self.grammar, resolve_shift)
+        self.tokens = self.grammar.lex(["2 x (3 + 4) + 1"], {"NUM": "[0-9]+"})
+
+    def test_evaluate(self):
+        actions = {
+            "E -> E + T": lambda e, _, t: e + t,
+            "E -> T": lambda t: t,
+            ("T", ("T", "x", "F")): lambda t, _, f: t * f,
+            "T -> F": lambda f: f,
+            "F -> ( E )": lambda _, e, __: e,
+            "F -> NUM": lambda num: int(num[1]),
+        }
+        self.assertEqual(self.parser.parse(self.tokens, "actions", actions), 15)
+
+    def test_default_ast(self):
+        tree = self.parser.parse(self.grammar.lex(["1 + 2"], {"NUM": "[0-9]+"}), "actions", {"F -> NUM": lambda num: num[1]})
+        self.assertEqual(tree, ASTNode("E", [ASTNode("E", [ASTNode("T", ["1"])]), ("+", "+"), ASTNode("T", ["2"])]))
+
+    def test_unknown_production(self):
+        self.assertRaises(CFGException, lambda: self.parser.session("actions", {"E -> E x T": lambda *x: None}))
+        self.assertRaises(CFGException, lambda: self.parser.session("actions", {"E -> E | T": lambda *x: None}))
+
+    def test_events(self):
+        class Recorder(ParseHandler):
+            def __init__(self):
+                self.events = []
+
+            def shift(self, token):
+                self.events.append(token[0])
+
+            def reduce(self, nt, prod):
+                self.events.append(nt + " -> " + " ".join(prod))
+
+            def accept(self):
+                return self.events
+
+        x = LR1Parser(Grammar([
+            "S -> a A",
+            "A -> #",
+        ]), resolve_shift)
+        self.assertEqual(x.parse([("a", "a")], "events", handler=Recorder()), ["a", "#", "A -> #", "S -> a A"])
+        self.assertRaises(ValueError, lambda: x.session("events"))
+        self.assertEqual(EPSILON_TOKEN, ("#", ""))
+
+
+class RecoveryTest(unittest.TestCase):
+    def setUp(self):
+        self.grammar = Grammar(CMINUS_RULES)
+        self.parser = LR1Parser(self.grammar, resolve_shift)
+        self.lexer = Lexer(self.grammar, CMINUS_SPECIALS)
+        self.source = "int f(void) {\n  x = 1 + ;\n  return 3 3;\n}\nint g(void) { return 0 }\n"
+
+    def test_all_errors(self):
+        with self.assertRaises(ParseErrors) as cm:
+            self.parser.parse(self.lexer.scan(self.source), sync=[";", "}"])
+        errors = cm.exception.errors()
+        self.assertEqual([(d.token().line(), d.token().col(), d.terminal()) for d in errors], [(2, 10, ";"), (3, 11, "NUM"), (5, 23, "}")])
+        self.assertIn("ADDOP", errors[1].expected())
+        self.assertEqual(cm.exception.result().sym(), "program")
+
+    def test_modes_agree(self):
+        results = {}
+        for mode in ("tree", "compact", "recognize"):
+            try:
+                self.parser.parse(self.lexer.scan(self.source), mode, sync=[";", "}"])
+            except ParseErrors as e:
+                results[mode] = e.result()
+        self.assertEqual(results["compact"].to_tree(), results["tree"])
+        self.assertIs(results["recognize"], True)
+
+    def test_unrecoverable(self):
+        session = self.parser.session(sync=[";"])
+        session.feed(self.grammar.lex(["int f(void) { x = 1"], CMINUS_SPECIALS))
+        self.assertRaises(ParseErrors, session.finish)
+        self.assertEqual(str(session.errors()[0]), "token 9: unexpected end of input, expected one of ;, ADDOP, MULOP, RELOP")
+
+    def test_no_recovery(self):
+        with self.assertRaises(ParseException) as cm:
+            self.parser.parse(self.lexer.scan(self.source))
+        self.assertNotIsInstance(cm.exception, ParseErrors)
+        session = self.parser.session()
+        self.assertRaises(ParseException, lambda: session.feed(self.lexer.scan(self.source)))
+        self.assertEqual(session.errors(), [])
+
+
+class TablesTest(unittest.TestCase):
+    def test_layout(self):
+        x = Grammar([
+            "S -> C C",
+            "C -> e C | d",
+        ])
+        y = LR1Parser(x, resolve_shift).tables()
+        self.assertEqual(y.productions()[0], ("S'", ("S",)))
+        self.assertEqual(set(y.terminals()), {"$", "d", "e"})
+        self.assertEqual(y.nonterms()[0], "S'")
+        self.assertEqual(len(y.action()), y.num_states() * len(y.terminals()))
+        self.assertEqual(len(y.goto()), y.num_states() * len(y.nonterms()))
+        self.assertEqual(list(y.prod_len()), [len(prod) for _, prod in y.productions()])
+
+    def test_entries(self):
+        x = Grammar([
+            "S -> C C",
+            "C -> e C | d",
+        ])
+        y = LR1Parser(x, resolve_shift)
+        tables = y.tables()
+        nt = len(tables.terminals())
+        nn = len(tables.nonterms())
+        for state, itemset in enumerate(y.item_sets()):
+            for char, (target, _) in itemset.shift().items():
+                if char in tables.nonterm_ids():
+                    self.assertEqual(tables.goto()[state * nn + tables.nonterm_ids()[char]], target)
+                else:
+                    self.assertEqual(tables.action()[state * nt + tables.term_ids()[char]], target + 1)
+            for char, item in itemset.reduce().items():
+                p = -tables.action()[state * nt + tables.term_ids()[char]] - 1
+                self.assertEqual(tables.productions()[p], (item.nt(), tuple(item.prod())))
+
+
+class CacheTest(unittest.TestCase):
+    def setUp(self):
+        self.grammar = Grammar([
+            "S -> C C",
+            "C -> e C | d",
+        ])
+        self.dir = tempfile.TemporaryDirectory()
+        self.cache = TableCache(self.dir.name)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_roundtrip(self):
+        x = LR1Parser(self.grammar, resolve_shift).tables()
+        buf = io.BytesIO()
+        x.dump(buf, "ab" * 32)
+        self.assertEqual(ParseTables.load(buf.getvalue(), "ab" * 32), x)
+        self.assertRaises(ValueError, lambda: ParseTables.load(buf.getvalue(), "cd" * 32))
+        self.assertRaises(ValueError, lambda: ParseTables.load(buf.getvalue()[:-4], "ab" * 32))
+
+    def test_cache(self):
+        x = LR1Parser(self.grammar, resolve_shift, self.cache)
+        key = parser_fingerprint(self.grammar, resolve_shift)
+        self.assertTrue(os.path.exists(self.cache.path(key)))
+        y = LR1Parser(self.grammar, resolve_shift, self.cache)
+        self.assertEqual(x.tables(), y.tables())
+        y.parse("edeeed")
+        self.assertRaises(ParseException, lambda: y.parse("edede"))
+
+    def test_fingerprint(self):
+        self.assertNotEqual(parser_fingerprint(self.grammar, resolve_shift), parser_fingerprint(self.grammar, resolve_throw))
+
+    def test_lambdas(self):
+        first = lambda i1, i2: i1
+        second = lambda i1, i2: i2
+        self.assertNotEqual(parser_fingerprint(self.grammar, first), parser_fingerprint(self.grammar, second))
+        self.assertEqual(parser_fingerprint(self.grammar, first), parser_fingerprint(self.grammar, lambda i1, i2: i1))
+
+        x = Grammar([
+            "S -> A | B",
+            "A -> a",
+            "B -> a",
+        ])
+        LR1Parser(x, first, self.cache)
+        # a cached table for the first lambda must not be reused for the second
+        y = LR1Parser(x, second, self.cache)
+        self.assertEqual(y.parse("a").children()[0].sym(), "B")
+
+    def test_uncacheable(self):
+        resolvers = [resolve_shift]
+        LR1Parser(self.grammar, lambda i1, i2: resolvers[0](i1, i2), self.cache)
+        self.assertEqual(os.listdir(self.dir.name), [])
+
+    def test_corrupt(self):
+        key = parser_fingerprint(self.grammar, resolve_shift)
+        with open(self.cache.path(key), "wb") as f:
+            f.write(b"garbage")
+        self.assertIsNone(self.cache.load(key))
+        LR1Parser(self.grammar, resolve_shift, self.cache).parse("dd")
+        self.assertIsNotNone(self.cache.load(key))
+
+
+class ModeTest(unittest.TestCase):
+    def test_lalr(self):
+        x = Grammar([
+            "S -> C C",
+            "C -> e C | d",
+        ])
+        lr1 = LR1Parser(x, resolve_throw)
+        lalr = LR1Parser(x, resolve_throw, mode="lalr")
+        self.assertLess(lalr.tables().num_states(), lr1.tables().num_states())
+        for s in ("edeeed", "dd", "ded"):
+            lalr.parse(s)
+        for s in ("d", "edede", "dde"):
+            self.assertRaises(ParseException, lambda: lalr.parse(s))
+
+    def test_minimal(self):
+        # LR(1) but not LALR(1): merging the two states for "c ." makes A and B reduce on the same lookaheads
+        x = Grammar([
+            "S -> a A d | b B d | a B e | b A e",
+            "A -> c",
+            "B -> c",
+        ])
+        self.assertRaises(ItemException, lambda: LR1Parser(x, resolve_throw, mode="lalr"))
+        lr1 = LR1Parser(x, resolve_throw)
+        minimal = LR1Parser(x, resolve_throw, mode="minimal")
+        self.assertLessEqual(minimal.tables().num_states(), lr1.tables().num_states())
+        for s in ("acd", "bcd", "ace", "bce"):
+            minimal.parse(s)
+        self.assertRaises(ParseException, lambda: minimal.parse("acc"))
+
+    def test_epsilon_loop(self):
+        # merging gives "B -> # ." the lookahead c, so on c the merged states could shift "#" and reduce B forever
+        x = Grammar([
+            "A -> a a | B C c",
+            "B -> #",
+            "C -> A b B | b",
+        ])
+        lr1 = LR1Parser(x, resolve_throw)
+        for mode in ("lalr", "minimal"):
+            y = LR1Parser(x, resolve_throw, mode=mode)
+            # every mode accepts the same short inputs
+            for n in range(1, 5):
+                for s in itertools.product("abc", repeat=n):
+                    s = " ".join(s)
+                    if s in ("a a", "b c"):
+                        self.assertEqual(y.parse(s), lr1.parse(s))
+                    else:
+                        self.assertRaises(ParseException, lambda: lr1.parse(s))
+                        self.assertRaises(ParseException, lambda: y.parse(s))
+            self.assertRaises(ParseErrors, lambda: y.parse("c b c", sync=["c"]))
+        # "minimal" keeps the states that would loop apart, so it finds the error in the same state as "lr1"
+        with self.assertRaises(ParseException) as e:
+            LR1Parser(x, resolve_throw, mode="minimal").parse("c")
+        self.assertEqual(str(e.exception), "No transition defined at state 4 for symbol c")
+
+    def test_unknown(self):
+        x = Grammar([
+            "S -> a",
+        ])
+        self.assertRaises(ValueError, lambda: LR1Parser(x, resolve_shift, mode="slr"))
+
+
+class LazyTest(unittest.TestCase):
+    def setUp(self):
+        self.grammar = Grammar(CMINUS_RULES)
+        self.tokens = self.grammar.lex(CMINUS_SOURCE, CMINUS_SPECIALS)
+
+    def test_on_demand(self):
+        x = LR1Parser(self.grammar, resolve_shift, mode="lazy")
+        self.assertEqual(x.tables().num_expanded(), 1)
+        self.assertEqual(x.parse(self.tokens), LR1Parser(self.grammar, resolve_shift).parse(self.tokens))
+        built = x.tables().num_expanded()
+        self.assertLess(built, 302)
+        # the same input does not need any more states
+        x.parse(self.tokens, "compact")
+        self.assertEqual(x.tables().num_expanded(), built)
+
+    def test_warm_up(self):
+        x = LR1Parser(self.grammar, resolve_shift, mode="lazy", warmup=[self.tokens, "int"])
+        built = x.tables().num_expanded()
+        self.assertGreater(built, 1)
+        x.parse(self.tokens, "recognize")
+        self.assertEqual(x.tables().num_expanded(), built)
+
+    def test_conflicts(self):
+        # conflicts are only found once a parse reaches them, and warming up does not hide them
+        grammar = Grammar(["S -> a A | b B", "A -> x", "B -> B + B | x"])
+        x = LR1Parser(grammar, resolve_throw, mode="lazy")
+        self.assertTrue(x.parse("a x", "recognize"))
+        for _ in range(2):
+            self.assertRaises(ItemException, lambda: x.parse("b x + x", "recognize"))
+        self.assertRaises(ItemException, lambda: x.warm_up(["b x + x"]))
+        self.assertRaises(ItemException, lambda: LR1Parser(grammar, resolve_throw, mode="lazy", warmup=["a x", "b x + x"]))
+
+    def test_errors(self):
+        bad = self.grammar.lex(["int x ( void ) { return 0 } int y ;"], CMINUS_SPECIALS)
+        with self.assertRaises(ParseErrors) as lr1:
+            LR1Parser(self.grammar, resolve_shift).parse(bad, sync=[";", "}"])
+        with self.assertRaises(ParseErrors) as lazy:
+            LR1Parser(self.grammar, resolve_shift, mode="lazy").parse(bad, sync=[";", "}"])
+        # the states are numbered differently, but the errors are found in the same places
+        self.assertEqual([(e.index(), e.terminal(), e.expected()) for e in lazy.exception.errors()],
+                         [(e.index(), e.terminal(), e.expected()) for e in lr1.exception.errors()])
+
+    def test_stats(self):
+        x = LR1Parser(Grammar([
+            "S -> a S b | #",
+        ]), resolve_shift, mode="lazy")
+        stats = ParseStats()
+        x.parse([("a", "a"), ("b", "b")], stats=stats)
+        self.assertEqual(len(stats.state_hits()), x.tables().num_states())
+
+        lazy, eager = ParseStats(), ParseStats()
+        LR1Parser(self.grammar, resolve_shift, mode="lazy").parse(self.tokens, stats=lazy)
+        LR1Parser(self.grammar, resolve_shift).parse(self.tokens, stats=eager)
+        # building a state does not count as using it
+        self.assertEqual(sum(lazy.state_hits()), sum(eager.state_hits()))
+        self.assertEqual({k: v for k, v in lazy.to_dict().items() if k != "state_hits"},
+                         {k: v for k, v in eager.to_dict().items() if k != "state_hits"})
+
+    def test_complete(self):
+        x = LR1Parser(self.grammar, resolve_shift, mode="lazy")
+        self.assertEqual(len(x.item_sets()), 302)
+        self.assertEqual(x.tables().num_expanded(), 302)
+        buf = io.BytesIO()
+        x.tables().dump(buf, x.fingerprint())
+        y = ParseTables.load(buf.getvalue(), x.fingerprint())
+        self.assertEqual(y, x.tables())
+
+
+class ItemCoresTest(unittest.TestCase):
+    def setUp(self):
+        self.grammar = Grammar([
+            "S' -> S",
+            "S -> C C",
+            "C -> e C | d",
+        ])
+        self.cores = ItemCores(self.grammar)
+
+    def test_numbering(self):
+        x = self.cores
+        self.assertEqual(x.productions()[0], ("S'", ("S",)))
+        c = x.core("C", ("e", "C"), 0)
+        self.assertEqual(x.symbol(c), "e")
+        self.assertEqual(x.symbol(c + 1), "C")
+        self.assertIsNone(x.symbol(c + 2))
+        self.assertEqual(x.dotpos(c + 2), 2)
+        self.assertEqual(x.productions()[x.production(c + 2)], ("C", ("e", "C")))
+
+    def test_closure(self):
+        x = self.cores
+        bits = x.bits()
+        start = Item(x, x.core("S'", ("S",), 0), bits.bit("$"))
+        closed = start.closure()
+        # each core appears once, with the lookaheads of every way of reaching it merged
+        self.assertEqual(len(closed), len({i.core() for i in closed}))
+        by_core = {(i.nt(), i.prod(), i.dotpos()): i.follow() for i in closed}
+        self.assertEqual(by_core, {
+            ("S'", ("S",), 0): {"$"},
+            ("S", ("C", "C"), 0): {"$"},
+            ("C", ("e", "C"), 0): {"e", "d"},
+            ("C", ("d",), 0): {"e", "d"},
+        })
+        self.assertEqual(closed[0], start)
+
+
+class GenerateTest(unittest.TestCase):
+    def test_cminus(self):
+        x = Grammar(CMINUS_RULES)
+        y = LR1Parser(x, resolve_shift)
+        # both branches of the if shift on "}", which used to corrupt the state after it
+        y.parse(x.lex(CMINUS_SOURCE, CMINUS_SPECIALS))
+        self.assertEqual(y.tables(), LR1Parser(x, resolve_shift).tables())
+
+    def test_unique_kernels(self):
+        x = Grammar(CMINUS_RULES)
+        y = LR1Parser(x, resolve_shift)
+        kernels = set()
+        for itemset in y.item_sets()[1:]:
+            kernel = frozenset((i.core(), i.follow_mask()) for i in itemset if i.dotpos() > 0)
+            self.assertNotIn(kernel, kernels)
+            kernels.add(kernel)
+
+    def test_workers(self):
+        x = Grammar(CMINUS_RULES)
+        for mode in ("lr1", "lalr"):
+            y = LR1Parser(x, resolve_shift, mode=mode)
+            z = LR1Parser(x, resolve_shift, mode=mode, workers=2)
+            # the states are numbered the same, not just equivalent
+            self.assertEqual(z.tables(), y.tables())
+            self.assertEqual([str(s) for s in z.item_sets()], [str(s) for s in y.item_sets()])
+            z.parse(x.lex(CMINUS_SOURCE, CMINUS_SPECIALS))
+
+    def test_workers_conflict(self):
+        x = Grammar([
+            "S -> A a | B a",
+            "A -> c",
+            "B -> c",
+        ])
+        self.assertRaises(ItemException, lambda: LR1Parser(x, resolve_throw, workers=2))
+
+    def test_workers_spawn(self):
+        # spawned workers get nothing from the parent but what is pickled
+        x = Grammar(CMINUS_RULES)
+        y = LR1Parser(x, resolve_shift)
+        spawn = functools.partial(ProcessPoolExecutor, mp_context=multiprocessing.get_context("spawn"))
+        with mock.patch("parser.ProcessPoolExecutor", spawn):
+            z = LR1Parser(x, resolve_shift, workers=2)
+        self.assertEqual(z.tables(), y.tables())
@@ -0,0 +1,72 @@
+from grammar import Grammar
+from parser import LR1Parser, ParseException, resolve_shift
+from stats import BuildStats, ParseStats
+from main import CMINUS_RULES, CMINUS_SOURCE, CMINUS_SPECIALS
+import json
+import unittest
+
+
+class BuildStatsTest(unittest.TestCase):
+    def test_build(self):
+        stats = BuildStats()
+        x = LR1Parser(Grammar(CMINUS_RULES), resolve_shift, stats=stats)
+        self.assertEqual(set(stats.phases()), {"augment", "cores", "generate", "tables"})
+        self.assertEqual(stats.counters()["states"], x.tables().num_states())
+        self.assertEqual(stats.counters()["closures"], x.tables().num_states())
+        self.assertEqual(stats.counters()["transitions"], stats.counters()["kernel_hits"] + x.tables().num_states() - 1)
+        # the dangling else is the one conflict
+        self.assertGreater(stats.counters()["conflicts"], 0)
+        self.assertEqual(len(stats.items_per_state()), x.tables().num_states())
+        self.assertEqual(x.tables(), LR1Parser(Grammar(CMINUS_RULES), resolve_shift).tables())
+
+    def test_merge(self):
+        stats = BuildStats()
+        x = LR1Parser(Grammar(CMINUS_RULES), resolve_shift, stats=stats, mode="lalr")
+        self.assertIn("merge", stats.phases())
+        self.assertEqual(stats.counters()["merged_states"], x.tables().num_states())
+        self.assertLess(stats.counters()["merged_states"], stats.counters()["states"])
+        d = json.loads(json.dumps(stats.to_dict()))
+        self.assertEqual(d["items_per_state"]["states"], x.tables().num_states())
+
+
+class ParseStatsTest(unittest.TestCase):
+    def test_counts(self):
+        x = LR1Parser(Grammar([
+            "S -> a S b | #",
+        ]), resolve_shift)
+        stats = ParseStats()
+        x.parse([("a", "a")] * 3 + [("b", "b")] * 3, stats=stats)
+        self.assertEqual(stats.shifts(), 6)
+        self.assertEqual(stats.epsilons(), 1)
+        # S -> a S b three times, S -> # once, and accepting
+        self.assertEqual(stats.reduces(), 5)
+        self.assertEqual(sum(stats.production_hits()), 5)
+        # the start state, a a a S b
+        self.assertEqual(stats.max_depth(), 6)
+        self.assertEqual(sum(stats.state_hits()), 12)
+
+    def test_modes_agree(self):
+        g = Grammar(CMINUS_RULES)
+        x = LR1Parser(g, resolve_shift)
+        tokens = g.lex(CMINUS_SOURCE, CMINUS_SPECIALS)
+        results = []
+        for mode in ("tree", "compact", "recognize"):
+            stats = ParseStats()
+            x.parse(tokens, mode, stats=stats)
+            results.append(stats.to_dict())
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(results[0], results[2])
+        self.assertEqual(results[0]["shifts"], len(tokens))
+
+    def test_error(self):
+        x = LR1Parser(Grammar([
+            "S -> a S b | #",
+        ]), resolve_shift)
+        stats = ParseStats()
+        self.assertRaises(ParseException, lambda: x.parse([("a", "a"), ("b", "b"), ("b", "b")], stats=stats))
+        # what was done before the error is still counted
+        self.assertEqual(stats.shifts(), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()